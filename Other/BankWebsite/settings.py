@@ -55,6 +55,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'banking.middleware.MetricsMiddleware',
+    'banking.middleware.RequestInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -88,11 +90,82 @@ WSGI_APPLICATION = 'BankWebsite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql switches to the production profile. Connections are
+# kept open for DB_CONN_MAX_AGE seconds and health-checked before reuse, so a
+# request does not pay a TCP and auth handshake. Every statement is cancelled
+# after DB_STATEMENT_TIMEOUT_MS.
+#
+# With DB_POOL=pgbouncer, DB_HOST/DB_PORT point at a PgBouncer in transaction
+# pooling mode. It rejects startup options and cannot keep server-side cursors
+# across transactions. So the statement timeout must be set on the database
+# role instead (ALTER ROLE ... SET statement_timeout), and .iterator() falls
+# back to client-side cursors.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DB_POOL = os.environ.get('DB_POOL', '')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'wekeza'),
+            'USER': os.environ.get('DB_USER', 'wekeza_app'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '6432' if DB_POOL == 'pgbouncer' else '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', '5')),
+                'application_name': 'wekeza-banking',
+            },
+        }
     }
+    if DB_POOL == 'pgbouncer':
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+    else:
+        DATABASES['default']['OPTIONS']['options'] = (
+            f"-c statement_timeout={int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '5000'))}"
+        )
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+    # Concurrency profile for branch-edge deployments with several tellers.
+    # WAL lets readers run while a write is in progress. synchronous=NORMAL
+    # is safe under WAL and avoids an fsync per commit. Writers wait up to
+    # SQLITE_BUSY_TIMEOUT seconds for the write lock, which posting
+    # transactions take at BEGIN (BEGIN IMMEDIATE, see banking/posting.py),
+    # before the posting retry (WEKEZA_POSTING_RETRY) takes over.
+    if os.environ.get('SQLITE_TUNING', 'True') == 'True':
+        DATABASES['default']['OPTIONS'] = {
+            'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', '5')),
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))};"
+            ),
+        }
+
+# Read replicas: DB_REPLICAS is a comma-separated list of replica hosts (or
+# database files for SQLite), added as aliases replica1, replica2, ...
+# Safe-method API reads are routed to them by banking/routing.py; a user's
+# reads stay on the primary for DB_STICKY_SECONDS after one of their writes.
+DB_REPLICAS = [name for name in os.environ.get('DB_REPLICAS', '').split(',') if name]
+for _index, _name in enumerate(DB_REPLICAS, 1):
+    DATABASES[f'replica{_index}'] = {
+        **DATABASES['default'],
+        'HOST' if DB_ENGINE == 'postgresql' else 'NAME': _name,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['banking.routing.ReplicaRouter']
+
+WEKEZA_DB_ROUTING = {
+    'REPLICAS': [f'replica{index}' for index in range(1, len(DB_REPLICAS) + 1)],
+    'STICKY_SECONDS': int(os.environ.get('DB_STICKY_SECONDS', '5')),
 }
 
 
@@ -138,11 +211,31 @@ MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 # CORS Settings
+from corsheaders.defaults import default_headers
+
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 # REST Framework Settings
+# JSON encoding for the API: 'orjson' (banking/renderers.py) or 'json' for
+# DRF's stdlib renderer and parser. Internal services can negotiate
+# MessagePack (application/msgpack) instead
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson')
+
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'banking.renderers.ORJSONRenderer' if JSON_BACKEND == 'orjson' else 'rest_framework.renderers.JSONRenderer',
+        'banking.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'banking.renderers.ORJSONParser' if JSON_BACKEND == 'orjson' else 'rest_framework.parsers.JSONParser',
+        'banking.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
@@ -154,6 +247,106 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
 }
 
+# Group-commit mode for deposits: postings are gathered for WINDOW_MS and
+# written together (see banking/group_commit.py)
+WEKEZA_GROUP_COMMIT = {
+    'ENABLED': os.environ.get('GROUP_COMMIT_ENABLED', 'False') == 'True',
+    'WINDOW_MS': int(os.environ.get('GROUP_COMMIT_WINDOW_MS', '5')),
+    'MAX_BATCH': int(os.environ.get('GROUP_COMMIT_MAX_BATCH', '500')),
+}
+
+# Transaction/customer ID generator (see banking/ids.py). With the default
+# snowflake backend, ID_NODE_ID (0-255) must be set to a value unique per host
+# or container; only DEBUG runs default to 0. Startup fails without it.
+WEKEZA_ID_GENERATOR = {
+    'BACKEND': os.environ.get('ID_GENERATOR_BACKEND', 'banking.ids.SnowflakeGenerator'),
+    'OPTIONS': {
+        'node_id': os.environ.get('ID_NODE_ID', '0' if DEBUG else None),
+        'block_size': int(os.environ.get('ID_BLOCK_SIZE', '1000')),
+    },
+}
+
+# Posting transactions that fail on a lock conflict are re-run up to ATTEMPTS
+# times, sleeping a random 0..min(MAX_DELAY, BASE_DELAY * 2**n) seconds
+# between attempts (see banking/posting.py)
+WEKEZA_POSTING_RETRY = {
+    'ATTEMPTS': int(os.environ.get('POSTING_RETRY_ATTEMPTS', '5')),
+    'BASE_DELAY': 0.01,
+    'MAX_DELAY': 0.5,
+}
+
+# Account lookups on the posting hot path (banking/account_cache.py): an
+# in-process LRU of LOCAL_SIZE entries kept LOCAL_TTL seconds, backed by the
+# shared cache for SHARED_TTL seconds
+WEKEZA_ACCOUNT_CACHE = {
+    'ENABLED': os.environ.get('ACCOUNT_CACHE_ENABLED', 'True') == 'True',
+    'LOCAL_SIZE': 10000,
+    'LOCAL_TTL': 30,
+    'SHARED_TTL': 300,
+}
+
+# Batch-transfer files (banking/batch_transfers.py): posted CHUNK_SIZE credits
+# per transaction, in a background thread unless BACKGROUND is off. Run
+# process_transfer_batches to finish batches interrupted by a restart.
+WEKEZA_TRANSFER_BATCH = {
+    'BACKGROUND': os.environ.get('TRANSFER_BATCH_BACKGROUND', 'True') == 'True',
+    'CHUNK_SIZE': int(os.environ.get('TRANSFER_BATCH_CHUNK_SIZE', '1000')),
+    'MAX_LINES': int(os.environ.get('TRANSFER_BATCH_MAX_LINES', '50000')),
+}
+
+# Idempotency-Key handling for money-moving actions (banking/idempotency.py).
+# Keys are replayable for TTL_HOURS; purge_idempotency_keys deletes older ones.
+WEKEZA_IDEMPOTENCY = {
+    'TTL_HOURS': int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24')),
+    'WAIT_TIMEOUT': float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', '10')),
+}
+
+# Per-request instrumentation (banking/middleware.py). Budgets are keyed by URL
+# name, e.g. 'transaction-deposit' or 'account-statement'; 'default' applies to
+# every route without its own entry.
+WEKEZA_PERF = {
+    'SERVER_TIMING': os.environ.get('SERVER_TIMING', 'True') == 'True',
+    'MAX_CAPTURED_SQL': 200,
+    'BUDGETS': {
+        'default': {'queries': 50, 'db_ms': 250, 'total_ms': 1000},
+        'transaction-deposit': {'queries': 10, 'db_ms': 50},
+        'transaction-withdraw': {'queries': 10, 'db_ms': 50},
+        'transaction-transfer': {'queries': 12, 'db_ms': 80},
+        'account-balance': {'queries': 5, 'db_ms': 20},
+        'account-balances': {'queries': 5, 'db_ms': 30},
+        'account-statement': {'queries': 8, 'db_ms': 100},
+    },
+    # Extra queries allowed when an Idempotency-Key is sent: claiming the key
+    # (with its savepoint) and storing the response
+    'IDEMPOTENCY_KEY_QUERIES': 6,
+}
+
+# Metrics scraped from /metrics/ (banking/metrics.py). Under gunicorn, point
+# METRICS_MULTIPROC_DIR at an empty directory shared by all workers.
+WEKEZA_METRICS = {
+    'MULTIPROCESS_DIR': os.environ.get('METRICS_MULTIPROC_DIR'),
+    'FLUSH_INTERVAL': float(os.environ.get('METRICS_FLUSH_INTERVAL', '1.0')),
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # One JSON line per request at INFO; budget overruns at WARNING
+        'banking.perf': {
+            'handlers': ['console'],
+            'level': os.environ.get('PERF_LOG_LEVEL', 'WARNING' if DEBUG else 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # JWT Settings
 from datetime import timedelta
 
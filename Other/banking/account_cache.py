@@ -0,0 +1,161 @@
+"""
+Cached account lookup by account number for the posting hot path.
+
+lookup() returns an AccountRef: the parts of an account that never or rarely
+change (primary key, currency, status, customer, stripe count). It checks an
+in-process LRU first, then the shared Django cache, then the database. With
+the primary key known, a deposit or withdrawal becomes one
+``UPDATE ... RETURNING`` instead of a locking SELECT followed by an UPDATE
+(see banking/posting.py).
+
+Cached status is only a hint. A posting goes on the fast path only when the
+cached status is ACTIVE, and the UPDATE itself requires ``status = 'ACTIVE'``
+in its WHERE clause. So a stale entry can never let a FROZEN or CLOSED
+account post. A stale entry can only send a posting down the slow path, which
+re-reads the row under lock.
+
+Entries are dropped when an Account is saved or deleted (post_save and
+post_delete signals), under its previous number too when a save renames it
+(read in pre_save), and by code that changes accounts with queryset
+``update()``. Other processes' LRUs are not told, so their entries also expire
+after LOCAL_TTL seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Account
+
+DEFAULTS = {
+    'ENABLED': True,
+    'LOCAL_SIZE': 10000,
+    'LOCAL_TTL': 30,
+    'SHARED_TTL': 300,
+}
+
+FIELDS = ('pk', 'account_number', 'currency', 'status', 'customer_id', 'stripe_count')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'WEKEZA_ACCOUNT_CACHE', {})}
+
+
+@dataclass(frozen=True)
+class AccountRef:
+    pk: int
+    account_number: str
+    currency: str
+    status: str
+    customer_id: int
+    stripe_count: int
+
+    @property
+    def fast_path(self):
+        """Whether postings may use the single-statement path (see banking/posting.py)."""
+        return self.status == 'ACTIVE' and self.stripe_count <= 1
+
+    def as_account(self, **values):
+        """An unsaved Account carrying these fields, for ledger rows and serializers."""
+        return Account(
+            pk=self.pk, account_number=self.account_number, currency=self.currency, status=self.status,
+            customer_id=self.customer_id, stripe_count=self.stripe_count, **values,
+        )
+
+
+class _LocalCache:
+    """Thread-safe LRU with a per-entry time to live."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            ref, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return ref
+
+    def set(self, key, ref, ttl, size):
+        with self._lock:
+            self._entries[key] = (ref, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local = _LocalCache()
+
+
+def _shared_key(account_number):
+    return f'banking:account:{account_number}'
+
+
+def lookup(account_number):
+    """The AccountRef for ``account_number``, or None if there is no such account (or caching is off)."""
+    config = get_config()
+    if not config['ENABLED'] or not isinstance(account_number, str):
+        return None
+
+    ref = _local.get(account_number)
+    if ref is not None:
+        return ref
+
+    values = cache.get(_shared_key(account_number))
+    if values is None:
+        values = Account.objects.filter(account_number=account_number).values_list(*FIELDS).first()
+        if values is None:
+            return None
+        cache.set(_shared_key(account_number), values, config['SHARED_TTL'])
+
+    ref = AccountRef(*values)
+    _local.set(account_number, ref, config['LOCAL_TTL'], config['LOCAL_SIZE'])
+    return ref
+
+
+def invalidate(account_number):
+    _local.delete(account_number)
+    cache.delete(_shared_key(account_number))
+
+
+def clear_local():
+    _local.clear()
+
+
+@receiver(pre_save, sender=Account)
+def _account_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    # A renamed account must also leave the cache under its old number
+    instance._previous_account_number = None
+    if raw or instance.pk is None or (update_fields is not None and 'account_number' not in update_fields):
+        return
+    instance._previous_account_number = (
+        Account.objects.filter(pk=instance.pk).values_list('account_number', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def _account_changed(sender, instance, **kwargs):
+    invalidate(instance.account_number)
+    previous = getattr(instance, '_previous_account_number', None)
+    if previous is not None and previous != instance.account_number:
+        invalidate(previous)
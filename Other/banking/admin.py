@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Customer, Account, Transaction, Loan, Card, LoanPayment
+from .models import Customer, Account, Transaction, Loan, Card, LoanPayment, FeeSchedule, TransferBatch
 
 
 @admin.register(Customer)
@@ -51,3 +51,21 @@ class LoanPaymentAdmin(admin.ModelAdmin):
     search_fields = ['payment_id', 'loan__loan_id']
     readonly_fields = ['payment_id', 'payment_date']
     date_hierarchy = 'payment_date'
+
+
+@admin.register(FeeSchedule)
+class FeeScheduleAdmin(admin.ModelAdmin):
+    list_display = ['name', 'fee_type', 'account_type', 'amount', 'currency', 'minimum_balance', 'is_active']
+    list_filter = ['fee_type', 'account_type', 'currency', 'is_active']
+    search_fields = ['name']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(TransferBatch)
+class TransferBatchAdmin(admin.ModelAdmin):
+    list_display = ['batch_id', 'source_account', 'status', 'total_lines', 'processed_lines', 'total_amount', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['batch_id', 'source_account__account_number']
+    readonly_fields = ['batch_id', 'funding_transaction', 'created_at', 'completed_at']
+    raw_id_fields = ['source_account', 'submitted_by']
+    date_hierarchy = 'created_at'
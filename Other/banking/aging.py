@@ -0,0 +1,140 @@
+"""
+Nightly loan delinquency aging.
+
+build_loan_aging() reads every disbursed, active or defaulted loan with one
+aggregated query: the loan's terms plus ``SUM`` of its LoanPayments up to the
+as-of day. It compares the payments with the installments that should have
+been paid by then (``monthly_payment`` times the due dates passed since
+``disbursement_date``). From the oldest installment the payments do not cover
+it derives the days past due, and from those the aging bucket. Results are
+upserted into LoanAging in chunks, one row per loan per day, so collections
+dashboards read the stored buckets. Finally one UPDATE moves loans
+DEFAULT_AFTER_DAYS or more past due to DEFAULTED.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .amortization import add_months
+from .models import Loan, LoanAging
+from .snapshots import day_bounds
+
+AGING_CHUNK_SIZE = 5000
+AGED_STATUSES = ('DISBURSED', 'ACTIVE', 'DEFAULTED')
+DEFAULT_AFTER_DAYS = 90
+ZERO = Decimal('0.00')
+
+# (minimum days past due, bucket), most overdue first
+BUCKETS = (
+    (90, 'DPD_90_PLUS'),
+    (60, 'DPD_60_89'),
+    (30, 'DPD_30_59'),
+    (1, 'DPD_1_29'),
+    (0, 'CURRENT'),
+)
+
+
+def bucket_for(days_past_due):
+    for threshold, bucket in BUCKETS:
+        if days_past_due >= threshold:
+            return bucket
+
+
+def installments_due(start, term_months, as_of):
+    """Number of the monthly due dates after ``start`` that fall on or before ``as_of``."""
+    months = (as_of.year - start.year) * 12 + as_of.month - start.month
+    if months > 0 and add_months(start, months) > as_of:
+        months -= 1
+    return max(0, min(months, term_months))
+
+
+def age_loan(start, term_months, monthly_payment, paid, as_of):
+    """Return ``(installments_due, expected_amount, arrears, days_past_due)`` for one loan."""
+    due = installments_due(start, term_months, as_of)
+    expected = monthly_payment * due
+    arrears = max(expected - paid, ZERO)
+    if not arrears:
+        return due, expected, arrears, 0
+    covered = int(paid // monthly_payment)
+    oldest_unpaid = add_months(start, covered + 1)
+    return due, expected, arrears, (as_of - oldest_unpaid).days
+
+
+def _write(rows):
+    LoanAging.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['loan', 'as_of'],
+        update_fields=['installments_due', 'expected_amount', 'paid_amount', 'arrears', 'days_past_due',
+                       'bucket', 'outstanding_balance', 'built_at'],
+    )
+
+
+def build_loan_aging(as_of, chunk_size=AGING_CHUNK_SIZE):
+    """Age every loan in AGED_STATUSES as of the end of ``as_of``; returns ``(aged, newly_defaulted)``."""
+    _, end = day_bounds(as_of)
+    loans = (
+        Loan.objects
+        .filter(status__in=AGED_STATUSES, disbursement_date__lt=end, monthly_payment__gt=0)
+        .annotate(paid=Coalesce(Sum('payments__amount', filter=Q(payments__payment_date__lt=end)), ZERO))
+        .order_by('pk')
+        .values_list('pk', 'disbursement_date', 'term_months', 'monthly_payment', 'outstanding_balance', 'paid')
+        .iterator(chunk_size=chunk_size)
+    )
+
+    aged = 0
+    rows = []
+    for pk, disbursed, term_months, monthly_payment, outstanding, paid in loans:
+        start = timezone.localtime(disbursed).date()
+        due, expected, arrears, days_past_due = age_loan(start, term_months, monthly_payment, paid, as_of)
+        rows.append(LoanAging(
+            loan_id=pk,
+            as_of=as_of,
+            installments_due=due,
+            expected_amount=expected,
+            paid_amount=paid,
+            arrears=arrears,
+            days_past_due=days_past_due,
+            bucket=bucket_for(days_past_due),
+            outstanding_balance=outstanding,
+        ))
+        if len(rows) >= chunk_size:
+            _write(rows)
+            aged += len(rows)
+            rows = []
+    if rows:
+        _write(rows)
+        aged += len(rows)
+
+    defaulted = Loan.objects.filter(
+        status__in=('DISBURSED', 'ACTIVE'),
+        aging__as_of=as_of,
+        aging__days_past_due__gte=DEFAULT_AFTER_DAYS,
+    ).update(status='DEFAULTED')
+    return aged, defaulted
+
+
+def bucket_summary(as_of=None):
+    """Loans, arrears and outstanding balance per bucket from the stored aging (latest day by default)."""
+    if as_of is None:
+        as_of = LoanAging.objects.aggregate(latest=Max('as_of'))['latest']
+    totals = {
+        row['bucket']: row
+        for row in LoanAging.objects.filter(as_of=as_of).values('bucket').annotate(
+            loans=Count('id'), arrears=Sum('arrears'), outstanding=Sum('outstanding_balance'),
+        )
+    }
+    return {
+        'as_of': as_of,
+        'buckets': [
+            {
+                'bucket': bucket,
+                'loans': totals.get(bucket, {}).get('loans', 0),
+                'arrears': totals.get(bucket, {}).get('arrears') or ZERO,
+                'outstanding': totals.get(bucket, {}).get('outstanding') or ZERO,
+            }
+            for _, bucket in reversed(BUCKETS)
+        ],
+    }
@@ -0,0 +1,273 @@
+"""
+Loan amortization schedules.
+
+monthly_payment() is the level-payment formula applied when a loan is
+approved. It works in Decimal and rounds half-up to the cent. Each
+installment's interest is ``round_half_up(balance x rate / 1200)`` (see
+installment_interest()). That is a 30/360 day count: a month is 30 days and
+repayments accrue interest between payments on the same basis (days_360() and
+accrued_interest()), so a payment made one month after the last is charged
+exactly the installment interest of the schedule. The principal is the payment
+minus that interest. The last installment takes whatever balance is left, so the loan closes at exactly
+zero. decimal_schedule() applies these rules to one loan and is the reference
+for everything else.
+
+The portfolio engine (build_schedules()) covers the whole book. It groups the
+scheduled loans by term and processes each group in chunks of loans. For each
+chunk it holds the schedule as ``(term x loans)`` arrays of integer cents and
+steps through the installments with NumPy operations across all loans at
+once. Payments are computed in float64 and recomputed with Decimal wherever
+the result lies within rounding distance of half a cent. Interest is computed
+in exact integer arithmetic. The arrays therefore equal decimal_schedule() to
+the cent.
+"""
+import calendar
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import groupby, islice
+
+import numpy as np
+from django.utils import timezone
+
+from .models import Loan
+from .posting import CENT
+
+AMORTIZATION_CHUNK_SIZE = 5000
+SCHEDULED_STATUSES = ('DISBURSED', 'ACTIVE')
+SCHEDULE_COLUMNS = ('loan_id', 'installment', 'due_date', 'payment', 'principal', 'interest', 'balance')
+
+# Loan rates have two decimals; the monthly rate is rate_bp / RATE_DIVISOR with rate_bp = rate x 100
+RATE_DIVISOR = 100 * 100 * 12
+
+# Float payments closer than this (relative) to half a cent are recomputed with Decimal
+_PAYMENT_TOLERANCE = 1e-11
+
+
+def monthly_payment(principal, annual_rate, term_months):
+    """Level monthly payment of a loan, rounded half-up to the cent."""
+    monthly_rate = annual_rate / 100 / 12
+    if monthly_rate > 0:
+        payment = (principal * monthly_rate * (1 + monthly_rate) ** term_months) / \
+                  ((1 + monthly_rate) ** term_months - 1)
+    else:
+        payment = principal / term_months
+    return payment.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def installment_interest(balance, annual_rate):
+    """One month's interest on ``balance``, rounded half-up to the cent."""
+    return (balance * annual_rate / 1200).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def days_360(start, end):
+    """Days from ``start`` to ``end`` (dates) under the 30E/360 day count."""
+    return (
+        360 * (end.year - start.year) + 30 * (end.month - start.month)
+        + min(end.day, 30) - min(start.day, 30)
+    )
+
+
+def accrued_interest(balance, annual_rate, days):
+    """Interest on ``balance`` over ``days`` 30/360 days, rounded half-up to the cent."""
+    return (balance * annual_rate * days / 36000).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def add_months(value, months):
+    """Move a date (or datetime) by ``months``, clamping the day to the end of the month."""
+    index = value.month - 1 + months
+    year, month = value.year + index // 12, index % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+
+def decimal_schedule(principal, annual_rate, term_months):
+    """
+    Schedule of one loan as ``(installment, payment, principal, interest,
+    balance)`` rows of Decimals; stops early if the loan is paid off.
+    """
+    payment = monthly_payment(principal, annual_rate, term_months)
+    balance = principal
+    rows = []
+    for installment in range(1, term_months + 1):
+        interest = installment_interest(balance, annual_rate)
+        principal_part = payment - interest
+        if installment == term_months or principal_part >= balance:
+            principal_part = balance
+        balance -= principal_part
+        rows.append((installment, principal_part + interest, principal_part, interest, balance))
+        if not balance:
+            break
+    return rows
+
+
+def _cents(values):
+    return [int(value * 100) for value in values]
+
+
+def _from_cents(value):
+    return Decimal(int(value)).scaleb(-2)
+
+
+def _int_dtype(principal_cents, rate_bp):
+    # Python ints (object arrays) when balance x rate could overflow int64
+    limit = np.iinfo(np.int64).max // 2 - RATE_DIVISOR
+    return np.int64 if max(principal_cents) * max(max(rate_bp), 1) <= limit else object
+
+
+def monthly_payments(principals, rates, term_months):
+    """Vectorized monthly_payment() for one term; returns the payments in cents."""
+    principal_cents = np.array(_cents(principals), dtype=np.float64)
+    monthly_rate = np.array(_cents(rates), dtype=np.float64) / RATE_DIVISOR
+    growth = (1 + monthly_rate) ** term_months
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw = np.where(
+            monthly_rate > 0,
+            principal_cents * monthly_rate * growth / (growth - 1),
+            principal_cents / term_months,
+        )
+
+    payments = np.floor(raw + 0.5).astype(np.int64).tolist()
+    fraction = raw - np.floor(raw)
+    near_half = np.abs(fraction - 0.5) <= _PAYMENT_TOLERANCE * np.maximum(raw, 1.0)
+    for index in np.flatnonzero(near_half):
+        payments[index] = int(monthly_payment(principals[index], rates[index], term_months) * 100)
+    return payments
+
+
+@dataclass
+class ScheduleBlock:
+    """Schedules of loans sharing one term; the arrays are cents, shaped (term, loans)."""
+    term: int
+    loans: list  # (loan pk, loan_id, schedule start date)
+    payment: np.ndarray
+    principal: np.ndarray
+    interest: np.ndarray
+    balance: np.ndarray
+
+
+def amortize(principals, rates, term_months):
+    """Build the schedules of loans sharing ``term_months`` as (payment, principal, interest, balance) arrays."""
+    principal_cents = _cents(principals)
+    rate_bp = _cents(rates)
+    dtype = _int_dtype(principal_cents, rate_bp)
+
+    level_payment = np.array(monthly_payments(principals, rates, term_months), dtype=dtype)
+    rate = np.array(rate_bp, dtype=dtype)
+    remaining = np.array(principal_cents, dtype=dtype)
+    shape = (term_months, len(principal_cents))
+    principal = np.zeros(shape, dtype=dtype)
+    interest = np.zeros(shape, dtype=dtype)
+    balance = np.zeros(shape, dtype=dtype)
+
+    for month in range(term_months):
+        # round_half_up(remaining * rate / RATE_DIVISOR), exactly
+        due = (remaining * rate * 2 + RATE_DIVISOR) // (2 * RATE_DIVISOR)
+        principal_part = level_payment - due
+        if month == term_months - 1:
+            principal_part = remaining
+        else:
+            principal_part = np.where(principal_part >= remaining, remaining, principal_part)
+        remaining = remaining - principal_part
+        principal[month] = principal_part
+        interest[month] = due
+        balance[month] = remaining
+
+    return principal + interest, principal, interest, balance
+
+
+def scheduled_loans():
+    return Loan.objects.filter(status__in=SCHEDULED_STATUSES)
+
+
+def _schedule_start(disbursed, approved, applied):
+    return timezone.localtime(disbursed or approved or applied).date()
+
+
+def build_schedules(loans=None, chunk_size=AMORTIZATION_CHUNK_SIZE):
+    """Yield a ScheduleBlock per chunk of ``loans`` (default: all scheduled loans) sharing a term."""
+    loans = scheduled_loans() if loans is None else loans
+    rows = (
+        loans.order_by('term_months', 'pk')
+        .values_list('term_months', 'pk', 'loan_id', 'principal_amount', 'interest_rate',
+                     'disbursement_date', 'approval_date', 'application_date')
+        .iterator(chunk_size=chunk_size)
+    )
+    for term, group in groupby(rows, key=lambda row: row[0]):
+        while True:
+            chunk = list(islice(group, chunk_size))
+            if not chunk:
+                break
+            payment, principal, interest, balance = amortize(
+                [row[3] for row in chunk], [row[4] for row in chunk], term,
+            )
+            yield ScheduleBlock(
+                term=term,
+                loans=[(row[1], row[2], _schedule_start(*row[5:])) for row in chunk],
+                payment=payment,
+                principal=principal,
+                interest=interest,
+                balance=balance,
+            )
+
+
+def schedule_rows(loans=None):
+    """Yield every installment of ``loans`` as a tuple in SCHEDULE_COLUMNS order (for exports)."""
+    for block in build_schedules(loans):
+        payment, principal = block.payment.T.tolist(), block.principal.T.tolist()
+        interest, balance = block.interest.T.tolist(), block.balance.T.tolist()
+        for index, (_, loan_id, start) in enumerate(block.loans):
+            for month in range(block.term):
+                if not payment[index][month]:
+                    break
+                yield (
+                    loan_id, month + 1, add_months(start, month + 1),
+                    _from_cents(payment[index][month]), _from_cents(principal[index][month]),
+                    _from_cents(interest[index][month]), _from_cents(balance[index][month]),
+                )
+
+
+def _month_ordinal(day):
+    return day.year * 12 + day.month - 1
+
+
+def project_portfolio(from_month, loans=None):
+    """
+    Scheduled principal and interest per calendar month for the installments
+    of ``loans`` falling due in ``from_month`` or later.
+    """
+    first = _month_ordinal(from_month)
+    totals = {}
+    count = 0
+    for block in build_schedules(loans):
+        count += len(block.loans)
+        starts = np.array([_month_ordinal(start) for _, _, start in block.loans])
+        due = starts[np.newaxis, :] + np.arange(1, block.term + 1)[:, np.newaxis]
+        mask = (due >= first) & (block.payment > 0)
+        offsets = due[mask] - first
+        if not offsets.size:
+            continue
+
+        sums = np.zeros((3, int(offsets.max()) + 1), dtype=block.principal.dtype)
+        np.add.at(sums[0], offsets, block.principal[mask])
+        np.add.at(sums[1], offsets, block.interest[mask])
+        np.add.at(sums[2], offsets, 1)
+        for offset in np.flatnonzero(sums[2]):
+            month = totals.setdefault(first + int(offset), [0, 0, 0])
+            for index in range(3):
+                month[index] += int(sums[index, offset])
+
+    months = [
+        {
+            'month': f"{ordinal // 12:04d}-{ordinal % 12 + 1:02d}",
+            'principal': _from_cents(principal),
+            'interest': _from_cents(interest),
+            'installments': installments,
+        }
+        for ordinal, (principal, interest, installments) in sorted(totals.items())
+    ]
+    return {
+        'from': f"{from_month:%Y-%m}",
+        'loans': count,
+        'projected_principal': sum((month['principal'] for month in months), Decimal('0.00')),
+        'projected_interest': sum((month['interest'] for month in months), Decimal('0.00')),
+        'months': months,
+    }
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class BankingConfig(AppConfig):
     name = 'banking'
+
+    def ready(self):
+        from . import account_cache  # noqa: F401  (Account save/delete invalidation)
+        from . import ids
+
+        # Fail at startup, not on the first posting, when the id generator is misconfigured
+        ids.get_generator()
@@ -0,0 +1,332 @@
+"""
+Batch transfers: one debit from a source account funding many credits, for
+payroll and bulk-payment files.
+
+submit() validates an uploaded file of ``(account_number, amount)`` lines. It
+reads every destination account with one ``IN`` query and stores the batch
+and its lines with one bulk_create. Lines that fail validation (unknown or
+inactive account, bad amount) are REJECTED up front. The rest are PENDING.
+
+process() then posts the batch in atomic units. Each unit is its own database
+transaction.
+
+1. Funding: one TRANSFER debit of the accepted lines' total from the source
+   account. If the source cannot cover it, the batch FAILS and nothing is
+   credited.
+2. Credits, CHUNK_SIZE lines per unit: the next PENDING lines are credited
+   through ``posting.post_batch`` (one bulk_create and one CASE/WHEN balance
+   UPDATE). In the same transaction the lines are marked CREDITED with
+   CASE/WHEN UPDATEs and the batch's progress counters are advanced. A line whose account was frozen or
+   closed after the upload is REJECTED.
+3. Settlement: the amount of the lines rejected while posting is credited back
+   to the source account, and the batch is COMPLETED.
+
+Until settlement, the part of the funding debit not yet credited
+(``total_amount - credited_amount - refunded_amount``) is held by the batch.
+
+Every unit starts by locking the batch row, then re-reads which lines are
+still PENDING. So two workers never post the same line, and a batch that was
+interrupted part-way is finished by running process() again (the
+``process_transfer_batches`` command does this for every unfinished batch).
+Batches are locked before accounts (see banking/posting.py).
+"""
+import csv
+import io
+import json
+import logging
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections, transaction as db_transaction
+from django.db.models import BigIntegerField, F
+from django.utils import timezone
+
+from . import exports, ids
+from .models import Account, TransferBatch, TransferBatchLine
+from .posting import (
+    BALANCE_UPDATE_CHUNK_SIZE, AccountInactive, AccountNotFound, BatchPosting, PostingError, _retried, parse_amount,
+    post_batch, value_by_pk, write_atomic,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKGROUND': True,
+    'CHUNK_SIZE': 1000,
+    'MAX_LINES': 50000,
+}
+
+RESULT_COLUMNS = ('line', 'account_number', 'amount', 'status', 'error', 'transaction_id')
+
+UNFINISHED_STATUSES = ('PENDING', 'PROCESSING')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'WEKEZA_TRANSFER_BATCH', {})}
+
+
+class BatchFileError(PostingError):
+    default_message = 'Unreadable batch file'
+
+
+def read_records(records):
+    """``(account_number, amount)`` pairs from a list of ``{"account_number", "amount"}`` objects."""
+    if not isinstance(records, list):
+        raise BatchFileError('Expected a list of lines with account_number and amount')
+    lines = []
+    for record in records:
+        if not isinstance(record, dict):
+            raise BatchFileError('Expected a list of lines with account_number and amount')
+        lines.append((str(record.get('account_number') or '').strip(), record.get('amount')))
+    return lines
+
+
+def read_file(upload):
+    """``(account_number, amount)`` pairs from an uploaded CSV (with a header row) or JSON file."""
+    try:
+        text = upload.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise BatchFileError('The file must be UTF-8 encoded')
+
+    if upload.name.lower().endswith('.json') or upload.content_type == 'application/json':
+        try:
+            records = json.loads(text)
+        except ValueError:
+            raise BatchFileError('The file is not valid JSON')
+        return read_records(records.get('lines') if isinstance(records, dict) else records)
+
+    reader = csv.DictReader(io.StringIO(text))
+    if not {'account_number', 'amount'} <= set(reader.fieldnames or ()):
+        raise BatchFileError("The file needs 'account_number' and 'amount' columns")
+    return [((row['account_number'] or '').strip(), (row['amount'] or '').strip()) for row in reader]
+
+
+def submit(source_account_number, lines, description='Batch transfer', user=None, owner=None):
+    """
+    Validate ``(account_number, amount)`` lines and store them as a PENDING
+    batch funded from ``source_account_number``; returns the TransferBatch.
+    With ``owner`` set, the source account must belong to that user.
+    """
+    config = get_config()
+    if not lines:
+        raise BatchFileError('The file has no lines')
+    if len(lines) > config['MAX_LINES']:
+        raise BatchFileError(f"A batch can have at most {config['MAX_LINES']} lines")
+
+    sources = Account.objects.filter(account_number=source_account_number)
+    if owner is not None:
+        sources = sources.filter(customer__user=owner)
+    source = sources.only('pk', 'account_number', 'status').first()
+    if source is None:
+        raise AccountNotFound()
+    if source.status != 'ACTIVE':
+        raise AccountInactive()
+
+    accounts = {
+        number: (pk, status)
+        for number, pk, status in Account.objects
+        .filter(account_number__in={number for number, _ in lines})
+        .values_list('account_number', 'pk', 'status')
+    }
+
+    batch = TransferBatch(
+        batch_id=ids.batch_id(),
+        source_account=source,
+        submitted_by=user,
+        description=description,
+        total_lines=len(lines),
+    )
+    rows = []
+    for line_number, (account_number, amount) in enumerate(lines, start=1):
+        row = TransferBatchLine(batch=batch, line_number=line_number, account_number=account_number[:50])
+        try:
+            row.amount = parse_amount(amount)
+            pk, status = accounts.get(account_number, (None, None))
+            if pk is None:
+                raise AccountNotFound()
+            if pk == source.pk:
+                raise PostingError('Cannot transfer to the same account')
+            if status != 'ACTIVE':
+                raise AccountInactive()
+        except PostingError as e:
+            row.status = 'REJECTED'
+            row.error = e.message
+        else:
+            row.account_id = pk
+            batch.accepted_lines += 1
+            batch.total_amount += row.amount
+        rows.append(row)
+
+    batch.rejected_lines = batch.total_lines - batch.accepted_lines
+    with db_transaction.atomic():
+        batch.save(force_insert=True)
+        TransferBatchLine.objects.bulk_create(rows)
+    return batch
+
+
+def _finish(batch, status, error=''):
+    batch.status = status
+    batch.error = error
+    batch.completed_at = timezone.now()
+
+
+@_retried
+def _fund(batch_pk):
+    """Post the funding debit of a PENDING batch."""
+    with write_atomic():
+        batch = TransferBatch.objects.select_for_update().get(pk=batch_pk)
+        if batch.status != 'PENDING':
+            return
+        if not batch.accepted_lines:
+            _finish(batch, 'COMPLETED')
+            batch.save()
+            return
+
+        [debit] = post_batch([BatchPosting(
+            account=batch.source_account_id,
+            transaction_type='TRANSFER',
+            amount=batch.total_amount,
+            credit=False,
+            description=f"{batch.description} - Batch {batch.batch_id} ({batch.accepted_lines} credits)",
+            user=batch.submitted_by,
+            reference_number=batch.batch_id,
+        )], lookup='pk')
+
+        if isinstance(debit, PostingError):
+            rejected = batch.lines.filter(status='PENDING').update(
+                status='REJECTED', error=f"Batch not funded: {debit.message}"[:255],
+            )
+            batch.processed_lines += rejected
+            batch.rejected_lines += rejected
+            _finish(batch, 'FAILED', debit.message)
+        else:
+            batch.funding_transaction = debit
+            batch.status = 'PROCESSING'
+        batch.save()
+
+
+@_retried
+def _credit_chunk(batch_pk, chunk_size):
+    """Credit the next ``chunk_size`` PENDING lines, or settle the batch; returns False once it is finished."""
+    with write_atomic():
+        batch = (
+            TransferBatch.objects.select_for_update(of=('self',))
+            .select_related('source_account', 'funding_transaction', 'submitted_by')
+            .get(pk=batch_pk)
+        )
+        if batch.status != 'PROCESSING':
+            return False
+
+        lines = list(batch.lines.filter(status='PENDING').order_by('line_number')[:chunk_size])
+        if not lines:
+            _settle(batch)
+            return False
+
+        results = post_batch(
+            [
+                BatchPosting(
+                    account=line.account_id,
+                    transaction_type='TRANSFER',
+                    amount=line.amount,
+                    description=f"{batch.description} - From {batch.source_account.account_number}",
+                    user=batch.submitted_by,
+                    reference_number=batch.funding_transaction.transaction_id,
+                )
+                for line in lines
+            ],
+            lookup='pk',
+        )
+
+        credited, rejected = [], {}
+        amount = Decimal('0.00')
+        for line, result in zip(lines, results):
+            if isinstance(result, PostingError):
+                rejected.setdefault(result.message, []).append(line.pk)
+            else:
+                credited.append((line.pk, result.pk))
+                amount += line.amount
+        _mark_credited(credited)
+        for error, pks in rejected.items():
+            TransferBatchLine.objects.filter(pk__in=pks).update(status='REJECTED', error=error)
+
+        TransferBatch.objects.filter(pk=batch.pk).update(
+            processed_lines=F('processed_lines') + len(lines),
+            credited_lines=F('credited_lines') + len(credited),
+            rejected_lines=F('rejected_lines') + len(lines) - len(credited),
+            credited_amount=F('credited_amount') + amount,
+        )
+        return True
+
+
+def _mark_credited(items):
+    """Mark ``(line pk, transaction pk)`` lines CREDITED with one CASE ... WHEN UPDATE per chunk."""
+    for start in range(0, len(items), BALANCE_UPDATE_CHUNK_SIZE):
+        chunk = items[start:start + BALANCE_UPDATE_CHUNK_SIZE]
+        TransferBatchLine.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            status='CREDITED',
+            transaction_id=value_by_pk(TransferBatchLine, chunk, BigIntegerField()),
+        )
+
+
+def _settle(batch):
+    """Refund the lines rejected while posting to the source account and complete ``batch``."""
+    refund = batch.total_amount - batch.credited_amount
+    if refund:
+        [result] = post_batch([BatchPosting(
+            account=batch.source_account_id,
+            transaction_type='TRANSFER',
+            amount=refund,
+            description=f"{batch.description} - Batch {batch.batch_id} refund of rejected lines",
+            user=batch.submitted_by,
+            reference_number=batch.funding_transaction.transaction_id,
+        )], lookup='pk')
+        if isinstance(result, PostingError):
+            # The source was frozen or closed mid-batch; leave the funds held for an operator
+            _finish(batch, 'FAILED', f"Refund of {refund} not posted: {result.message}")
+            batch.save()
+            return
+        batch.refunded_amount = refund
+    _finish(batch, 'COMPLETED')
+    batch.save()
+
+
+def process(batch_pk, chunk_size=None):
+    """Fund, credit and settle a batch (or finish an interrupted one); returns the TransferBatch."""
+    chunk_size = chunk_size or get_config()['CHUNK_SIZE']
+    _fund(batch_pk)
+    while _credit_chunk(batch_pk, chunk_size):
+        pass
+    return TransferBatch.objects.select_related('source_account').get(pk=batch_pk)
+
+
+def _process_in_thread(batch_pk):
+    try:
+        process(batch_pk)
+    except Exception:
+        # Left PENDING or PROCESSING; process_transfer_batches picks it up
+        logger.exception('Transfer batch %s stopped', batch_pk)
+    finally:
+        connections.close_all()
+
+
+def start(batch):
+    """
+    Process ``batch`` in a background thread once the current transaction has
+    committed, or before returning when ``BACKGROUND`` is off; returns the batch.
+    """
+    if not get_config()['BACKGROUND']:
+        return process(batch.pk)
+    db_transaction.on_commit(lambda: threading.Thread(
+        target=_process_in_thread, args=(batch.pk,), name=f'transfer-batch-{batch.batch_id}', daemon=True,
+    ).start())
+    return batch
+
+
+def result_rows(batch):
+    """Per-line outcome rows of ``batch``, in file order, matching RESULT_COLUMNS."""
+    return (
+        batch.lines.order_by('line_number')
+        .values_list('line_number', 'account_number', 'amount', 'status', 'error', 'transaction__transaction_id')
+        .iterator(chunk_size=exports.EXPORT_CHUNK_SIZE)
+    )
@@ -0,0 +1,128 @@
+"""
+Streaming exports (CSV / NDJSON) of large result sets.
+
+Rows are read with ``.values_list().iterator(chunk_size=...)``, which uses a
+server-side cursor on PostgreSQL, and are written to a StreamingHttpResponse a
+chunk at a time. Memory use stays flat regardless of how many rows an export
+covers.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+EXPORT_CHUNK_SIZE = 2000
+
+STATEMENT_COLUMNS = (
+    'transaction_id', 'created_at', 'transaction_type', 'description', 'reference_number',
+    'amount', 'balance_before', 'balance_after', 'status',
+)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class _Echo:
+    """File-like object whose write() hands the line straight back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def _to_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _chunked(lines, size=EXPORT_CHUNK_SIZE):
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def iter_csv(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_to_text(value) for value in row])
+
+
+def _to_json(value):
+    # Decimals and timestamps are written as strings so no precision is lost
+    if value is None or isinstance(value, (bool, int)):
+        return value
+    return _to_text(value)
+
+
+def iter_ndjson(columns, rows):
+    for row in rows:
+        yield json.dumps({column: _to_json(value) for column, value in zip(columns, row)}) + '\n'
+
+
+def get_output_format(request, default='csv'):
+    output = request.query_params.get('output', default).lower()
+    if output not in CONTENT_TYPES:
+        raise ValidationError({'output': f"Must be one of: {', '.join(CONTENT_TYPES)}"})
+    return output
+
+
+def parse_date_range(request):
+    """
+    Read the inclusive ``from``/``to`` dates (YYYY-MM-DD) from the query string
+    and return the matching ``[start, end)`` datetimes; either may be None.
+    """
+    bounds = []
+    for param in ('from', 'to'):
+        value = request.query_params.get(param)
+        if not value:
+            bounds.append(None)
+            continue
+        try:
+            day = parse_date(value)
+        except ValueError:  # well formed but impossible, e.g. 2024-02-30
+            day = None
+        if day is None:
+            raise ValidationError({param: 'Use the YYYY-MM-DD format.'})
+        if param == 'to':
+            day += timedelta(days=1)
+        bounds.append(timezone.make_aware(datetime.combine(day, time.min)))
+
+    start, end = bounds
+    if start and end and start >= end:
+        raise ValidationError({'to': "Must not be earlier than 'from'."})
+    return start, end
+
+
+def streaming_export(columns, rows, output, filename):
+    """Wrap an iterable of row tuples in a CSV or NDJSON StreamingHttpResponse."""
+    lines = iter_csv(columns, rows) if output == 'csv' else iter_ndjson(columns, rows)
+    response = StreamingHttpResponse(_chunked(lines), content_type=CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{output}"'
+    return response
+
+
+def statement_rows(account, start=None, end=None):
+    transactions = account.transactions.all()
+    if start:
+        transactions = transactions.filter(created_at__gte=start)
+    if end:
+        transactions = transactions.filter(created_at__lt=end)
+    return (
+        transactions.order_by('created_at', 'id')
+        .values_list(*STATEMENT_COLUMNS)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
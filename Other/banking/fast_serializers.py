@@ -0,0 +1,129 @@
+"""
+values_list()-based serializers for hot read endpoints.
+
+A ModelSerializer builds a model instance for every row, then runs each
+field's to_representation() on it. For ledger listings that is most of the
+request time. A ValuesSerializer declares its output fields and the lookup
+behind each one. The first time it is used, it resolves those lookups to model
+fields and compiles one converter per column that needs one:
+
+* Decimals become fixed-point strings with the field's decimal places;
+* datetimes become ISO 8601 in the current time zone, or epoch microseconds
+  while ``renderers.epoch_timestamps()`` is on (MessagePack responses).
+
+These are rendered exactly as DRF renders them. Rows are then read as tuples
+with ``values_list()`` and turned into dicts with ``dict(zip())``. Columns
+that need no conversion (text, integers, foreign-key ids) are passed through
+untouched.
+
+The output matches the ModelSerializer a ValuesSerializer stands in for (see
+TransactionRowSerializer in banking/serializers.py and its test). The
+``bench_serializers`` command measures the difference.
+"""
+import decimal
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+from . import instrumentation, renderers
+
+
+def _decimal_converter(field):
+    exponent = decimal.Decimal(1).scaleb(-field.decimal_places)
+    context = decimal.Context(prec=field.max_digits)
+
+    def bind():
+        def convert(value):
+            return format(value.quantize(exponent, context=context), 'f')
+        return convert
+    return bind
+
+
+def _datetime_converter(field):
+    def bind():
+        if renderers.epoch_timestamps():
+            return renderers.epoch_microseconds
+        # Resolved per call, not per class: the current time zone can differ per request
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+        def convert(value):
+            if tz is not None and timezone.is_aware(value):
+                value = value.astimezone(tz)
+            value = value.isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return convert
+    return bind
+
+
+def _date_converter(field):
+    def bind():
+        return lambda value: value.isoformat()
+    return bind
+
+
+CONVERTERS = (
+    (models.DecimalField, _decimal_converter),
+    (models.DateTimeField, _datetime_converter),
+    (models.DateField, _date_converter),
+)
+
+
+def _resolve(model, lookup):
+    """The model field a ``values_list()`` lookup such as ``account__account_number`` reads."""
+    *relations, name = lookup.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+
+class ValuesSerializer:
+    """
+    Base class. Subclasses set ``model``, the output ``fields`` in order, and
+    ``sources`` for any field whose lookup differs from its name.
+    """
+    model = None
+    fields = ()
+    sources = {}
+
+    _compiled = None
+
+    @classmethod
+    def lookups(cls):
+        return [cls.sources.get(name, name) for name in cls.fields]
+
+    @classmethod
+    def compile(cls):
+        """``(column index, converter factory)`` for every column that needs converting, cached per class."""
+        if cls.__dict__.get('_compiled') is None:
+            compiled = []
+            for index, lookup in enumerate(cls.lookups()):
+                field = _resolve(cls.model, lookup)
+                for field_class, factory in CONVERTERS:
+                    if isinstance(field, field_class):
+                        compiled.append((index, factory(field)))
+                        break
+            cls._compiled = compiled
+        return cls._compiled
+
+    @classmethod
+    def values_list(cls, queryset, named=False):
+        """``queryset`` as rows for to_dicts(); ``named`` rows also expose each column as an attribute."""
+        return queryset.values_list(*cls.lookups(), named=named)
+
+    @classmethod
+    def to_dicts(cls, rows):
+        names = cls.fields
+        converters = [(index, bind()) for index, bind in cls.compile()]
+        stats = instrumentation.current()
+        with instrumentation.serializer_timer(stats):
+            data = []
+            for row in rows:
+                if converters:
+                    row = list(row)
+                    for index, convert in converters:
+                        value = row[index]
+                        if value is not None:
+                            row[index] = convert(value)
+                data.append(dict(zip(names, row)))
+            return data
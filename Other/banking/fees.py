@@ -0,0 +1,184 @@
+"""
+Batch fee engine.
+
+Fees are declared as FeeSchedule rows and evaluated for a billing period
+(normally a calendar month) across all ACTIVE accounts, a primary-key chunk at
+a time. Each schedule is evaluated for a chunk with one set-based query:
+
+* MONTHLY_MAINTENANCE: every matching account, once.
+* PER_WITHDRAWAL: ``COUNT(*)`` of the period's completed withdrawals per
+  account, charged as one posting of ``amount x count``.
+* BELOW_MINIMUM_BALANCE: accounts whose lowest end-of-day balance in the
+  period (``MIN`` over the DailyBalance snapshots, see banking/snapshots.py)
+  fell below ``minimum_balance``. Days without a snapshot are not evaluated,
+  so build the period's snapshots first.
+
+The FEE debits of a chunk are posted through ``posting.post_batch`` in one
+database transaction. Each posting's reference is ``FEE-<schedule>-<period
+start>``, and accounts already charged for that reference are skipped. Runs are
+therefore restartable, and partitions of the account-id range can be processed
+by parallel workers without overlapping (see the ``assess_fees`` command).
+"""
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Min
+
+from .models import Account, DailyBalance, FeeSchedule, Transaction
+from .posting import BatchPosting, PostingError, _retried, post_batch, write_atomic
+from .snapshots import day_bounds
+
+FEE_CHUNK_SIZE = 5000
+
+
+@dataclass
+class FeeRunResult:
+    accounts: int = 0
+    posted: int = 0
+    skipped: int = 0
+    failed: int = 0
+    total: Decimal = Decimal('0.00')
+    last_id: int = None
+
+    def add(self, other):
+        self.accounts += other.accounts
+        self.posted += other.posted
+        self.skipped += other.skipped
+        self.failed += other.failed
+        self.total += other.total
+        self.last_id = other.last_id
+
+
+def reference_for(schedule, period_start):
+    return f"FEE-{schedule.pk}-{period_start:%Y%m%d}"
+
+
+def active_accounts(start_id=None, end_id=None):
+    accounts = Account.objects.filter(status='ACTIVE')
+    if start_id is not None:
+        accounts = accounts.filter(pk__gte=start_id)
+    if end_id is not None:
+        accounts = accounts.filter(pk__lte=end_id)
+    return accounts.order_by('pk')
+
+
+def partition_account_range(partitions, start_id=None, end_id=None):
+    """
+    Split the ACTIVE accounts with ``start_id <= pk <= end_id`` into at most
+    ``partitions`` contiguous ``(first_id, last_id)`` ranges of roughly equal
+    size; ``last_id`` of the final range is None (open-ended).
+    """
+    ids = active_accounts(start_id, end_id).values_list('pk', flat=True)
+    count = ids.count()
+    if not count:
+        return []
+    firsts = sorted({ids[count * index // partitions] for index in range(partitions)})
+    lasts = [first - 1 for first in firsts[1:]] + [end_id]
+    return list(zip(firsts, lasts))
+
+
+def _charges(schedule, account_ids, period_start, period_end):
+    """Return ``{account_id: units}`` for the accounts of the chunk this schedule charges."""
+    accounts = Account.objects.filter(pk__in=account_ids, status='ACTIVE', currency=schedule.currency)
+    if schedule.account_type:
+        accounts = accounts.filter(account_type=schedule.account_type)
+
+    if schedule.fee_type == 'MONTHLY_MAINTENANCE':
+        return dict.fromkeys(accounts.values_list('pk', flat=True), 1)
+
+    if schedule.fee_type == 'PER_WITHDRAWAL':
+        start, _ = day_bounds(period_start)
+        _, end = day_bounds(period_end)
+        rows = (
+            Transaction.objects
+            .filter(account__in=accounts, transaction_type='WITHDRAWAL', status='COMPLETED',
+                    created_at__gte=start, created_at__lt=end)
+            .values('account_id')
+            .annotate(withdrawals=Count('id'))
+            .values_list('account_id', 'withdrawals')
+        )
+        return dict(rows)
+
+    if schedule.fee_type == 'BELOW_MINIMUM_BALANCE' and schedule.minimum_balance is not None:
+        rows = (
+            DailyBalance.objects
+            .filter(account__in=accounts, date__gte=period_start, date__lte=period_end)
+            .values('account_id')
+            .annotate(lowest=Min('closing_balance'))
+            .filter(lowest__lt=schedule.minimum_balance)
+            .values_list('account_id', flat=True)
+        )
+        return dict.fromkeys(rows, 1)
+
+    return {}
+
+
+@_retried
+def assess_chunk(schedules, account_ids, period_start, period_end, user=None):
+    """Evaluate ``schedules`` for one chunk of accounts and post the fees in one transaction."""
+    references = {schedule.pk: reference_for(schedule, period_start) for schedule in schedules}
+    result = FeeRunResult(accounts=len(account_ids))
+    with write_atomic():
+        # Lock first, so an overlapping run waits here and then sees this run's fees as charged
+        list(Account.objects.select_for_update().filter(pk__in=account_ids).order_by('pk').values_list('pk'))
+        charged = set(
+            Transaction.objects.filter(
+                account_id__in=account_ids, transaction_type='FEE', reference_number__in=references.values(),
+            ).values_list('account_id', 'reference_number')
+        )
+
+        postings = []
+        for schedule in schedules:
+            reference = references[schedule.pk]
+            for account_id, units in sorted(_charges(schedule, account_ids, period_start, period_end).items()):
+                if (account_id, reference) in charged:
+                    result.skipped += 1
+                    continue
+                description = schedule.name if units == 1 else f"{schedule.name} x {units}"
+                postings.append(BatchPosting(
+                    account=account_id,
+                    transaction_type='FEE',
+                    amount=schedule.amount * units,
+                    credit=False,
+                    description=description,
+                    user=user,
+                    reference_number=reference,
+                ))
+
+        for entry, outcome in zip(postings, post_batch(postings, lookup='pk')):
+            if isinstance(outcome, PostingError):
+                result.failed += 1
+            else:
+                result.posted += 1
+                result.total += entry.amount
+    return result
+
+
+def assess_fees(period_start, period_end, start_id=None, end_id=None, chunk_size=FEE_CHUNK_SIZE, user=None):
+    """
+    Charge every active FeeSchedule for the inclusive ``period_start`` ..
+    ``period_end`` dates to the ACTIVE accounts with ``start_id <= pk <=
+    end_id``. Yields one FeeRunResult per committed chunk.
+    """
+    schedules = list(FeeSchedule.objects.filter(is_active=True).order_by('pk'))
+    if not schedules:
+        return
+    accounts = active_accounts(start_id, end_id).values_list('pk', flat=True)
+    last_pk = None
+    while True:
+        chunk = accounts if last_pk is None else accounts.filter(pk__gt=last_pk)
+        account_ids = list(chunk[:chunk_size])
+        if not account_ids:
+            return
+        last_pk = account_ids[-1]
+        result = assess_chunk(schedules, account_ids, period_start, period_end, user=user)
+        result.last_id = last_pk
+        yield result
+
+
+def month_bounds(day):
+    """First and last date of the calendar month containing ``day``."""
+    first = day.replace(day=1)
+    last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return first, last
@@ -0,0 +1,126 @@
+"""
+Group-commit mode for high-volume deposits.
+
+When ``WEKEZA_GROUP_COMMIT['ENABLED']`` is set, deposit requests are not
+written one by one. Each request thread queues its posting and waits; a
+background flusher per process gathers postings for up to ``WINDOW_MS``
+milliseconds (or ``MAX_BATCH`` postings) and writes them with
+:func:`banking.posting.post_batch`, i.e. one ``bulk_create`` and one balance
+UPDATE per batch instead of an INSERT and UPDATE per request. Each caller still
+receives its own Transaction, or the PostingError for its row.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import posting
+
+DEFAULTS = {
+    'ENABLED': False,
+    'WINDOW_MS': 5,
+    'MAX_BATCH': 500,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'WEKEZA_GROUP_COMMIT', {})}
+
+
+def is_enabled():
+    return get_config()['ENABLED']
+
+
+class GroupCommitter:
+    """Collects postings from many request threads and flushes them in batches."""
+
+    def __init__(self, window_ms, max_batch):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, entry):
+        """Queue a BatchPosting and block until its batch has committed."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((entry, future))
+        # No timeout: once queued the posting may still commit, so the caller
+        # must wait for the real outcome rather than report a false failure.
+        return future.result()
+
+    def _ensure_started(self):
+        # Threads do not survive fork(), so each gunicorn worker starts its own
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            self.flush(self._collect())
+
+    def flush(self, batch):
+        close_old_connections()
+        try:
+            results = posting.post_batch([entry for entry, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, posting.PostingError):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+_committer = None
+_committer_lock = threading.Lock()
+
+
+def get_committer():
+    global _committer
+    if _committer is None:
+        with _committer_lock:
+            if _committer is None:
+                config = get_config()
+                _committer = GroupCommitter(config['WINDOW_MS'], config['MAX_BATCH'])
+    return _committer
+
+
+def deposit(account_number, amount, description='Deposit', user=None):
+    """Group-committed equivalent of :func:`banking.posting.deposit`."""
+    # Reject malformed amounts in the request thread; they never reach a batch
+    amount = posting.parse_amount(amount)
+    return get_committer().submit(posting.BatchPosting(
+        account=account_number,
+        transaction_type='DEPOSIT',
+        amount=amount,
+        description=description,
+        user=user,
+    ))
@@ -0,0 +1,159 @@
+"""
+Idempotency keys for money-moving actions.
+
+A client may send an ``Idempotency-Key`` header with a POST. The first request
+with a given key, per user, claims the key by inserting a PENDING
+IdempotencyKey row; the unique index on (user, key) makes that claim atomic. It
+then runs normally and stores its response on the row.
+
+Later requests with the same key never reach the view, so they never touch an
+Account row:
+
+* the stored response is replayed (with ``Idempotent-Replayed: true``);
+* while the first request is still running they poll until its response is
+  stored, up to WAIT_TIMEOUT seconds, then answer 409;
+* a different request body (uploaded file contents included), path or
+  timestamp format (epoch for MessagePack, ISO 8601 otherwise) under the same
+  key is rejected with 422.
+
+Responses with a 5xx status are not stored; the key is released so the
+client can retry. Keys expire after TTL_HOURS. Expired keys are reclaimed on
+use and deleted in bulk by the ``purge_idempotency_keys`` command.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+DEFAULTS = {
+    'TTL_HOURS': 24,
+    'WAIT_TIMEOUT': 10.0,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'WEKEZA_IDEMPOTENCY', {})}
+
+
+def expiry_cutoff():
+    return timezone.now() - timedelta(hours=get_config()['TTL_HOURS'])
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    digest = hashlib.sha256(f"{request.method} {request.path}\n{body}".encode())
+    # request.data only shows an upload's file name; hash what is in it
+    files = getattr(request, 'FILES', {})
+    for name in sorted(files):
+        for upload in files.getlist(name):
+            digest.update(f"\n{name}\n".encode())
+            for chunk in upload.chunks():
+                digest.update(chunk)
+            upload.seek(0)
+    # The stored response holds timestamps in the format this request negotiated
+    # (see banking/renderers.py), so a retry must ask for the same one
+    if getattr(getattr(request, 'accepted_renderer', None), 'epoch_timestamps', False):
+        digest.update(b'\nepoch-timestamps')
+    return digest.hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def claim(user, key, fingerprint):
+    """
+    Claim ``key`` for ``user``. Returns ``(record, None)`` when this request
+    owns the key, or ``(None, response)`` with the response to send instead.
+    """
+    deadline = time.monotonic() + get_config()['WAIT_TIMEOUT']
+    delay = 0.01
+    while True:
+        try:
+            with db_transaction.atomic():
+                return IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint), None
+        except IntegrityError:
+            pass
+
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None:
+            continue  # released by a request that failed; claim it again
+        if record.created_at < expiry_cutoff():
+            IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+            continue
+        if record.fingerprint != fingerprint:
+            return None, Response(
+                {'error': f'{HEADER} was already used for a different request'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if record.status == 'COMPLETED':
+            return None, _replay(record)
+        if time.monotonic() >= deadline:
+            return None, Response(
+                {'error': f'A request with this {HEADER} is still being processed'},
+                status=status.HTTP_409_CONFLICT,
+            )
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+
+def complete(record, response):
+    if response.status_code >= 500:
+        record.delete()
+        return
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        status='COMPLETED',
+        response_status=response.status_code,
+        response_body=response.data,
+    )
+
+
+def idempotent(view_method):
+    """Honour the Idempotency-Key header on a viewset action (apply below ``@action``)."""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view_method(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be 1-{MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        record, response = claim(request.user, key, request_fingerprint(request))
+        if response is not None:
+            return response
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        complete(record, response)
+        return response
+    return wrapper
+
+
+def purge_expired(chunk_size=10000):
+    """Delete expired keys a chunk at a time; returns the number deleted."""
+    cutoff = expiry_cutoff()
+    deleted = 0
+    while True:
+        pks = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
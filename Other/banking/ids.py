@@ -0,0 +1,238 @@
+"""
+Identifier service for transaction, customer and other business keys.
+
+The generator is pluggable through ``WEKEZA_ID_GENERATOR['BACKEND']``:
+
+* :class:`SnowflakeGenerator` (default) builds time-ordered 81-bit ids from the
+  current millisecond, a node id, the process id and a per-millisecond
+  sequence. It never touches the database. Processes on one node are kept apart
+  by their pid. Nodes are kept apart by ``NODE_ID`` (0-255). There is no
+  default: a hostname hash has only 256 values, and identical containers run
+  the same pids. Give each host or container its own value, for example a
+  StatefulSet ordinal.
+* :class:`BlockSequenceGenerator` reserves blocks of ``BLOCK_SIZE`` values from
+  the ``id_blocks`` table and hands them out from memory, so it costs one
+  database round trip per block rather than per id. A block needed inside a
+  transaction is reserved on a connection of its own, so a rollback cannot hand
+  it out twice. SQLite is the exception: the posting transaction already holds
+  the database's only write lock. There the block is reserved in the caller's
+  transaction and used only by it, and it joins the shared pool only once that
+  transaction commits.
+
+Ids are monotonic within a process. They are rendered as fixed-width base-36
+strings, so string order matches numeric order. Snowflake transaction ids
+therefore land on the right-hand edge of the ``transactions.transaction_id``
+index instead of at random positions.
+"""
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from .models import IdBlock
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+ID_WIDTH = 16  # 36 ** 16 > 2 ** 81
+
+DEFAULTS = {
+    'BACKEND': 'banking.ids.SnowflakeGenerator',
+    'OPTIONS': {},
+}
+
+
+def encode(value, width=ID_WIDTH):
+    """Render a non-negative integer as a zero-padded upper-case base-36 string."""
+    digits = []
+    while value:
+        value, remainder = divmod(value, 36)
+        digits.append(ALPHABET[remainder])
+    return ''.join(reversed(digits)).rjust(width, '0')
+
+
+class SnowflakeGenerator:
+    """Time-ordered ids: 41 bits of milliseconds, 8 node bits, 22 pid bits, 10 sequence bits."""
+    EPOCH_MS = 1767225600000  # 2026-01-01T00:00:00Z
+    NODE_BITS = 8
+    PID_BITS = 22  # Linux pid_max is at most 2 ** 22
+    SEQUENCE_BITS = 10
+
+    def __init__(self, node_id=None, **options):
+        max_node_id = (1 << self.NODE_BITS) - 1
+        try:
+            self.node_id = int(node_id)
+        except (TypeError, ValueError):
+            self.node_id = -1
+        if not 0 <= self.node_id <= max_node_id:
+            raise ImproperlyConfigured(
+                f"SnowflakeGenerator needs a node_id between 0 and {max_node_id} (ID_NODE_ID), "
+                f"unique per host or container; got {node_id!r}"
+            )
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_ms = -1
+        self._sequence = 0
+
+    def _now_ms(self):
+        return time.time_ns() // 1_000_000
+
+    def next_id(self, name=None):
+        sequence_mask = (1 << self.SEQUENCE_BITS) - 1
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked child: same state as the parent but a new pid
+                self._pid = os.getpid()
+                self._last_ms = -1
+
+            now = max(self._now_ms(), self._last_ms)  # never step backwards with the wall clock
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & sequence_mask
+                if self._sequence == 0:
+                    while now <= self._last_ms:
+                        now = self._now_ms()
+            else:
+                self._sequence = 0
+            self._last_ms = now
+
+            return (
+                (now - self.EPOCH_MS) << (self.NODE_BITS + self.PID_BITS + self.SEQUENCE_BITS)
+                | self.node_id << (self.PID_BITS + self.SEQUENCE_BITS)
+                | (self._pid & ((1 << self.PID_BITS) - 1)) << self.SEQUENCE_BITS
+                | self._sequence
+            )
+
+
+def _reserve_block(name, size):
+    """Advance the named sequence by ``size`` and return the reserved [start, end) range."""
+    with transaction.atomic():
+        block, _ = IdBlock.objects.select_for_update().get_or_create(name=name)
+        start = block.next_value
+        IdBlock.objects.filter(name=name).update(next_value=F('next_value') + size)
+    return start, start + size
+
+
+def _reserve_block_autocommit(name, size):
+    """
+    Reserve a block on a connection of its own when called inside a transaction,
+    so a rollback of the caller cannot hand the same block to another process.
+    Not for SQLite transactions; see BlockSequenceGenerator._next_in_transaction().
+    """
+    if not connections['default'].in_atomic_block:
+        return _reserve_block(name, size)
+
+    result = {}
+
+    def reserve():
+        try:
+            result['block'] = _reserve_block(name, size)
+        except Exception as e:
+            result['error'] = e
+        finally:
+            connections['default'].close()
+
+    thread = threading.Thread(target=reserve, name='id-block-reserve')
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['block']
+
+
+class BlockSequenceGenerator:
+    """Sequential ids per name, handed out from blocks reserved in the id_blocks table."""
+
+    def __init__(self, block_size=1000, **options):
+        self.block_size = int(block_size)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._blocks = {}
+        self._local = threading.local()
+
+    def next_id(self, name='default'):
+        connection = connections['default']
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never share a block reserved by the parent process
+                self._pid = os.getpid()
+                self._blocks = {}
+                self._local = threading.local()
+
+            current, end = self._blocks.get(name, (0, 0))
+            if current < end:
+                self._blocks[name] = (current + 1, end)
+                return current
+            if connection.vendor != 'sqlite' or not connection.in_atomic_block:
+                current, end = _reserve_block_autocommit(name, self.block_size)
+                self._blocks[name] = (current + 1, end)
+                return current
+        return self._next_in_transaction(name, connection)
+
+    def _next_in_transaction(self, name, connection):
+        """
+        Next id from a block reserved in the current SQLite transaction. Another
+        connection cannot write while that transaction holds the lock. The block
+        stays private to the transaction. Its unused ids join the shared pool on
+        commit and are dropped if the transaction or savepoint that reserved it
+        rolls back.
+        """
+        pending = self._local.__dict__.setdefault('pending', {})
+        block = pending.get(name)
+        # A rollback discards the block's on_commit hook along with its reservation
+        if block is None or block['current'] >= block['end'] or not any(
+            func is block['release'] for _, func, _ in connection.run_on_commit
+        ):
+            start, end = _reserve_block(name, self.block_size)
+            block = pending[name] = {'current': start, 'end': end}
+            block['release'] = lambda: self._release(name, pending, block)
+            connection.on_commit(block['release'])
+        value = block['current']
+        block['current'] += 1
+        return value
+
+    def _release(self, name, pending, block):
+        """Hand the unused part of a committed transaction's block to the shared pool."""
+        if pending.get(name) is block:
+            del pending[name]
+        with self._lock:
+            current, end = self._blocks.get(name, (0, 0))
+            if current >= end and block['current'] < block['end']:
+                self._blocks[name] = (block['current'], block['end'])
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def get_generator():
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                config = {**DEFAULTS, **getattr(settings, 'WEKEZA_ID_GENERATOR', {})}
+                _generator = import_string(config['BACKEND'])(**config['OPTIONS'])
+    return _generator
+
+
+def generate(prefix, name):
+    """Return ``prefix`` followed by the next encoded id of the ``name`` sequence."""
+    return f"{prefix}{encode(get_generator().next_id(name))}"
+
+
+def transaction_id():
+    return generate('TXN', 'transaction')
+
+
+def customer_id():
+    return generate('CUST', 'customer')
+
+
+def payment_id():
+    return generate('PAY', 'loan_payment')
+
+
+def batch_id():
+    return generate('BAT', 'transfer_batch')
@@ -0,0 +1,91 @@
+"""
+Request-scoped performance counters.
+
+RequestInstrumentationMiddleware opens a RequestStats for every request and
+makes it current through a context variable. Database time is collected with a
+connection execute wrapper. Serializer time is collected by
+InstrumentedSerializerMixin in banking/serializers.py and by the
+ValuesSerializers of banking/fast_serializers.py. Code that runs outside a
+request sees no current stats and pays nothing.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('banking_request_stats', default=None)
+
+
+def current():
+    return _current.get()
+
+
+class RequestStats:
+    def __init__(self, max_captured_sql=200):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest_sql = None
+        self.slowest_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        self.captured_sql = []
+        self.max_captured_sql = max_captured_sql
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        if duration >= self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_sql = sql
+        if len(self.captured_sql) < self.max_captured_sql:
+            self.captured_sql.append((duration, sql))
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def activate(self):
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+
+class QueryTimer:
+    """Execute wrapper (see connection.execute_wrapper) feeding a RequestStats."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.stats.record_query(sql, time.perf_counter() - start)
+
+
+@contextmanager
+def serializer_timer(stats):
+    """Add the time spent in the block to ``stats.serializer_time``."""
+    if stats is None or stats.serializing:
+        # Outside a request, or a nested serializer already being timed
+        yield
+        return
+
+    stats.serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializing = False
+        stats.serializer_time += time.perf_counter() - start
+
+
+class InstrumentedSerializerMixin:
+    """Adds the time spent in to_representation() to the current request's stats."""
+
+    def to_representation(self, instance):
+        with serializer_timer(_current.get()):
+            return super().to_representation(instance)
@@ -0,0 +1,148 @@
+"""
+End-of-day interest accrual.
+
+Interest accrues daily on ACTIVE accounts with a positive balance and a
+non-zero ``interest_rate`` (an annual percentage, Actual/365 fixed). Accounts
+are processed in primary-key chunks. For each chunk the balances and rates are
+read with one ``values_list()`` query and the day's interest is computed for
+the whole chunk with NumPy. Postings then go through ``posting.post_batch``
+(one ``bulk_create`` plus CASE/WHEN balance UPDATEs).
+
+Rounding happens once, at the posting boundary: ROUND_HALF_UP to the cent.
+The float computation is only trusted where it cannot change the rounded
+result. Rows whose fractional cent lands too close to one half are recomputed
+exactly with Decimal.
+
+Each posting carries the reference ``INT-YYYYMMDD``. A re-run of the same day
+skips accounts that already have it, so an interrupted job can simply be run
+again, whole or by account-id range.
+"""
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+
+from . import striping
+from .models import Account, Transaction
+from .posting import CENT, BatchPosting, PostingError, _retried, post_batch, write_atomic
+
+ACCRUAL_CHUNK_SIZE = 5000
+DAYS_IN_YEAR = 365
+
+# |fraction - 0.5| below this (relative to the value) is settled with Decimal
+_HALF_CENT_TOLERANCE = 1e-9
+
+
+@dataclass
+class AccrualResult:
+    accounts: int = 0
+    posted: int = 0
+    skipped: int = 0
+    failed: int = 0
+    total: Decimal = Decimal('0.00')
+    last_id: int = None
+
+
+def reference_for(day):
+    return f"INT-{day:%Y%m%d}"
+
+
+def _exact_daily_interest(balance, rate):
+    return (balance * rate / 100 / DAYS_IN_YEAR).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def daily_interest(balances, rates):
+    """
+    One day's interest for each ``(balance, rate)`` pair, as Decimals rounded
+    half-up to the cent. ``balances`` and ``rates`` are sequences of Decimal.
+    """
+    if not balances:
+        return []
+    cents = np.rint(np.array(balances, dtype=np.float64) * 100)
+    rate = np.array(rates, dtype=np.float64)
+
+    raw = cents * rate / (100 * DAYS_IN_YEAR)
+    rounded = np.floor(raw + 0.5)
+    fraction = raw - np.floor(raw)
+    near_half = np.abs(fraction - 0.5) <= _HALF_CENT_TOLERANCE * np.maximum(raw, 1.0)
+
+    amounts = [Decimal(int(value)) * CENT for value in rounded]
+    for index in np.flatnonzero(near_half):
+        amounts[index] = _exact_daily_interest(balances[index], rates[index])
+    return amounts
+
+
+def _eligible_accounts(start_id, end_id):
+    accounts = Account.objects.filter(status='ACTIVE', balance__gt=0, interest_rate__gt=0)
+    if start_id is not None:
+        accounts = accounts.filter(pk__gte=start_id)
+    if end_id is not None:
+        accounts = accounts.filter(pk__lte=end_id)
+    return accounts.order_by('pk')
+
+
+@_retried
+def accrue_chunk(day, account_ids, user=None):
+    """Compute and post ``day``'s interest for the given accounts in one transaction."""
+    reference = reference_for(day)
+    result = AccrualResult()
+    with write_atomic():
+        # Lock first, so interest is computed on the balance it is posted against
+        rows = list(
+            Account.objects.select_for_update()
+            .filter(pk__in=account_ids, status='ACTIVE', balance__gt=0, interest_rate__gt=0)
+            .order_by('pk')
+            .values_list('pk', 'balance', 'interest_rate')
+        )
+        folded = striping.consolidate([row[0] for row in rows])
+        rows = [(pk, balance + folded.get(pk, 0), rate) for pk, balance, rate in rows]
+        already_posted = set(
+            Transaction.objects.filter(
+                account_id__in=account_ids, transaction_type='INTEREST', reference_number=reference,
+            ).values_list('account_id', flat=True)
+        )
+        pending = [row for row in rows if row[0] not in already_posted]
+        result.accounts = len(rows)
+        result.skipped = len(rows) - len(pending)
+
+        amounts = daily_interest([row[1] for row in pending], [row[2] for row in pending])
+        postings = [
+            BatchPosting(
+                account=pk,
+                transaction_type='INTEREST',
+                amount=amount,
+                description=f"Interest for {day:%Y-%m-%d}",
+                user=user,
+                reference_number=reference,
+            )
+            for (pk, _, _), amount in zip(pending, amounts)
+            if amount > 0
+        ]
+        result.skipped += len(pending) - len(postings)
+
+        for entry, outcome in zip(postings, post_batch(postings, lookup='pk')):
+            if isinstance(outcome, PostingError):
+                result.failed += 1
+            else:
+                result.posted += 1
+                result.total += entry.amount
+    return result
+
+
+def accrue_interest(day, start_id=None, end_id=None, chunk_size=ACCRUAL_CHUNK_SIZE, user=None):
+    """
+    Accrue ``day``'s interest for every eligible account with ``start_id <= pk
+    <= end_id``. Yields one AccrualResult per committed chunk, so callers can
+    report progress and the last account id done.
+    """
+    accounts = _eligible_accounts(start_id, end_id).values_list('pk', flat=True)
+    last_pk = None
+    while True:
+        chunk = accounts if last_pk is None else accounts.filter(pk__gt=last_pk)
+        account_ids = list(chunk[:chunk_size])
+        if not account_ids:
+            return
+        last_pk = account_ids[-1]
+        result = accrue_chunk(day, account_ids, user=user)
+        result.last_id = last_pk
+        yield result
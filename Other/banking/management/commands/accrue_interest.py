@@ -0,0 +1,43 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from banking.interest import ACCRUAL_CHUNK_SIZE, accrue_interest
+
+
+class Command(BaseCommand):
+    help = "Accrue and post one day's interest on every ACTIVE interest-bearing account"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Accrual day (YYYY-MM-DD); defaults to yesterday")
+        parser.add_argument('--start-id', type=int, help="First account id to process (inclusive)")
+        parser.add_argument('--end-id', type=int, help="Last account id to process (inclusive)")
+        parser.add_argument('--chunk-size', type=int, default=ACCRUAL_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                day = parse_date(options['date'])
+            except ValueError:  # well formed but impossible, e.g. 2024-02-30
+                day = None
+            if day is None:
+                raise CommandError("--date must be a valid date in the YYYY-MM-DD format")
+        else:
+            day = timezone.localdate() - timedelta(days=1)
+
+        posted = skipped = failed = 0
+        total = Decimal('0.00')
+        for result in accrue_interest(day, options['start_id'], options['end_id'], options['chunk_size']):
+            posted += result.posted
+            skipped += result.skipped
+            failed += result.failed
+            total += result.total
+            # Every chunk is committed; rerun with --start-id=<last id + 1> to resume
+            self.stdout.write(f"{day}: up to account {result.last_id}: {posted} posted, {skipped} skipped")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{day}: {posted} interest postings totalling {total}, {skipped} skipped, {failed} failed"
+        ))
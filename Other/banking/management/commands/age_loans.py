@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from banking.aging import AGING_CHUNK_SIZE, DEFAULT_AFTER_DAYS, build_loan_aging
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the loan delinquency aging for a day and mark loans "
+        f"{DEFAULT_AFTER_DAYS}+ days past due as DEFAULTED"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="As-of day (YYYY-MM-DD); defaults to today")
+        parser.add_argument('--chunk-size', type=int, default=AGING_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                as_of = parse_date(options['date'])
+            except ValueError:  # well formed but impossible, e.g. 2024-02-30
+                as_of = None
+            if as_of is None:
+                raise CommandError("--date must be a valid date in the YYYY-MM-DD format")
+        else:
+            as_of = timezone.localdate()
+
+        aged, defaulted = build_loan_aging(as_of, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"{as_of}: {aged} loans aged, {defaulted} newly defaulted"))
@@ -0,0 +1,83 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from banking.fees import FEE_CHUNK_SIZE, FeeRunResult, assess_fees, month_bounds, partition_account_range
+
+
+def run_partition(period_start, period_end, first_id, last_id, chunk_size):
+    """Process one account-id range; runs in a worker process."""
+    started = time.perf_counter()
+    totals = FeeRunResult()
+    try:
+        for result in assess_fees(period_start, period_end, first_id, last_id, chunk_size):
+            totals.add(result)
+    finally:
+        connections.close_all()
+    return first_id, last_id, totals, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluate the active fee schedules for a billing month and post the FEE debits. "
+        "With --workers > 1 the account-id range is split into partitions processed by "
+        "parallel worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help="Billing month (YYYY-MM); defaults to last month")
+        parser.add_argument('--start-id', type=int, help="First account id to process (inclusive)")
+        parser.add_argument('--end-id', type=int, help="Last account id to process (inclusive)")
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--chunk-size', type=int, default=FEE_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                day = parse_date(f"{options['month']}-01")
+            except ValueError:  # well formed but impossible, e.g. 2024-13
+                day = None
+            if day is None:
+                raise CommandError("--month must be a valid month in the YYYY-MM format")
+        else:
+            day = timezone.localdate().replace(day=1) - timedelta(days=1)
+        period_start, period_end = month_bounds(day)
+
+        workers = max(options['workers'], 1)
+        if workers > 1 and connections['default'].vendor == 'sqlite':
+            # SQLite allows a single writer; parallel workers would only fail with "database is locked"
+            self.stderr.write(self.style.WARNING("SQLite database: running with a single worker"))
+            workers = 1
+
+        partitions = partition_account_range(workers, options['start_id'], options['end_id'])
+        jobs = [(period_start, period_end, first, last, options['chunk_size']) for first, last in partitions]
+
+        started = time.perf_counter()
+        if len(jobs) <= 1:
+            outcomes = [run_partition(*job) for job in jobs]
+        else:
+            # Workers must not share the parent's database connection
+            connections.close_all()
+            with ProcessPoolExecutor(len(jobs), mp_context=multiprocessing.get_context('fork')) as pool:
+                outcomes = list(pool.map(run_partition, *zip(*jobs)))
+        elapsed = time.perf_counter() - started
+
+        overall = FeeRunResult()
+        for first, last, totals, seconds in outcomes:
+            overall.add(totals)
+            self.stdout.write(
+                f"accounts {first}-{last or 'end'}: {totals.accounts} accounts, {totals.posted} fees posted, "
+                f"{totals.skipped} skipped, {totals.failed} failed in {seconds:.2f}s "
+                f"({totals.accounts / seconds if seconds else 0:.0f} accounts/s)"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"{period_start:%Y-%m}: {overall.posted} fees totalling {overall.total} across "
+            f"{overall.accounts} accounts in {elapsed:.2f}s "
+            f"({overall.accounts / elapsed if elapsed else 0:.0f} accounts/s)"
+        ))
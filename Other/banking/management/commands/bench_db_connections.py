@@ -0,0 +1,63 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from banking.models import Account
+
+
+def _summary(timings):
+    ms = sorted(t * 1000 for t in timings)
+    p95 = statistics.quantiles(ms, n=20)[-1] if len(ms) > 1 else ms[0]
+    return {'p50': statistics.median(ms), 'p95': p95, 'mean': statistics.fmean(ms)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time a balance inquiry with a new database connection per request (CONN_MAX_AGE=0) "
+        "against one on a persistent connection"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--account', help="Account number to read; defaults to the first account")
+
+    def _lookup(self, pk):
+        # The balance endpoint's query
+        return Account.objects.filter(pk=pk).values_list('balance', 'currency', 'status').get()
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.order_by('pk')
+        if options['account']:
+            accounts = accounts.filter(account_number=options['account'])
+        pk = accounts.values_list('pk', flat=True).first()
+        if pk is None:
+            raise CommandError("No account to read")
+        requests = max(options['requests'], 2)
+
+        per_request = []
+        for _ in range(requests):
+            connection.close()
+            start = time.perf_counter()
+            self._lookup(pk)
+            per_request.append(time.perf_counter() - start)
+
+        persistent = []
+        connection.ensure_connection()
+        connection.close_at = None  # keep it open whatever CONN_MAX_AGE says
+        for _ in range(requests):
+            start = time.perf_counter()
+            # What request_started does; also re-arms CONN_HEALTH_CHECKS
+            connection.close_if_unusable_or_obsolete()
+            self._lookup(pk)
+            persistent.append(time.perf_counter() - start)
+
+        self.stdout.write(f"{connection.vendor} {connection.settings_dict['HOST'] or connection.settings_dict['NAME']}, "
+                          f"{requests} balance inquiries each")
+        for label, timings in (('connect per request', per_request), ('persistent connection', persistent)):
+            stats = _summary(timings)
+            self.stdout.write(f"  {label:<22} p50 {stats['p50']:.3f} ms  p95 {stats['p95']:.3f} ms  "
+                              f"mean {stats['mean']:.3f} ms")
+        saved = _summary(per_request)['p95'] - _summary(persistent)['p95']
+        self.stdout.write(self.style.SUCCESS(f"Connection reuse saves {saved:.3f} ms at p95"))
@@ -0,0 +1,98 @@
+import random
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, connections
+
+from banking import metrics, posting
+from banking.models import Account, Customer
+
+BENCH_USERNAME = 'bench-contention'
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent teller writers (deposits, withdrawals, transfers) against the configured database "
+        "and report the postings per second it sustains. Creates BENCH-* accounts; use a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--accounts', type=int, default=20, help="Accounts the writers share; fewer means more contention")
+
+    def _accounts(self, count):
+        user, _ = User.objects.get_or_create(username=BENCH_USERNAME)
+        customer, _ = Customer.objects.get_or_create(
+            user=user,
+            defaults={'customer_id': 'CUST-BENCH-CONTENTION', 'phone_number': '0700000000', 'address': 'Bench',
+                      'date_of_birth': date(1990, 1, 1), 'id_number': 'BENCH-CONTENTION'},
+        )
+        numbers = [f'BENCH-{index:05d}' for index in range(count)]
+        Account.objects.bulk_create(
+            [Account(customer=customer, account_number=number, account_type='CURRENT', balance=Decimal('1000000.00'))
+             for number in numbers],
+            ignore_conflicts=True,
+        )
+        return numbers
+
+    def _writer(self, numbers, deadline, seed, results):
+        rng = random.Random(seed)
+        done = rejected = locked = 0
+        try:
+            while time.monotonic() < deadline:
+                amount = Decimal(rng.randint(1, 10000)) / 100
+                operation = rng.random()
+                try:
+                    if operation < 0.4:
+                        posting.deposit(rng.choice(numbers), amount)
+                    elif operation < 0.6:
+                        posting.withdraw(rng.choice(numbers), amount)
+                    else:
+                        source, target = rng.sample(numbers, 2)
+                        posting.transfer(source, target, amount)
+                    done += 1
+                except posting.PostingError:
+                    rejected += 1
+                except OperationalError:
+                    locked += 1
+        finally:
+            connections.close_all()
+            results.append((done, rejected, locked))
+
+    def handle(self, *args, **options):
+        numbers = self._accounts(max(options['accounts'], 2))
+        journal = 'n/a'
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                journal = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+        close_old_connections()
+
+        retries_before = sum(value for _, value in metrics.POSTING_RETRIES.snapshot())
+        results = []
+        started = time.monotonic()
+        deadline = started + options['seconds']
+        threads = [
+            threading.Thread(target=self._writer, args=(numbers, deadline, seed, results))
+            for seed in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        done, rejected, locked = (sum(column) for column in zip(*results))
+        retries = sum(value for _, value in metrics.POSTING_RETRIES.snapshot()) - retries_before
+        self.stdout.write(
+            f"{connection.vendor} (journal_mode={journal}), {options['writers']} writers, "
+            f"{len(numbers)} accounts, {elapsed:.1f}s"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{done} postings ({done / elapsed:.0f}/s), {retries} retries, "
+            f"{locked} failed on locks after retrying, {rejected} rejected"
+        ))
@@ -0,0 +1,77 @@
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from banking.models import Transaction
+from banking.renderers import MessagePackRenderer, ORJSONRenderer, use_epoch_timestamps
+from banking.serializers import TransactionRowSerializer, TransactionSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare payload size, render time and allocations of DRF's JSONRenderer, ORJSONRenderer and "
+        "MessagePackRenderer on a page of transactions, as the ledger and statement endpoints serve it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20, help="Best of this many runs is reported")
+
+    def _best(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def _peak_allocated(self, func):
+        """Peak memory allocated by Python while ``func`` runs once, output included."""
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def handle(self, *args, **options):
+        transactions = Transaction.objects.select_related('account').order_by('-created_at', '-id')[:options['rows']]
+        instances = list(transactions)
+        if not instances:
+            raise CommandError("No transactions to render")
+        tuples = list(TransactionRowSerializer.values_list(transactions))
+        repeat = max(options['repeat'], 1)
+
+        self.stdout.write(
+            f"{len(instances)} rows, best of {repeat}. render: a TransactionSerializer page; "
+            f"serialize + render: statement rows through TransactionRowSerializer"
+        )
+        timings = {}
+        for renderer in (JSONRenderer(), ORJSONRenderer(), MessagePackRenderer()):
+            label = type(renderer).__name__
+            # MessagePack responses carry timestamps as epoch microseconds, produced while serializing
+            mode = use_epoch_timestamps if getattr(renderer, 'epoch_timestamps', False) else nullcontext
+            with mode():
+                page = {'next': None, 'previous': None, 'results': TransactionSerializer(instances, many=True).data}
+
+                def render():
+                    return renderer.render(page, renderer.media_type, {})
+
+                def serialize_and_render():
+                    rows = TransactionRowSerializer.to_dicts(tuples)
+                    return renderer.render({'next': None, 'previous': None, 'results': rows}, renderer.media_type, {})
+
+                size = len(render())
+                timings[label] = self._best(repeat, render)
+                end_to_end = self._best(repeat, serialize_and_render)
+                peak = self._peak_allocated(render)
+            self.stdout.write(
+                f"  {label:<20} {size:>9,} bytes   render {timings[label] * 1000:>7.2f} ms   "
+                f"serialize + render {end_to_end * 1000:>7.2f} ms   peak allocated {peak / 1024:>6,.0f} KiB"
+            )
+        speedup = timings['JSONRenderer'] / timings['ORJSONRenderer']
+        self.stdout.write(self.style.SUCCESS(f"ORJSONRenderer renders {speedup:.1f}x faster than JSONRenderer"))
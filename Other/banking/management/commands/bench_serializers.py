@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from banking.models import Transaction
+from banking.serializers import TransactionRowSerializer, TransactionSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows per second of TransactionSerializer(many=True) and the values_list()-based "
+        "TransactionRowSerializer over the newest ledger rows, with and without the query"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5, help="Best of this many runs is reported")
+
+    def _best(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        transactions = Transaction.objects.select_related('account').order_by('-created_at', '-id')[:options['rows']]
+        rows = len(transactions)
+        if not rows:
+            raise CommandError("No transactions to serialize")
+        repeat = max(options['repeat'], 1)
+
+        instances = list(transactions)
+        tuples = list(TransactionRowSerializer.values_list(transactions))
+        timings = {
+            'TransactionSerializer': (
+                self._best(repeat, lambda: TransactionSerializer(list(transactions.all()), many=True).data),
+                self._best(repeat, lambda: TransactionSerializer(instances, many=True).data),
+            ),
+            'TransactionRowSerializer': (
+                self._best(repeat, lambda: TransactionRowSerializer.to_dicts(
+                    TransactionRowSerializer.values_list(transactions.all()))),
+                self._best(repeat, lambda: TransactionRowSerializer.to_dicts(tuples)),
+            ),
+        }
+
+        self.stdout.write(f"{rows} rows, best of {repeat}")
+        for label, (with_query, serialize_only) in timings.items():
+            self.stdout.write(
+                f"  {label:<25} query + serialize {rows / with_query:>9,.0f} rows/s   "
+                f"serialize only {rows / serialize_only:>9,.0f} rows/s"
+            )
+        speedup = timings['TransactionSerializer'][0] / timings['TransactionRowSerializer'][0]
+        self.stdout.write(self.style.SUCCESS(f"values_list() path is {speedup:.1f}x faster end to end"))
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from banking.snapshots import SNAPSHOT_CHUNK_SIZE, build_daily_balances
+
+
+class Command(BaseCommand):
+    help = "Build end-of-day balance snapshots (one row per account per day)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Day to snapshot (YYYY-MM-DD); defaults to yesterday")
+        parser.add_argument('--days', type=int, default=1,
+                            help="Backfill this many days ending on --date, oldest first")
+        parser.add_argument('--chunk-size', type=int, default=SNAPSHOT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                last_day = parse_date(options['date'])
+            except ValueError:  # well formed but impossible, e.g. 2024-02-30
+                last_day = None
+            if last_day is None:
+                raise CommandError("--date must be a valid date in the YYYY-MM-DD format")
+        else:
+            last_day = timezone.localdate() - timedelta(days=1)
+
+        # Oldest first, so each day opens from the snapshot built just before it
+        for offset in range(options['days'] - 1, -1, -1):
+            day = last_day - timedelta(days=offset)
+            built = build_daily_balances(day, chunk_size=options['chunk_size'])
+            self.stdout.write(f"{day}: {built} account snapshots")
@@ -0,0 +1,62 @@
+import csv
+import time
+from contextlib import ExitStack
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from banking.posting import PostingError
+from banking.repayments import REPAYMENT_CHUNK_SIZE, repay_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply a repayment file (CSV with 'loan_id' and 'amount' columns). Every chunk is "
+        "committed on its own; rerun with --skip=<rows committed> to resume an interrupted import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Repayment file")
+        parser.add_argument('--chunk-size', type=int, default=REPAYMENT_CHUNK_SIZE)
+        parser.add_argument('--skip', type=int, default=0, help="Number of data rows to skip")
+        parser.add_argument('--errors', help="Write rejected rows, with the reason, to this CSV file")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        applied = rejected = 0
+        row_number = options['skip']
+
+        with ExitStack() as stack:
+            reader = csv.DictReader(stack.enter_context(open(options['path'], newline='')))
+            if not {'loan_id', 'amount'} <= set(reader.fieldnames or ()):
+                raise CommandError("The file needs 'loan_id' and 'amount' columns")
+            errors = None
+            if options['errors']:
+                errors = csv.writer(stack.enter_context(open(options['errors'], 'w', newline='')))
+                errors.writerow(['row', 'loan_id', 'amount', 'error'])
+
+            rows = islice(reader, options['skip'], None)
+            while True:
+                chunk = [
+                    (row['loan_id'].strip(), row['amount'].strip())
+                    for row in islice(rows, options['chunk_size'])
+                ]
+                if not chunk:
+                    break
+
+                for offset, result in enumerate(repay_batch(chunk)):
+                    if isinstance(result, PostingError):
+                        rejected += 1
+                        if errors:
+                            errors.writerow([row_number + offset + 1, *chunk[offset], result.message])
+                    else:
+                        applied += 1
+                row_number += len(chunk)
+                self.stdout.write(f"committed through row {row_number}: {applied} applied, {rejected} rejected")
+
+        elapsed = time.perf_counter() - started
+        processed = applied + rejected
+        self.stdout.write(self.style.SUCCESS(
+            f"{applied} repayments applied, {rejected} rejected in {elapsed:.1f}s "
+            f"({processed / elapsed if elapsed else 0:.0f} rows/s)"
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from banking.batch_transfers import UNFINISHED_STATUSES, get_config, process
+from banking.models import TransferBatch
+
+
+class Command(BaseCommand):
+    help = (
+        "Process every PENDING transfer batch and finish any left PROCESSING by an interrupted run. "
+        "Each chunk is committed on its own, so this is safe to rerun at any time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', help="Process only this batch id")
+        parser.add_argument('--chunk-size', type=int, default=get_config()['CHUNK_SIZE'])
+
+    def handle(self, *args, **options):
+        batches = TransferBatch.objects.filter(status__in=UNFINISHED_STATUSES).order_by('created_at')
+        if options['batch']:
+            batches = batches.filter(batch_id=options['batch'])
+
+        for batch_pk, batch_id in list(batches.values_list('pk', 'batch_id')):
+            batch = process(batch_pk, options['chunk_size'])
+            self.stdout.write(
+                f"{batch_id}: {batch.status}, {batch.credited_lines} credited ({batch.credited_amount}), "
+                f"{batch.rejected_lines} rejected, {batch.refunded_amount} refunded"
+            )
+        self.stdout.write(self.style.SUCCESS("No unfinished transfer batches left"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from banking.idempotency import get_config, purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete idempotency keys older than WEKEZA_IDEMPOTENCY['TTL_HOURS']"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{deleted} idempotency keys older than {get_config()['TTL_HOURS']}h deleted"
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from banking.models import Account
+from banking.striping import MAX_STRIPES, set_stripe_count
+
+
+class Command(BaseCommand):
+    help = "Spread a hot account's credits over several stripe rows (--stripes 1 turns striping off)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('account_number')
+        parser.add_argument('--stripes', type=int, required=True, help=f"1-{MAX_STRIPES}")
+
+    def handle(self, *args, **options):
+        account = Account.objects.filter(account_number=options['account_number']).first()
+        if account is None:
+            raise CommandError(f"Account {options['account_number']} not found")
+        try:
+            account = set_stripe_count(account, options['stripes'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"{account.account_number}: {account.stripe_count} stripe(s), balance {account.balance}"
+        ))
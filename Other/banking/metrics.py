@@ -0,0 +1,250 @@
+"""
+Prometheus-style metrics for the banking API.
+
+Metrics are aggregated in process memory. Each metric has its own lock, held
+only for a dictionary lookup and a few additions, so recording costs a few
+microseconds on the request path.
+
+Multi-process servers (gunicorn workers) set ``WEKEZA_METRICS['MULTIPROCESS_DIR']``.
+A daemon thread in every worker then writes its snapshot to that directory
+once per ``FLUSH_INTERVAL`` seconds. The scrape endpoint merges the snapshots
+of all workers with its own live values. Counters and histograms from exited
+workers are kept, so totals never go backwards. Gauges only count live
+workers. Clear the directory when the service is redeployed.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+DEFAULTS = {
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 1.0,
+    'TOKEN': None,
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'WEKEZA_METRICS', {})}
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), self._copy(value)] for labels, value in self._values.items()]
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, last slot is +Inf; then sum
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def _copy(self, value):
+        return list(value)
+
+
+REGISTRY = []
+
+REQUEST_LATENCY = Histogram(
+    'wekeza_http_request_duration_seconds',
+    'Request latency by view and DRF action.',
+    ['view', 'action'],
+)
+RESPONSES = Counter(
+    'wekeza_http_responses_total',
+    'Responses by view, DRF action and status code.',
+    ['view', 'action', 'status'],
+)
+IN_FLIGHT = Gauge(
+    'wekeza_http_requests_in_flight',
+    'Requests currently being processed.',
+)
+DB_CONNECTION_WAIT = Histogram(
+    'wekeza_db_connection_wait_seconds',
+    'Time spent opening (or waiting for) a database connection during a request, by alias.',
+    ['alias'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+POSTINGS = Counter(
+    'wekeza_postings_total',
+    'Ledger postings by transaction type and status.',
+    ['transaction_type', 'status'],
+)
+POSTING_RETRIES = Counter(
+    'wekeza_posting_retries_total',
+    'Posting transactions re-run after a lock conflict, by posting function.',
+    ['operation'],
+)
+
+
+def snapshot():
+    return {metric.name: metric.snapshot() for metric in REGISTRY}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _Flusher:
+    """Writes this process's snapshot to the multiprocess directory periodically."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.filename = None
+
+    def ensure_started(self, directory, interval):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # The start time keeps a recycled pid from overwriting a dead worker's file
+            self.filename = os.path.join(directory, f'{self._pid}-{time.time_ns()}.json')
+            thread = threading.Thread(target=self._run, args=(interval,), name='metrics-flush', daemon=True)
+            thread.start()
+
+    def _run(self, interval):
+        while True:
+            self.flush()
+            time.sleep(interval)
+
+    def flush(self):
+        temporary = f'{self.filename}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(snapshot(), f)
+        os.replace(temporary, self.filename)
+
+
+_flusher = _Flusher()
+
+
+def start_flusher():
+    """Start this process's snapshot writer when a multiprocess directory is configured."""
+    config = get_config()
+    if config['MULTIPROCESS_DIR']:
+        _flusher.ensure_started(config['MULTIPROCESS_DIR'], config['FLUSH_INTERVAL'])
+
+
+def _collect():
+    """Merge the live snapshot of this process with those written by other workers."""
+    snapshots = [(snapshot(), True)]
+    directory = get_config()['MULTIPROCESS_DIR']
+    if directory and os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json') or os.path.join(directory, filename) == _flusher.filename:
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshots.append((data, _pid_alive(int(filename.split('-', 1)[0]))))
+
+    merged = {metric.name: {} for metric in REGISTRY}
+    for data, alive in snapshots:
+        for metric in REGISTRY:
+            if metric.type == 'gauge' and not alive:
+                continue
+            values = merged[metric.name]
+            for labels, value in data.get(metric.name, []):
+                key = tuple(labels)
+                if metric.type == 'histogram':
+                    current = values.setdefault(key, [0] * len(value))
+                    values[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    values[key] = values.get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Render all metrics in the Prometheus text exposition format (version 0.0.4)."""
+    merged = _collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for labels, value in sorted(merged[metric.name].items()):
+            if metric.type != 'histogram':
+                lines.append(f'{metric.name}{_labels(metric.labelnames, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            bounds = [repr(float(bound)) for bound in metric.buckets] + ['+Inf']
+            for bound, count in zip(bounds, value[:-1]):
+                cumulative += count
+                lines.append(
+                    f'{metric.name}_bucket{_labels(metric.labelnames, labels, [("le", bound)])} {cumulative}'
+                )
+            lines.append(f'{metric.name}_sum{_labels(metric.labelnames, labels)} {_number(value[-1])}')
+            lines.append(f'{metric.name}_count{_labels(metric.labelnames, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
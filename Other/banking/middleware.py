@@ -0,0 +1,164 @@
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import idempotency, metrics
+from .instrumentation import QueryTimer, RequestStats
+
+logger = logging.getLogger('banking.perf')
+
+PERF_DEFAULTS = {
+    'SERVER_TIMING': True,
+    'MAX_CAPTURED_SQL': 200,
+    'BUDGETS': {
+        'default': {'queries': 50, 'db_ms': 250, 'total_ms': 1000},
+    },
+    'IDEMPOTENCY_KEY_QUERIES': 6,
+}
+
+
+def get_perf_config():
+    return {**PERF_DEFAULTS, **getattr(settings, 'WEKEZA_PERF', {})}
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Records query count, DB time, serializer time and the slowest SQL statement
+    for every request. Reports them in a ``Server-Timing`` header and a JSON log
+    line on the ``banking.perf`` logger. Requests over their route's budget (see
+    ``WEKEZA_PERF['BUDGETS']``, keyed by URL name) are logged at WARNING with
+    the SQL they ran. A request with an ``Idempotency-Key`` header may run
+    IDEMPOTENCY_KEY_QUERIES more queries than its route's budget, for claiming
+    the key and storing the response (see banking/idempotency.py).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = get_perf_config()
+        self.server_timing = config['SERVER_TIMING']
+        self.max_captured_sql = config['MAX_CAPTURED_SQL']
+        self.budgets = config['BUDGETS']
+        self.idempotency_key_queries = config['IDEMPOTENCY_KEY_QUERIES']
+
+    def __call__(self, request):
+        stats = RequestStats(self.max_captured_sql)
+        token = stats.activate()
+        try:
+            with ExitStack() as stack:
+                timer = QueryTimer(stats)
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timer))
+                response = self.get_response(request)
+        finally:
+            RequestStats.deactivate(token)
+
+        self.report(request, response, stats)
+        return response
+
+    def get_budget(self, route, keyed=False):
+        budget = {**self.budgets.get('default', {}), **self.budgets.get(route, {})}
+        if keyed and 'queries' in budget:
+            budget['queries'] += self.idempotency_key_queries
+        return budget
+
+    def report(self, request, response, stats):
+        total_ms = stats.elapsed * 1000
+        db_ms = stats.db_time * 1000
+        serializer_ms = stats.serializer_time * 1000
+        match = getattr(request, 'resolver_match', None)
+        route = match.url_name if match else None
+
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={db_ms:.2f};desc="{stats.queries} queries"',
+                f'sql-max;dur={stats.slowest_time * 1000:.2f}',
+                f'ser;dur={serializer_ms:.2f}',
+                f'total;dur={total_ms:.2f}',
+            ])
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            'db_ms': round(db_ms, 2),
+            'queries': stats.queries,
+            'serializer_ms': round(serializer_ms, 2),
+            'slowest_sql_ms': round(stats.slowest_time * 1000, 2),
+            'slowest_sql': stats.slowest_sql[:500] if stats.slowest_sql else None,
+        }
+
+        budget = self.get_budget(route, keyed=idempotency.HEADER in request.headers)
+        exceeded = [
+            name for name, measured in (
+                ('queries', stats.queries), ('db_ms', db_ms), ('total_ms', total_ms),
+            )
+            if name in budget and measured > budget[name]
+        ]
+        if exceeded:
+            record['budget'] = budget
+            record['exceeded'] = exceeded
+            record['sql'] = [
+                {'ms': round(duration * 1000, 2), 'sql': sql}
+                for duration, sql in stats.captured_sql
+            ]
+            logger.warning(json.dumps(record))
+        elif logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record))
+
+
+class MetricsMiddleware:
+    """
+    Feeds the request metrics in banking/metrics.py: latency and responses per
+    DRF action, requests in flight, and the time taken to open each database
+    connection the request actually uses, by alias. Connections are left to
+    open lazily, so a read routed to a replica never opens one to the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics.start_flusher()
+        for connection in connections.all():
+            _time_connect(connection)
+        start = time.perf_counter()
+        metrics.IN_FLIGHT.inc()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.IN_FLIGHT.dec()
+
+        view, action = getattr(request, '_metrics_labels', ('unmatched', 'unmatched'))
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, view, action)
+        metrics.RESPONSES.inc(view, action, str(response.status_code))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # ViewSet routes carry their method -> action mapping, e.g. {'post': 'deposit'}
+        view_class = getattr(view_func, 'cls', None)
+        actions = getattr(view_func, 'actions', None) or {}
+        request._metrics_labels = (
+            view_class.__name__ if view_class else view_func.__name__,
+            actions.get(request.method.lower(), request.method.lower()),
+        )
+        return None
+
+
+def _time_connect(connection):
+    """Observe DB_CONNECTION_WAIT whenever ``connection`` (a per-thread wrapper) opens."""
+    if 'connect' in vars(connection):
+        return
+    connect = connection.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        connect()
+        metrics.DB_CONNECTION_WAIT.observe(time.perf_counter() - start, connection.alias)
+
+    connection.connect = timed_connect
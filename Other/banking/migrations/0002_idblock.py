@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdBlock',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+            options={
+                'verbose_name': 'ID Block',
+                'verbose_name_plural': 'ID Blocks',
+                'db_table': 'id_blocks',
+            },
+        ),
+    ]
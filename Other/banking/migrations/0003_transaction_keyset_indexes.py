@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0002_idblock'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', '-created_at', '-id'], name='txn_account_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['-created_at', '-id'], name='txn_created_idx'),
+        ),
+    ]
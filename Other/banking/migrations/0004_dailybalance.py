@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0003_transaction_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('total_credits', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('total_debits', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('transaction_count', models.IntegerField(default=0)),
+                ('built_at', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='banking.account')),
+            ],
+            options={
+                'verbose_name': 'Daily Balance',
+                'verbose_name_plural': 'Daily Balances',
+                'db_table': 'daily_balances',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'date'), name='daily_balance_account_date_uniq')],
+            },
+        ),
+    ]
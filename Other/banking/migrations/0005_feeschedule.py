@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:40
+
+import django.core.validators
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0004_dailybalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeeSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('fee_type', models.CharField(choices=[('MONTHLY_MAINTENANCE', 'Monthly Maintenance'), ('PER_WITHDRAWAL', 'Per Withdrawal'), ('BELOW_MINIMUM_BALANCE', 'Below Minimum Balance')], max_length=30)),
+                ('account_type', models.CharField(blank=True, choices=[('SAVINGS', 'Savings Account'), ('CHECKING', 'Checking Account'), ('BUSINESS', 'Business Account'), ('FIXED_DEPOSIT', 'Fixed Deposit')], help_text='Leave blank to apply to every account type', max_length=20)),
+                ('currency', models.CharField(choices=[('KES', 'Kenyan Shilling'), ('USD', 'US Dollar'), ('EUR', 'Euro'), ('GBP', 'British Pound')], default='KES', max_length=3)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))])),
+                ('minimum_balance', models.DecimalField(blank=True, decimal_places=2, help_text='Threshold for below-minimum-balance fees', max_digits=15, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Fee Schedule',
+                'verbose_name_plural': 'Fee Schedules',
+                'db_table': 'fee_schedules',
+                'ordering': ['name'],
+            },
+        ),
+    ]
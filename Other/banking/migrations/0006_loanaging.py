@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0005_feeschedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanAging',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateField()),
+                ('installments_due', models.IntegerField(default=0)),
+                ('expected_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('paid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('arrears', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('days_past_due', models.IntegerField(default=0)),
+                ('bucket', models.CharField(choices=[('CURRENT', 'Current'), ('DPD_1_29', '1-29 days past due'), ('DPD_30_59', '30-59 days past due'), ('DPD_60_89', '60-89 days past due'), ('DPD_90_PLUS', '90+ days past due')], default='CURRENT', max_length=12)),
+                ('outstanding_balance', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('built_at', models.DateTimeField(auto_now=True)),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aging', to='banking.loan')),
+            ],
+            options={
+                'verbose_name': 'Loan Aging',
+                'verbose_name_plural': 'Loan Aging',
+                'db_table': 'loan_aging',
+                'ordering': ['-as_of', '-days_past_due'],
+                'indexes': [models.Index(fields=['as_of', 'bucket'], name='loan_aging_as_of_bucket_idx')],
+                'constraints': [models.UniqueConstraint(fields=('loan', 'as_of'), name='loan_aging_loan_as_of_uniq')],
+            },
+        ),
+    ]
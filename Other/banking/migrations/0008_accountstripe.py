@@ -0,0 +1,34 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0007_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='stripe_count',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Above 1, credits are spread over this many stripes'),
+        ),
+        migrations.CreateModel(
+            name='AccountStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripes', to='banking.account')),
+            ],
+            options={
+                'verbose_name': 'Account Stripe',
+                'verbose_name_plural': 'Account Stripes',
+                'db_table': 'account_stripes',
+                'constraints': [models.UniqueConstraint(fields=('account', 'stripe'), name='account_stripe_account_stripe_uniq')],
+            },
+        ),
+    ]
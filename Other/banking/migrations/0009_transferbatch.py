@@ -0,0 +1,66 @@
+# Generated by Django 6.0.1 on 2026-10-18 03:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0008_accountstripe'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.CharField(max_length=50, unique=True)),
+                ('description', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('total_lines', models.IntegerField(default=0)),
+                ('accepted_lines', models.IntegerField(default=0, help_text='Lines that passed validation on upload')),
+                ('processed_lines', models.IntegerField(default=0, help_text='Accepted lines credited or rejected so far')),
+                ('credited_lines', models.IntegerField(default=0)),
+                ('rejected_lines', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, help_text='Sum of the accepted lines, debited from the source account', max_digits=15)),
+                ('credited_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('refunded_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('funding_transaction', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='funded_batch', to='banking.transaction')),
+                ('source_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfer_batches', to='banking.account')),
+                ('submitted_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transfer_batches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Transfer Batch',
+                'verbose_name_plural': 'Transfer Batches',
+                'db_table': 'transfer_batches',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TransferBatchLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.IntegerField()),
+                ('account_number', models.CharField(max_length=50)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('CREDITED', 'Credited'), ('REJECTED', 'Rejected')], default='PENDING', max_length=10)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='banking.account')),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='banking.transferbatch')),
+                ('transaction', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='batch_line', to='banking.transaction')),
+            ],
+            options={
+                'verbose_name': 'Transfer Batch Line',
+                'verbose_name_plural': 'Transfer Batch Lines',
+                'db_table': 'transfer_batch_lines',
+                'indexes': [models.Index(fields=['batch', 'status', 'line_number'], name='transfer_batch_line_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('batch', 'line_number'), name='transfer_batch_line_uniq')],
+            },
+        ),
+    ]
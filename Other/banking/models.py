@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 
@@ -56,6 +57,8 @@ class Account(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     interest_rate = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    stripe_count = models.PositiveSmallIntegerField(default=1,
+                                                    help_text='Above 1, credits are spread over this many stripes')
     
     class Meta:
         db_table = 'accounts'
@@ -64,6 +67,35 @@ class Account(models.Model):
     
     def __str__(self):
         return f"{self.account_number} - {self.customer.user.get_full_name()} - {self.balance} {self.currency}"
+    
+    def consolidated_balance(self):
+        """
+        The balance including credits still held on stripes (see banking/striping.py).
+        Uses the ``stripe_balance`` annotation (striping.stripe_total()) when the row was loaded with one.
+        """
+        if hasattr(self, 'stripe_balance'):
+            return self.balance + self.stripe_balance
+        if self.stripe_count <= 1:
+            return self.balance
+        return self.balance + (self.stripes.aggregate(total=models.Sum('balance'))['total'] or 0)
+
+
+class AccountStripe(models.Model):
+    """One sub-balance of a striped account; credits land here until consolidated"""
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='stripes')
+    stripe = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'account_stripes'
+        verbose_name = 'Account Stripe'
+        verbose_name_plural = 'Account Stripes'
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'stripe'], name='account_stripe_account_stripe_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.account.account_number} - stripe {self.stripe} - {self.balance}"
 
 
 class Transaction(models.Model):
@@ -103,6 +135,11 @@ class Transaction(models.Model):
         verbose_name = 'Transaction'
         verbose_name_plural = 'Transactions'
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination (banking/pagination.py) seeks on these
+            models.Index(fields=['account', '-created_at', '-id'], name='txn_account_created_idx'),
+            models.Index(fields=['-created_at', '-id'], name='txn_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.transaction_id} - {self.transaction_type} - {self.amount}"
@@ -206,3 +243,210 @@ class LoanPayment(models.Model):
     
     def __str__(self):
         return f"{self.payment_id} - {self.loan.loan_id} - {self.amount}"
+
+
+class IdBlock(models.Model):
+    """High-water mark of a block-allocated identifier sequence (see banking/ids.py)"""
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField(default=1)
+    
+    class Meta:
+        db_table = 'id_blocks'
+        verbose_name = 'ID Block'
+        verbose_name_plural = 'ID Blocks'
+    
+    def __str__(self):
+        return f"{self.name} - {self.next_value}"
+
+
+class DailyBalance(models.Model):
+    """End-of-day balance snapshot, one row per account per day"""
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='daily_balances')
+    date = models.DateField()
+    opening_balance = models.DecimalField(max_digits=15, decimal_places=2)
+    closing_balance = models.DecimalField(max_digits=15, decimal_places=2)
+    total_credits = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    total_debits = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    transaction_count = models.IntegerField(default=0)
+    built_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'daily_balances'
+        verbose_name = 'Daily Balance'
+        verbose_name_plural = 'Daily Balances'
+        ordering = ['-date']
+        constraints = [
+            # Also the index behind point-in-time balance lookups
+            models.UniqueConstraint(fields=['account', 'date'], name='daily_balance_account_date_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.account.account_number} - {self.date} - {self.closing_balance}"
+
+
+class FeeSchedule(models.Model):
+    """Declarative fee rule, evaluated across all accounts by the batch fee engine (banking/fees.py)"""
+    FEE_TYPES = [
+        ('MONTHLY_MAINTENANCE', 'Monthly Maintenance'),
+        ('PER_WITHDRAWAL', 'Per Withdrawal'),
+        ('BELOW_MINIMUM_BALANCE', 'Below Minimum Balance'),
+    ]
+    
+    name = models.CharField(max_length=100)
+    fee_type = models.CharField(max_length=30, choices=FEE_TYPES)
+    account_type = models.CharField(max_length=20, choices=Account.ACCOUNT_TYPES, blank=True,
+                                    help_text='Leave blank to apply to every account type')
+    currency = models.CharField(max_length=3, choices=Account.CURRENCY_CHOICES, default='KES')
+    amount = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
+    minimum_balance = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True,
+                                          help_text='Threshold for below-minimum-balance fees')
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'fee_schedules'
+        verbose_name = 'Fee Schedule'
+        verbose_name_plural = 'Fee Schedules'
+        ordering = ['name']
+    
+    def __str__(self):
+        return f"{self.name} - {self.get_fee_type_display()} - {self.amount} {self.currency}"
+
+
+class LoanAging(models.Model):
+    """Delinquency aging of a loan as of a day, built nightly by banking/aging.py"""
+    BUCKET_CHOICES = [
+        ('CURRENT', 'Current'),
+        ('DPD_1_29', '1-29 days past due'),
+        ('DPD_30_59', '30-59 days past due'),
+        ('DPD_60_89', '60-89 days past due'),
+        ('DPD_90_PLUS', '90+ days past due'),
+    ]
+    
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name='aging')
+    as_of = models.DateField()
+    installments_due = models.IntegerField(default=0)
+    expected_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    paid_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    arrears = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    days_past_due = models.IntegerField(default=0)
+    bucket = models.CharField(max_length=12, choices=BUCKET_CHOICES, default='CURRENT')
+    outstanding_balance = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    built_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'loan_aging'
+        verbose_name = 'Loan Aging'
+        verbose_name_plural = 'Loan Aging'
+        ordering = ['-as_of', '-days_past_due']
+        constraints = [
+            models.UniqueConstraint(fields=['loan', 'as_of'], name='loan_aging_loan_as_of_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['as_of', 'bucket'], name='loan_aging_as_of_bucket_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.loan.loan_id} - {self.as_of} - {self.bucket}"
+
+
+class IdempotencyKey(models.Model):
+    """Outcome of a request sent with an Idempotency-Key header, replayed on retries (see banking/idempotency.py)"""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('COMPLETED', 'Completed'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        db_table = 'idempotency_keys'
+        verbose_name = 'Idempotency Key'
+        verbose_name_plural = 'Idempotency Keys'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_user_key_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.key} - {self.status}"
+
+
+class TransferBatch(models.Model):
+    """A batch-transfer file: one debit from source_account funding many credits (see banking/batch_transfers.py)"""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('PROCESSING', 'Processing'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    batch_id = models.CharField(max_length=50, unique=True)
+    source_account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='transfer_batches')
+    submitted_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='transfer_batches')
+    description = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    total_lines = models.IntegerField(default=0)
+    accepted_lines = models.IntegerField(default=0, help_text='Lines that passed validation on upload')
+    processed_lines = models.IntegerField(default=0, help_text='Accepted lines credited or rejected so far')
+    credited_lines = models.IntegerField(default=0)
+    rejected_lines = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0,
+                                       help_text='Sum of the accepted lines, debited from the source account')
+    credited_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    refunded_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    funding_transaction = models.OneToOneField(Transaction, on_delete=models.SET_NULL, null=True, blank=True,
+                                               related_name='funded_batch')
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'transfer_batches'
+        verbose_name = 'Transfer Batch'
+        verbose_name_plural = 'Transfer Batches'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.batch_id} - {self.source_account.account_number} - {self.status}"
+
+
+class TransferBatchLine(models.Model):
+    """One credit of a TransferBatch, with its outcome"""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('CREDITED', 'Credited'),
+        ('REJECTED', 'Rejected'),
+    ]
+    
+    batch = models.ForeignKey(TransferBatch, on_delete=models.CASCADE, related_name='lines')
+    line_number = models.IntegerField()
+    account_number = models.CharField(max_length=50)
+    account = models.ForeignKey(Account, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    error = models.CharField(max_length=255, blank=True)
+    transaction = models.OneToOneField(Transaction, on_delete=models.SET_NULL, null=True, blank=True,
+                                       related_name='batch_line')
+    
+    class Meta:
+        db_table = 'transfer_batch_lines'
+        verbose_name = 'Transfer Batch Line'
+        verbose_name_plural = 'Transfer Batch Lines'
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'line_number'], name='transfer_batch_line_uniq'),
+        ]
+        indexes = [
+            # Each processing unit takes the next PENDING lines in file order
+            models.Index(fields=['batch', 'status', 'line_number'], name='transfer_batch_line_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.batch.batch_id} - line {self.line_number} - {self.status}"
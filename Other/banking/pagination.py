@@ -0,0 +1,128 @@
+"""
+Keyset (cursor) pagination for ledger listings.
+
+Pages are addressed by the ``(created_at, id)`` position of their boundary row
+instead of an OFFSET, and no COUNT(*) is issued. Fetching page N therefore
+costs one index range scan of ``page_size + 1`` rows, the same as page 1. Rows
+are returned newest first; ``id`` breaks ties between rows created in the same
+instant so no row is skipped or repeated across pages.
+
+Rows may be model instances or named ``values_list()`` rows; either way the
+paginator reads their ``created_at`` and ``id``.
+"""
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE or 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request):
+        """Return ``(created_at, id, reverse)`` from the request, or None for the first page."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            direction, created_at, pk = b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (BinasciiError, UnicodeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None or direction not in ('n', 'p'):
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk, direction == 'p'
+
+    def encode_cursor(self, row, reverse):
+        position = f"{'p' if reverse else 'n'}|{row.created_at.isoformat()}|{row.id}"
+        token = b64encode(position.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        reverse = False
+        if cursor is None:
+            queryset = queryset.order_by('-created_at', '-id')
+        else:
+            created_at, pk, reverse = cursor
+            if reverse:
+                # Rows newer than the cursor, fetched oldest first and flipped below
+                queryset = queryset.filter(
+                    Q(created_at__gte=created_at),
+                    Q(created_at__gt=created_at) | Q(id__gt=pk),
+                ).order_by('created_at', 'id')
+            else:
+                # The redundant created_at__lte gives the planner an index range
+                queryset = queryset.filter(
+                    Q(created_at__lte=created_at),
+                    Q(created_at__lt=created_at) | Q(id__lt=pk),
+                ).order_by('-created_at', '-id')
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class StatementPagination(KeysetPagination):
+    page_size = 20
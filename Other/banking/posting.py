@@ -0,0 +1,551 @@
+"""
+Posting engine for every money-moving operation.
+
+All balance changes go through this module. Each posting runs inside a single
+database transaction, locks the accounts it touches in primary-key order (so
+two concurrent transfers between the same accounts can never deadlock) and
+applies the balance change with an ``F()`` expression UPDATE. The lock is taken
+as late as possible and held only for the UPDATE and the ledger INSERT, which
+keeps hot accounts from becoming a bottleneck under many concurrent writers.
+
+Lock ordering rule: loans are always locked before accounts, and accounts are
+always locked in ascending primary-key order. Credits to striped accounts skip
+the account lock and take a stripe lock instead (see banking/striping.py).
+
+A posting transaction that fails on a lock conflict (SQLite's "database is
+locked", a PostgreSQL deadlock or serialization failure) is rolled back and run
+again, up to ``WEKEZA_POSTING_RETRY['ATTEMPTS']`` times with jittered
+exponential backoff. Postings called inside a caller's transaction are not
+retried here; the error propagates to whoever owns the transaction. On
+SQLite, posting transactions start with BEGIN IMMEDIATE (write_atomic()), so
+they queue for the write lock at BEGIN rather than failing when a read lock
+has to be upgraded part-way through.
+
+Deposits, withdrawals and transfers between unstriped accounts that
+banking/account_cache.py knows to be ACTIVE take a fast path. Each balance
+change is one ``UPDATE ... RETURNING`` by primary key, which locks the row,
+re-checks ``status = 'ACTIVE'``, ``stripe_count <= 1`` (and, for a debit, the
+funds) in its WHERE clause, and returns the new balance. If it matches no row,
+_reject() reads the row again to report why. If the account has been striped
+since it was cached, the stale entry is dropped and the posting takes the
+locking path, which consolidates the stripes first.
+"""
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction as db_transaction
+from django.db.models import DecimalField, F
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from . import account_cache, ids, metrics, striping
+from .models import Account, Loan, Transaction
+
+CENT = Decimal('0.01')
+
+# Accounts per CASE ... WHEN balance UPDATE issued by post_batch
+BALANCE_UPDATE_CHUNK_SIZE = 500
+
+RETRY_DEFAULTS = {
+    'ATTEMPTS': 5,
+    'BASE_DELAY': 0.01,
+    'MAX_DELAY': 0.5,
+}
+
+LOCK_CONFLICT_MESSAGES = (
+    'database is locked',
+    'database table is locked',
+    'deadlock detected',
+    'could not serialize access',
+)
+
+
+def get_retry_config():
+    return {**RETRY_DEFAULTS, **getattr(settings, 'WEKEZA_POSTING_RETRY', {})}
+
+
+class PostingError(Exception):
+    """A posting rejected by the engine; carries the HTTP status to report."""
+    status_code = 400
+    default_message = 'Posting rejected'
+
+    def __init__(self, message=None):
+        self.message = message or self.default_message
+        super().__init__(self.message)
+
+
+class AccountNotFound(PostingError):
+    status_code = 404
+    default_message = 'Account not found'
+
+
+class LoanNotFound(PostingError):
+    status_code = 404
+    default_message = 'Loan not found'
+
+
+class AccountInactive(PostingError):
+    default_message = 'Account is not active'
+
+
+class InvalidAmount(PostingError):
+    default_message = 'Amount must be positive'
+
+
+class InsufficientFunds(PostingError):
+    default_message = 'Insufficient balance'
+
+
+class InvalidLoanState(PostingError):
+    default_message = 'Loan must be approved first'
+
+
+def _counted(transaction_type, legs=1):
+    """Count the postings written (or rejected) by a posting function."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                result = func(*args, **kwargs)
+            except PostingError:
+                metrics.POSTINGS.inc(transaction_type, 'FAILED')
+                raise
+            metrics.POSTINGS.inc(transaction_type, 'COMPLETED', amount=legs)
+            return result
+        return wrapper
+    return decorator
+
+
+def is_lock_conflict(error):
+    message = str(error).lower()
+    return any(text in message for text in LOCK_CONFLICT_MESSAGES)
+
+
+@contextmanager
+def write_atomic():
+    """``transaction.atomic()`` for a posting; on SQLite the outermost one begins IMMEDIATE."""
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with db_transaction.atomic():
+            yield
+        return
+
+    connection.ensure_connection()
+    mode = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with db_transaction.atomic():
+            connection.transaction_mode = mode  # BEGIN IMMEDIATE has been issued
+            yield
+    finally:
+        connection.transaction_mode = mode
+
+
+def _retried(func):
+    """Re-run a posting transaction that failed on a lock conflict (see the module docstring)."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        config = get_retry_config()
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if attempt >= config['ATTEMPTS'] or connection.in_atomic_block or not is_lock_conflict(e):
+                    raise
+            metrics.POSTING_RETRIES.inc(func.__name__)
+            # Full jitter, so writers that collided do not collide again in step
+            time.sleep(random.uniform(0, min(config['MAX_DELAY'], config['BASE_DELAY'] * 2 ** (attempt - 1))))
+            attempt += 1
+    return wrapper
+
+
+def parse_amount(value):
+    """Convert request input to a positive Decimal with at most two decimal places."""
+    try:
+        # str() first so JSON floats such as 0.1 become Decimal('0.1') exactly
+        amount = Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise InvalidAmount('Invalid amount')
+    if not amount.is_finite() or amount <= 0:
+        raise InvalidAmount()
+    if amount != amount.quantize(CENT):
+        raise InvalidAmount('Amount cannot have more than 2 decimal places')
+    return amount
+
+
+def _lock_accounts(account_numbers, credited=()):
+    """
+    Lock the given accounts with SELECT ... FOR UPDATE in primary-key order and
+    return them keyed by account number. Striped accounts among ``credited``
+    are read without a lock; their credits go through _post_to_stripe().
+    """
+    numbers = set(account_numbers)
+    accounts = Account.objects.select_for_update().filter(account_number__in=numbers)
+    if credited:
+        accounts = accounts.exclude(account_number__in=credited, stripe_count__gt=1)
+    locked = {account.account_number: account for account in accounts.order_by('pk')}
+    if credited and len(locked) < len(numbers):
+        locked.update(
+            (account.account_number, account)
+            for account in Account.objects.filter(account_number__in=numbers - locked.keys(), stripe_count__gt=1)
+        )
+    if any(number not in locked for number in account_numbers):
+        raise AccountNotFound()
+    return locked
+
+
+def _consolidate(accounts):
+    """Fold the stripes of any striped ``accounts`` (locked by the caller) into their balance."""
+    striped = {account.pk: account for account in accounts if account.stripe_count > 1}
+    if striped:
+        for pk, amount in striping.consolidate(list(striped)).items():
+            striped[pk].balance += amount
+
+
+def _ledger_row(account, transaction_type, amount, balance_after, delta, description, user,
+                reference_number=None, transaction_id=None):
+    """An unsaved COMPLETED Transaction moving ``account`` by ``delta`` to ``balance_after``."""
+    return Transaction(
+        transaction_id=transaction_id or ids.transaction_id(),
+        account=account,
+        transaction_type=transaction_type,
+        amount=amount,
+        balance_before=balance_after - delta,
+        balance_after=balance_after,
+        description=description,
+        status='COMPLETED',
+        processed_by=user,
+        reference_number=reference_number,
+    )
+
+
+def _post(account, transaction_type, amount, delta, description, user, reference_number=None):
+    """Apply ``delta`` to a locked account and write its ledger row."""
+    Account.objects.filter(pk=account.pk).update(
+        balance=F('balance') + delta,
+        updated_at=timezone.now(),
+    )
+    account.balance += delta
+
+    transaction = _ledger_row(account, transaction_type, amount, account.balance, delta, description, user,
+                              reference_number)
+    transaction.save(force_insert=True)
+    return transaction
+
+
+def _post_to_stripe(account, transaction_type, amount, description, user, reference_number=None):
+    """Credit a striped account, read but not locked by _lock_accounts(), through one of its stripes."""
+    transaction_id = ids.transaction_id()
+    if not striping.credit(account, transaction_id, amount):
+        account = Account.objects.select_for_update().get(pk=account.pk)
+        return _post(account, transaction_type, amount, amount, description, user, reference_number)
+
+    transaction = _ledger_row(account, transaction_type, amount, account.consolidated_balance(), amount,
+                              description, user, reference_number, transaction_id)
+    transaction.save(force_insert=True)
+    return transaction
+
+
+def _fast_path(*refs):
+    """Whether a posting between the accounts of ``refs`` can use UPDATE ... RETURNING."""
+    return (
+        connection.vendor in ('postgresql', 'sqlite')
+        and connection.features.can_return_columns_from_insert  # RETURNING support (SQLite 3.35+)
+        and all(ref is not None and ref.fast_path for ref in refs)
+    )
+
+
+def _update_returning(ref, delta):
+    """
+    Apply ``delta`` to an ACTIVE, unstriped account with one UPDATE ... RETURNING;
+    a debit (negative ``delta``) also requires the balance to stay non-negative.
+    Credits are accepted whatever the balance, as on the locking path. Returns the
+    new balance, or None if the row did not qualify.
+    """
+    qn = connection.ops.quote_name
+    balance = qn('balance')
+    params = [delta, connection.ops.adapt_datetimefield_value(timezone.now()), ref.pk]
+    funds_check = ''
+    if delta < 0:
+        funds_check = f"AND {balance} + CAST(%s AS NUMERIC) >= 0 "
+        params.append(delta)
+    sql = (
+        f"UPDATE {qn(Account._meta.db_table)} SET {balance} = {balance} + CAST(%s AS NUMERIC), {qn('updated_at')} = %s "
+        f"WHERE {qn('id')} = %s AND {qn('status')} = 'ACTIVE' AND {qn('stripe_count')} <= 1 "
+        f"{funds_check}"
+        f"RETURNING {balance}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    # SQLite hands back a float; quantizing its shortest repr restores the exact amount
+    return None if row is None else Decimal(str(row[0])).quantize(CENT)
+
+
+def _reject(refs, inactive_message=None):
+    """
+    Raise the reason an UPDATE ... RETURNING on the accounts of ``refs`` matched
+    no row. Returns instead if one of them has been striped since it was cached;
+    the caller then takes the locking path.
+    """
+    rows = {
+        pk: (status, stripe_count)
+        for pk, status, stripe_count in Account.objects.filter(pk__in=[ref.pk for ref in refs])
+        .values_list('pk', 'status', 'stripe_count')
+    }
+    for ref in refs:
+        if rows.get(ref.pk) != (ref.status, ref.stripe_count):
+            account_cache.invalidate(ref.account_number)
+    if len(rows) < len(refs):
+        raise AccountNotFound()
+    if any(status != 'ACTIVE' for status, _ in rows.values()):
+        raise AccountInactive(inactive_message)
+    if any(stripe_count > 1 for _, stripe_count in rows.values()):
+        return
+    raise InsufficientFunds()
+
+
+def _credit(account, transaction_type, amount, description, user, reference_number=None):
+    if account.stripe_count > 1:
+        return _post_to_stripe(account, transaction_type, amount, description, user, reference_number)
+    return _post(account, transaction_type, amount, amount, description, user, reference_number)
+
+
+@_counted('DEPOSIT')
+@_retried
+def deposit(account_number, amount, description='Deposit', user=None):
+    amount = parse_amount(amount)
+    ref = account_cache.lookup(account_number)
+    with write_atomic():
+        if _fast_path(ref):
+            balance_after = _update_returning(ref, amount)
+            if balance_after is not None:
+                transaction = _ledger_row(ref.as_account(balance=balance_after), 'DEPOSIT', amount, balance_after,
+                                          amount, description, user)
+                transaction.save(force_insert=True)
+                return transaction
+            _reject([ref])
+
+        account = _lock_accounts([account_number], credited=[account_number])[account_number]
+        if account.status != 'ACTIVE':
+            raise AccountInactive()
+        return _credit(account, 'DEPOSIT', amount, description, user)
+
+
+@_counted('WITHDRAWAL')
+@_retried
+def withdraw(account_number, amount, description='Withdrawal', user=None):
+    amount = parse_amount(amount)
+    ref = account_cache.lookup(account_number)
+    with write_atomic():
+        if _fast_path(ref):
+            balance_after = _update_returning(ref, -amount)
+            if balance_after is not None:
+                transaction = _ledger_row(ref.as_account(balance=balance_after), 'WITHDRAWAL', amount,
+                                          balance_after, -amount, description, user)
+                transaction.save(force_insert=True)
+                return transaction
+            _reject([ref])
+
+        account = _lock_accounts([account_number])[account_number]
+        if account.status != 'ACTIVE':
+            raise AccountInactive()
+        _consolidate([account])
+        if account.balance < amount:
+            raise InsufficientFunds()
+        return _post(account, 'WITHDRAWAL', amount, -amount, description, user)
+
+
+@_counted('TRANSFER', legs=2)
+@_retried
+def transfer(from_account_number, to_account_number, amount, description='Transfer', user=None):
+    """Move funds between two accounts; returns the (debit, credit) ledger rows."""
+    amount = parse_amount(amount)
+    if from_account_number == to_account_number:
+        raise PostingError('Cannot transfer to the same account')
+
+    source = account_cache.lookup(from_account_number)
+    target = account_cache.lookup(to_account_number)
+    with write_atomic():
+        if _fast_path(source, target):
+            legs = _fast_transfer(source, target, amount, description, user)
+            if legs is not None:
+                return legs
+
+        locked = _lock_accounts([from_account_number, to_account_number], credited=[to_account_number])
+        from_account = locked[from_account_number]
+        to_account = locked[to_account_number]
+
+        if from_account.status != 'ACTIVE' or to_account.status != 'ACTIVE':
+            raise AccountInactive('One or both accounts are not active')
+        _consolidate([from_account])
+        if from_account.balance < amount:
+            raise InsufficientFunds()
+
+        debit = _post(
+            from_account, 'TRANSFER', amount, -amount,
+            f"{description} - To {to_account_number}", user,
+        )
+        credit = _credit(
+            to_account, 'TRANSFER', amount,
+            f"{description} - From {from_account_number}", user,
+            reference_number=debit.transaction_id,
+        )
+        return debit, credit
+
+
+def _fast_transfer(source, target, amount, description, user):
+    """Post a transfer with UPDATE ... RETURNING; returns (debit, credit), or None to take the locking path."""
+    balances = {}
+    # Primary-key order, as everywhere else
+    for ref, delta in sorted(((source, -amount), (target, amount)), key=lambda leg: leg[0].pk):
+        balances[ref.pk] = _update_returning(ref, delta)
+        if balances[ref.pk] is None:
+            _reject([source, target], 'One or both accounts are not active')
+            # A leg's account was striped since it was cached: undo the leg already
+            # applied (its row stays locked) and let the caller take the locking path
+            for applied, applied_delta in ((source, -amount), (target, amount)):
+                if balances.get(applied.pk) is not None:
+                    Account.objects.filter(pk=applied.pk).update(balance=F('balance') - applied_delta)
+            return None
+
+    debit = _ledger_row(
+        source.as_account(balance=balances[source.pk]), 'TRANSFER', amount, balances[source.pk], -amount,
+        f"{description} - To {target.account_number}", user,
+    )
+    credit = _ledger_row(
+        target.as_account(balance=balances[target.pk]), 'TRANSFER', amount, balances[target.pk], amount,
+        f"{description} - From {source.account_number}", user,
+        reference_number=debit.transaction_id,
+    )
+    Transaction.objects.bulk_create([debit, credit])
+    return debit, credit
+
+
+@_counted('LOAN_DISBURSEMENT')
+@_retried
+def disburse_loan(loan, user=None):
+    """Credit an approved loan's principal to its account and mark it DISBURSED."""
+    with write_atomic():
+        loan = Loan.objects.select_for_update().get(pk=loan.pk)
+        if loan.status != 'APPROVED':
+            raise InvalidLoanState()
+
+        account = Account.objects.select_for_update().get(pk=loan.account_id)
+        if account.status != 'ACTIVE':
+            raise AccountInactive()
+
+        transaction = _post(
+            account, 'LOAN_DISBURSEMENT', loan.principal_amount, loan.principal_amount,
+            f"Loan disbursement - {loan.loan_id}", user,
+        )
+
+        loan.account = account
+        loan.status = 'DISBURSED'
+        loan.disbursement_date = timezone.now()
+        loan.save(update_fields=['status', 'disbursement_date'])
+        return loan, transaction
+
+
+@dataclass
+class BatchPosting:
+    """One ledger row to be written by :func:`post_batch`."""
+    account: object  # account number, or primary key when lookup='pk'
+    transaction_type: str
+    amount: Decimal
+    credit: bool = True
+    description: str = ''
+    user: object = None
+    reference_number: str = None
+
+
+def value_by_pk(model, items, output_field):
+    """
+    ``CASE <pk> WHEN %s THEN %s ... END`` over ``(pk, value)`` pairs, for bulk
+    UPDATEs. Written as one RawSQL expression: resolving a When() per row costs
+    the ORM far more than the UPDATE itself takes to run.
+    """
+    column = connection.ops.quote_name(model._meta.pk.column)
+    return RawSQL(
+        f"CASE {column} {' '.join(['WHEN %s THEN %s'] * len(items))} END",
+        [value for item in items for value in item],
+        output_field=output_field,
+    )
+
+
+def amount_by_pk(model, items):
+    return value_by_pk(model, items, DecimalField(max_digits=15, decimal_places=2))
+
+
+def _apply_deltas(deltas):
+    """Apply per-account balance deltas with one CASE ... WHEN UPDATE per chunk."""
+    items = sorted((pk, delta) for pk, delta in deltas.items() if delta)
+    now = timezone.now()
+    for start in range(0, len(items), BALANCE_UPDATE_CHUNK_SIZE):
+        chunk = items[start:start + BALANCE_UPDATE_CHUNK_SIZE]
+        Account.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            balance=F('balance') + amount_by_pk(Account, chunk),
+            updated_at=now,
+        )
+
+
+@_retried
+def post_batch(postings, lookup='account_number'):
+    """
+    Write many postings in a single database transaction.
+
+    Accounts are looked up by ``lookup`` (``account_number`` or ``pk``) and
+    locked in primary-key order. Postings are validated in the order given, so
+    a debit sees the credits queued before it. Striped accounts are
+    consolidated first, so every check sees the exact balance. Rows are
+    inserted with one ``bulk_create`` and each account's net delta is applied once.
+
+    Returns one entry per posting: the created Transaction, or the
+    PostingError explaining why that row was rejected.
+    """
+    postings = list(postings)
+    with write_atomic():
+        accounts = {
+            getattr(account, lookup): account
+            for account in Account.objects.select_for_update()
+            .filter(**{f'{lookup}__in': {p.account for p in postings}})
+            .order_by('pk')
+        }
+        _consolidate(accounts.values())
+
+        results, rows, deltas = [], [], {}
+        for entry in postings:
+            account = accounts.get(entry.account)
+            try:
+                amount = parse_amount(entry.amount)
+                if account is None:
+                    raise AccountNotFound()
+                if account.status != 'ACTIVE':
+                    raise AccountInactive()
+                delta = amount if entry.credit else -amount
+                if account.balance + delta < 0:
+                    raise InsufficientFunds()
+            except PostingError as e:
+                results.append(e)
+                continue
+
+            account.balance += delta
+            deltas[account.pk] = deltas.get(account.pk, 0) + delta
+
+            transaction = _ledger_row(account, entry.transaction_type, amount, account.balance, delta,
+                                      entry.description, entry.user, entry.reference_number)
+            rows.append(transaction)
+            results.append(transaction)
+
+        Transaction.objects.bulk_create(rows)
+        _apply_deltas(deltas)
+
+    for entry, result in zip(postings, results):
+        status = 'FAILED' if isinstance(result, PostingError) else 'COMPLETED'
+        metrics.POSTINGS.inc(entry.transaction_type, status)
+    return results
@@ -0,0 +1,160 @@
+"""
+Fast JSON and MessagePack renderers and parsers for the API.
+
+DRF's JSONRenderer encodes through the stdlib ``json`` module and calls its
+encoder's default() for every Decimal and datetime. ORJSONRenderer and
+ORJSONParser are drop-in replacements built on orjson. They are selected in
+``REST_FRAMEWORK`` (``JSON_BACKEND`` in BankWebsite/settings.py).
+
+Output matches JSONRenderer, with one deliberate difference: a Decimal that
+reaches the renderer unserialized, such as the balance endpoint's balance, is
+written as an exact string ("1050.25") instead of a float. Serializer fields
+already render Decimals as strings, so both now look the same. Datetimes are
+written as DRF writes them (ISO 8601, "Z" for UTC), \u2028 and \u2029 are
+escaped, and ``indent`` (from the Accept header or the browsable API) gives
+two-space indentation, the only indent orjson supports. Anything else orjson
+cannot encode natively goes through DRF's encoder.
+
+MessagePackRenderer and MessagePackParser serve ``application/msgpack`` (or
+``?format=msgpack``) for internal services. Decimals are exact strings, as in
+JSON. Timestamps are integers: microseconds since the Unix epoch. For that,
+views with EpochTimestampsMixin turn on epoch_timestamps() for requests that
+negotiated MessagePack, and TimestampField and the ValuesSerializers then
+produce the integers themselves. So ``response.data``, and the idempotency
+replays stored from it, already hold them. A key used for a MessagePack
+request cannot be replayed as JSON, or the reverse; the idempotency
+fingerprint includes the timestamp format.
+"""
+import contextvars
+import datetime
+import decimal
+from contextlib import contextmanager
+
+import msgpack
+import orjson
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+# Initial MessagePack output buffer. msgpack's default of 256 KiB outweighs a
+# statement page; the buffer grows as needed for larger ones.
+BUFFER_SIZE = 16 * 1024
+
+_drf_default = JSONEncoder().default
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+_epoch_timestamps = contextvars.ContextVar('banking_epoch_timestamps', default=False)
+
+
+def epoch_timestamps():
+    """True while serializing a response that encodes timestamps as epoch microseconds."""
+    return _epoch_timestamps.get()
+
+
+@contextmanager
+def use_epoch_timestamps():
+    """Turn epoch_timestamps() on for the block, outside a view (scripts, benchmarks)."""
+    token = _epoch_timestamps.set(True)
+    try:
+        yield
+    finally:
+        _epoch_timestamps.reset(token)
+
+
+def epoch_microseconds(value):
+    """Microseconds since the Unix epoch of a datetime; naive ones are in the current time zone."""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return format(value, 'f')
+    return _drf_default(value)
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        option = OPTIONS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        ret = orjson.dumps(data, default=_default, option=option)
+        # Keep the output a strict JavaScript subset, as JSONRenderer does
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                body = body.decode(encoding)
+            # orjson rejects NaN and Infinity, like JSONParser with STRICT_JSON
+            return orjson.loads(body)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+def _msgpack_default(value):
+    if isinstance(value, decimal.Decimal):
+        return format(value, 'f')
+    if isinstance(value, datetime.datetime):
+        return epoch_microseconds(value)
+    return _drf_default(value)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    epoch_timestamps = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_msgpack_default, buf_size=BUFFER_SIZE)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read())
+        except (msgpack.UnpackException, ValueError) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
+
+
+class EpochTimestampsMixin:
+    """
+    Turn on epoch_timestamps() for requests whose negotiated renderer sets
+    ``epoch_timestamps`` (MessagePackRenderer).
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if getattr(request.accepted_renderer, 'epoch_timestamps', False):
+            self._epoch_timestamps_token = _epoch_timestamps.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_epoch_timestamps_token', None)
+        if token is not None:
+            _epoch_timestamps.reset(token)
+            self._epoch_timestamps_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
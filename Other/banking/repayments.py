@@ -0,0 +1,260 @@
+"""
+Loan repayments.
+
+The interest part of a repayment is the interest owed on the outstanding
+balance. It accrues from the loan's last payment that covered all the interest
+then owed, or from its disbursement, on the 30/360 day count the amortization
+schedules use (amortization.accrued_interest), less any interest paid since.
+A payment smaller than the interest owed goes entirely to interest and leaves
+the rest owed, so accrual does not restart until the interest is paid off. The
+rest of a payment reduces the principal. A payment larger than the outstanding
+balance plus the interest owed is rejected.
+
+A repayment debits the loan's account with a LOAN_REPAYMENT ledger row. In the
+same database transaction it writes the LoanPayment and lowers
+``Loan.outstanding_balance`` with an F() expression. A DISBURSED loan becomes
+ACTIVE and any loan becomes PAID once nothing is outstanding. A DEFAULTED loan
+stays defaulted until it is paid off. Loans are locked before accounts (see
+banking/posting.py).
+
+repay_loan() handles a single payment. repay_batch() applies a chunk of
+repayment-file rows. It runs one locking query per table and reads the loans'
+accrual state with two more, posts the debits through post_batch, writes the
+LoanPayments with one bulk_create, and lowers all the balances with CASE/WHEN
+UPDATEs.
+"""
+from decimal import Decimal
+
+from django.db.models import Case, F, Max, Value, When
+from django.utils import timezone
+
+from . import ids, metrics
+from .amortization import accrued_interest, days_360
+from .models import Account, Loan, LoanPayment
+from .posting import (
+    BALANCE_UPDATE_CHUNK_SIZE, AccountInactive, BatchPosting, InsufficientFunds, InvalidAmount,
+    InvalidLoanState, LoanNotFound, PostingError, _consolidate, _counted, _post, _retried, amount_by_pk,
+    parse_amount, post_batch, write_atomic,
+)
+
+REPAYABLE_STATUSES = ('DISBURSED', 'ACTIVE', 'DEFAULTED')
+REPAYMENT_CHUNK_SIZE = 2000
+
+
+class LoanNotRepayable(InvalidLoanState):
+    default_message = 'Only disbursed, active or defaulted loans can be repaid'
+
+
+def accruals(loans):
+    """
+    Map each loan's pk to ``(start, paid)``: the local date its interest accrues
+    from and the interest already paid since then. ``start`` is the date of the
+    last payment that reduced the principal (and so covered all the interest),
+    else the disbursement (or approval, or application) date.
+    """
+    payments = LoanPayment.objects.filter(loan__in=[loan.pk for loan in loans])
+    last = dict(
+        payments.filter(principal_paid__gt=0)
+        .values('loan').annotate(last=Max('payment_date')).values_list('loan', 'last')
+    )
+    paid = {}
+    for loan_pk, payment_date, interest in payments.filter(principal_paid=0).values_list(
+        'loan', 'payment_date', 'interest_paid',
+    ):
+        if last.get(loan_pk) is None or payment_date > last[loan_pk]:
+            paid[loan_pk] = paid.get(loan_pk, Decimal('0.00')) + interest
+    return {
+        loan.pk: (
+            timezone.localtime(
+                last.get(loan.pk) or loan.disbursement_date or loan.approval_date or loan.application_date
+            ).date(),
+            paid.get(loan.pk, Decimal('0.00')),
+        )
+        for loan in loans
+    }
+
+
+def split_repayment(outstanding, annual_rate, amount, days, interest_paid=Decimal('0.00')):
+    """
+    Return the ``(interest, principal)`` parts of a payment of ``amount``, made
+    ``days`` 30/360 days after accrual started, with ``interest_paid`` paid since.
+    """
+    owed = max(accrued_interest(outstanding, annual_rate, max(days, 0)) - interest_paid, Decimal('0.00'))
+    interest = min(owed, amount)
+    principal = amount - interest
+    if principal > outstanding:
+        raise InvalidAmount(f'Repayment exceeds the amount due ({outstanding + owed})')
+    return interest, principal
+
+
+def _description(loan):
+    return f"Loan repayment - {loan.loan_id}"
+
+
+@_counted('LOAN_REPAYMENT')
+@_retried
+def repay_loan(loan, amount, user=None):
+    """Apply one repayment; returns the updated loan and its LoanPayment."""
+    amount = parse_amount(amount)
+    with write_atomic():
+        loan = Loan.objects.select_for_update().get(pk=loan.pk)
+        if loan.status not in REPAYABLE_STATUSES:
+            raise LoanNotRepayable()
+        start, paid = accruals([loan])[loan.pk]
+        interest, principal = split_repayment(
+            loan.outstanding_balance, loan.interest_rate, amount, days_360(start, timezone.localdate()), paid,
+        )
+
+        account = Account.objects.select_for_update().get(pk=loan.account_id)
+        if account.status != 'ACTIVE':
+            raise AccountInactive()
+        _consolidate([account])
+        if account.balance < amount:
+            raise InsufficientFunds()
+
+        transaction = _post(
+            account, 'LOAN_REPAYMENT', amount, -amount, _description(loan), user,
+            reference_number=loan.loan_id,
+        )
+
+        balance_after = loan.outstanding_balance - principal
+        loan_status = 'PAID' if balance_after == 0 else 'ACTIVE' if loan.status == 'DISBURSED' else loan.status
+        Loan.objects.filter(pk=loan.pk).update(
+            outstanding_balance=F('outstanding_balance') - principal,
+            status=loan_status,
+        )
+        loan.outstanding_balance = balance_after
+        loan.status = loan_status
+        loan.account = account
+
+        payment = LoanPayment.objects.create(
+            loan=loan,
+            payment_id=ids.payment_id(),
+            amount=amount,
+            principal_paid=principal,
+            interest_paid=interest,
+            balance_after=balance_after,
+            transaction=transaction,
+        )
+        return loan, payment
+
+
+def _reduce_outstanding(principal_by_loan, paid_off):
+    """Lower each loan's outstanding balance with one CASE ... WHEN UPDATE per chunk."""
+    items = sorted(principal_by_loan.items())
+    for start in range(0, len(items), BALANCE_UPDATE_CHUNK_SIZE):
+        chunk = items[start:start + BALANCE_UPDATE_CHUNK_SIZE]
+        Loan.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            outstanding_balance=F('outstanding_balance') - amount_by_pk(Loan, chunk),
+            status=Case(
+                When(pk__in=paid_off, then=Value('PAID')),
+                When(status='DISBURSED', then=Value('ACTIVE')),
+                default=F('status'),
+            ),
+        )
+
+
+@_retried
+def repay_batch(entries, user=None):
+    """
+    Apply ``(loan_id, amount)`` repayments in one database transaction, in the
+    order given; returns a LoanPayment or the PostingError rejecting it, per entry.
+    """
+    entries = list(entries)
+    results = [None] * len(entries)
+    with write_atomic():
+        loans = {
+            loan.loan_id: loan
+            for loan in Loan.objects.select_for_update()
+            .filter(loan_id__in={loan_id for loan_id, _ in entries})
+            .order_by('pk')
+            .only('pk', 'loan_id', 'account_id', 'status', 'interest_rate', 'outstanding_balance',
+                  'disbursement_date', 'approval_date', 'application_date')
+        }
+        accrual_by_loan = accruals(loans.values())
+        today = timezone.localdate()
+        accounts = {
+            account.pk: account
+            for account in Account.objects.select_for_update()
+            .filter(pk__in={loan.account_id for loan in loans.values()})
+            .order_by('pk')
+            .only('pk', 'status', 'balance', 'stripe_count')
+        }
+        _consolidate(accounts.values())
+
+        # Validate in file order against running balances, so that post_batch
+        # (which re-checks the same locked rows) accepts every planned debit
+        planned = []
+        for index, (loan_id, amount) in enumerate(entries):
+            try:
+                amount = parse_amount(amount)
+                loan = loans.get(loan_id)
+                if loan is None:
+                    raise LoanNotFound()
+                if loan.status not in REPAYABLE_STATUSES:
+                    raise LoanNotRepayable()
+                start, paid = accrual_by_loan[loan.pk]
+                interest, principal = split_repayment(
+                    loan.outstanding_balance, loan.interest_rate, amount, days_360(start, today), paid,
+                )
+                account = accounts[loan.account_id]
+                if account.status != 'ACTIVE':
+                    raise AccountInactive()
+                if account.balance < amount:
+                    raise InsufficientFunds()
+            except PostingError as e:
+                results[index] = e
+                continue
+
+            account.balance -= amount
+            loan.outstanding_balance -= principal
+            # Interest left owed keeps accruing from the same start
+            accrual_by_loan[loan.pk] = (today, Decimal('0.00')) if principal else (start, paid + interest)
+            if loan.outstanding_balance == 0:
+                loan.status = 'PAID'
+            planned.append((index, loan, amount, interest, principal, loan.outstanding_balance))
+
+        transactions = post_batch(
+            [
+                BatchPosting(
+                    account=loan.account_id,
+                    transaction_type='LOAN_REPAYMENT',
+                    amount=amount,
+                    credit=False,
+                    description=_description(loan),
+                    user=user,
+                    reference_number=loan.loan_id,
+                )
+                for _, loan, amount, _, _, _ in planned
+            ],
+            lookup='pk',
+        )
+        for transaction in transactions:
+            if isinstance(transaction, PostingError):
+                # Cannot happen after the checks above; never leave loans and ledger out of step
+                raise transaction
+
+        payments = []
+        principal_by_loan = {}
+        for (index, loan, amount, interest, principal, balance_after), transaction in zip(planned, transactions):
+            payment = LoanPayment(
+                loan=loan,
+                payment_id=ids.payment_id(),
+                amount=amount,
+                principal_paid=principal,
+                interest_paid=interest,
+                balance_after=balance_after,
+                transaction=transaction,
+            )
+            payments.append(payment)
+            results[index] = payment
+            principal_by_loan[loan.pk] = principal_by_loan.get(loan.pk, 0) + principal
+
+        LoanPayment.objects.bulk_create(payments)
+        paid_off = [loan.pk for loan in loans.values() if loan.status == 'PAID' and loan.pk in principal_by_loan]
+        _reduce_outstanding(principal_by_loan, paid_off)
+
+    rejected = sum(isinstance(result, PostingError) for result in results)
+    if rejected:
+        metrics.POSTINGS.inc('LOAN_REPAYMENT', 'FAILED', amount=rejected)
+    return results
@@ -0,0 +1,99 @@
+"""
+Read-replica routing for read-only API traffic.
+
+ReplicaRouter sends every write to ``default``. Reads also go to ``default``
+unless the current request has opted in to a replica. ReplicaReadMixin opts
+in, after authentication, for safe-method requests to the viewset actions
+listed in ``replica_actions``. It picks one replica from
+``WEKEZA_DB_ROUTING['REPLICAS']`` for the whole request, so all reads in a
+request see the same snapshot.
+
+Replicas lag behind the primary. So that users read their own writes, any
+successful unsafe request (a deposit, a transfer, a loan application) makes
+its user sticky: for STICKY_SECONDS that user's reads stay on ``default``.
+Sticky users are tracked in the Django cache. With several processes or hosts,
+configure a shared cache so that stickiness follows the user across them.
+"""
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+DEFAULTS = {
+    'REPLICAS': [],
+    'STICKY_SECONDS': 5,
+}
+
+_replica = contextvars.ContextVar('banking_read_replica', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'WEKEZA_DB_ROUTING', {})}
+
+
+def _sticky_key(user):
+    return f'banking:db-sticky:{user.pk}'
+
+
+def stick(user):
+    """Keep ``user``'s reads on the primary for STICKY_SECONDS."""
+    cache.set(_sticky_key(user), True, get_config()['STICKY_SECONDS'])
+
+
+def is_sticky(user):
+    return bool(cache.get(_sticky_key(user)))
+
+
+def choose_replica(user):
+    """The replica alias for a read-only request by ``user``, or None to read from the primary."""
+    replicas = get_config()['REPLICAS']
+    if not replicas or (user.is_authenticated and is_sticky(user)):
+        return None
+    return random.choice(replicas)
+
+
+def current_replica():
+    return _replica.get()
+
+
+class ReplicaRouter:
+    """Database router; see the module docstring."""
+
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        aliases = {'default', *get_config()['REPLICAS']}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Serve safe-method requests to ``replica_actions`` from a read replica,
+    and make users sticky to the primary after a successful write.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and self.action in self.replica_actions:
+            alias = choose_replica(request.user)
+            if alias is not None:
+                self._replica_token = _replica.set(alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _replica.reset(token)
+            self._replica_token = None
+        elif request.method not in SAFE_METHODS and response.status_code < 400 and request.user.is_authenticated:
+            stick(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,16 +1,37 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Customer, Account, Transaction, Loan, Card, LoanPayment
+from django.db import models
+from . import ids, renderers
+from .fast_serializers import ValuesSerializer
+from .instrumentation import InstrumentedSerializerMixin
+from .models import Customer, Account, Transaction, Loan, Card, LoanPayment, TransferBatch
 
 
-class UserSerializer(serializers.ModelSerializer):
+class TimestampField(serializers.DateTimeField):
+    """DateTimeField giving epoch microseconds instead of ISO 8601 while renderers.epoch_timestamps() is on"""
+    
+    def to_representation(self, value):
+        if value and renderers.epoch_timestamps():
+            return renderers.epoch_microseconds(value)
+        return super().to_representation(value)
+
+
+class TimestampFieldsMixin:
+    """Maps model DateTimeFields to TimestampField"""
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.DateTimeField: TimestampField,
+    }
+
+
+class UserSerializer(InstrumentedSerializerMixin, TimestampFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
         read_only_fields = ['id']
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(InstrumentedSerializerMixin, TimestampFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     full_name = serializers.SerializerMethodField()
     
@@ -23,19 +44,21 @@ class CustomerSerializer(serializers.ModelSerializer):
         return obj.user.get_full_name()
 
 
-class AccountSerializer(serializers.ModelSerializer):
+class AccountSerializer(InstrumentedSerializerMixin, TimestampFieldsMixin, serializers.ModelSerializer):
     customer_name = serializers.SerializerMethodField()
+    balance = serializers.DecimalField(max_digits=15, decimal_places=2, source='consolidated_balance', read_only=True)
     
     class Meta:
         model = Account
         fields = '__all__'
-        read_only_fields = ['account_number', 'balance', 'created_at', 'updated_at']
+        # stripe_count only changes through striping.set_stripe_count() (the stripe_account command)
+        read_only_fields = ['account_number', 'balance', 'stripe_count', 'created_at', 'updated_at']
     
     def get_customer_name(self, obj):
         return obj.customer.user.get_full_name()
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(InstrumentedSerializerMixin, TimestampFieldsMixin, serializers.ModelSerializer):
     account_number = serializers.CharField(source='account.account_number', read_only=True)
     
     class Meta:
@@ -44,7 +67,17 @@ class TransactionSerializer(serializers.ModelSerializer):
         read_only_fields = ['transaction_id', 'balance_before', 'balance_after', 'created_at']
 
 
-class LoanSerializer(serializers.ModelSerializer):
+class TransactionRowSerializer(ValuesSerializer):
+    """TransactionSerializer's output from values_list() rows, for ledger listings"""
+    model = Transaction
+    fields = (
+        'id', 'account_number', 'transaction_id', 'transaction_type', 'amount', 'balance_before', 'balance_after',
+        'description', 'status', 'created_at', 'reference_number', 'account', 'processed_by',
+    )
+    sources = {'account_number': 'account__account_number'}
+
+
+class LoanSerializer(InstrumentedSerializerMixin, TimestampFieldsMixin, serializers.ModelSerializer):
     customer_name = serializers.SerializerMethodField()
     account_number = serializers.CharField(source='account.account_number', read_only=True)
     
@@ -57,7 +90,7 @@ class LoanSerializer(serializers.ModelSerializer):
         return obj.customer.user.get_full_name()
 
 
-class CardSerializer(serializers.ModelSerializer):
+class CardSerializer(InstrumentedSerializerMixin, TimestampFieldsMixin, serializers.ModelSerializer):
     account_number = serializers.CharField(source='account.account_number', read_only=True)
     masked_card_number = serializers.SerializerMethodField()
     
@@ -70,7 +103,7 @@ class CardSerializer(serializers.ModelSerializer):
         return f"**** **** **** {obj.card_number[-4:]}"
 
 
-class LoanPaymentSerializer(serializers.ModelSerializer):
+class LoanPaymentSerializer(InstrumentedSerializerMixin, TimestampFieldsMixin, serializers.ModelSerializer):
     loan_id = serializers.CharField(source='loan.loan_id', read_only=True)
     
     class Meta:
@@ -79,6 +112,21 @@ class LoanPaymentSerializer(serializers.ModelSerializer):
         read_only_fields = ['payment_id', 'payment_date']
 
 
+class TransferBatchSerializer(InstrumentedSerializerMixin, TimestampFieldsMixin, serializers.ModelSerializer):
+    source_account_number = serializers.CharField(source='source_account.account_number', read_only=True)
+    progress = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = TransferBatch
+        exclude = ['source_account', 'funding_transaction']
+    
+    def get_progress(self, obj):
+        """Share of the accepted lines credited or rejected so far, in percent"""
+        if not obj.accepted_lines:
+            return 100 if obj.status in ('COMPLETED', 'FAILED') else 0
+        return round(100 * obj.processed_lines / obj.accepted_lines, 1)
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, style={'input_type': 'password'})
     password2 = serializers.CharField(write_only=True, required=True, style={'input_type': 'password'})
@@ -115,11 +163,9 @@ class RegisterSerializer(serializers.ModelSerializer):
         )
         
         # Create customer profile
-        import random
-        customer_id = f"CUST{random.randint(100000, 999999)}"
         Customer.objects.create(
             user=user,
-            customer_id=customer_id,
+            customer_id=ids.customer_id(),
             phone_number=phone_number,
             address=address,
             date_of_birth=date_of_birth,
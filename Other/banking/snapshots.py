@@ -0,0 +1,137 @@
+"""
+End-of-day balance snapshots.
+
+build_daily_balances() writes one DailyBalance row per account for a day. It
+is incremental: each account's opening balance is the previous day's closing
+snapshot, and the day's activity is a single GROUP BY over that day's
+transactions. Each ledger row's net effect is taken as
+``balance_after - balance_before``. That keeps the job independent of
+transaction ordering, and transfers are counted correctly whichever leg they
+are. An account with no previous snapshot (first run, or a missed day) has its
+opening balance worked back from the live balance.
+
+balance_on() answers "what was the balance of X at the end of day D" with one
+index seek on (account_id, date), plus a short ledger scan only for days after
+the latest snapshot.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Account, DailyBalance, Transaction
+from .striping import stripe_total
+
+SNAPSHOT_CHUNK_SIZE = 5000
+ZERO = Decimal('0.00')
+
+BALANCE_FIELD = DecimalField(max_digits=15, decimal_places=2)
+NET_CHANGE = ExpressionWrapper(F('balance_after') - F('balance_before'), output_field=BALANCE_FIELD)
+
+
+def day_bounds(day):
+    """Return the aware ``[start, end)`` datetimes of a calendar day."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def _activity(account_ids, start, end):
+    rows = (
+        Transaction.objects
+        .filter(account_id__in=account_ids, status='COMPLETED', created_at__gte=start, created_at__lt=end)
+        .values('account_id')
+        .annotate(
+            net=Sum(NET_CHANGE),
+            credits=Sum('amount', filter=Q(balance_after__gt=F('balance_before'))),
+            debits=Sum('amount', filter=Q(balance_after__lt=F('balance_before'))),
+            count=Count('id'),
+        )
+    )
+    return {row['account_id']: row for row in rows}
+
+
+def _balances_at(account_ids, moment):
+    """Balance of each account at ``moment``, worked back from its live balance."""
+    later = Sum(
+        F('transactions__balance_after') - F('transactions__balance_before'),
+        filter=Q(transactions__created_at__gte=moment, transactions__status='COMPLETED'),
+        output_field=BALANCE_FIELD,
+    )
+    rows = (
+        Account.objects.filter(pk__in=account_ids)
+        .annotate(stripe_balance=stripe_total(), later=Coalesce(later, ZERO, output_field=BALANCE_FIELD))
+        .values_list('pk', 'balance', 'stripe_balance', 'later')
+    )
+    return {pk: balance + stripes - later for pk, balance, stripes, later in rows}
+
+
+def build_daily_balances(day, chunk_size=SNAPSHOT_CHUNK_SIZE):
+    """Write (or rewrite) the snapshot of every account for ``day``; returns the row count."""
+    start, end = day_bounds(day)
+    account_ids = Account.objects.filter(created_at__lt=end).order_by('pk').values_list('pk', flat=True)
+
+    built = 0
+    last_pk = 0
+    while True:
+        ids = list(account_ids.filter(pk__gt=last_pk)[:chunk_size])
+        if not ids:
+            return built
+        last_pk = ids[-1]
+
+        opening = dict(
+            DailyBalance.objects.filter(account_id__in=ids, date=day - timedelta(days=1))
+            .values_list('account_id', 'closing_balance')
+        )
+        missing = [pk for pk in ids if pk not in opening]
+        if missing:
+            opening.update(_balances_at(missing, start))
+
+        activity = _activity(ids, start, end)
+        rows = []
+        for pk in ids:
+            day_activity = activity.get(pk, {})
+            rows.append(DailyBalance(
+                account_id=pk,
+                date=day,
+                opening_balance=opening[pk],
+                closing_balance=opening[pk] + (day_activity.get('net') or ZERO),
+                total_credits=day_activity.get('credits') or ZERO,
+                total_debits=day_activity.get('debits') or ZERO,
+                transaction_count=day_activity.get('count', 0),
+            ))
+
+        DailyBalance.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['account', 'date'],
+            update_fields=['opening_balance', 'closing_balance', 'total_credits',
+                           'total_debits', 'transaction_count', 'built_at'],
+        )
+        built += len(rows)
+
+
+def balance_on(account, day):
+    """
+    Return ``(balance, source)`` for the end of ``day``; source is 'snapshot',
+    'snapshot+ledger' (latest snapshot plus later postings) or 'ledger'.
+    """
+    snapshot = (
+        account.daily_balances.filter(date__lte=day)
+        .order_by('-date')
+        .values_list('date', 'closing_balance')
+        .first()
+    )
+    if snapshot and snapshot[0] == day:
+        return snapshot[1], 'snapshot'
+
+    _, end = day_bounds(day)
+    completed = account.transactions.filter(status='COMPLETED')
+    if snapshot:
+        start, _ = day_bounds(snapshot[0] + timedelta(days=1))
+        net = completed.filter(created_at__gte=start, created_at__lt=end).aggregate(net=Sum(NET_CHANGE))['net']
+        return snapshot[1] + (net or ZERO), 'snapshot+ledger'
+
+    later = completed.filter(created_at__gte=end).aggregate(net=Sum(NET_CHANGE))['net']
+    return account.consolidated_balance() - (later or ZERO), 'ledger'
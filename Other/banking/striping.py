@@ -0,0 +1,110 @@
+"""
+Striped balances for hot collection accounts.
+
+Every posting to an account holds that account's row lock until it commits.
+For an account that many customers pay into at once, such as a paybill or
+collection account, this serialises all the transfers into it. Setting
+``Account.stripe_count`` to N > 1 spreads its credits over N AccountStripe
+rows. A credit picks its stripe by hashing its transaction id and adds to that
+row only, without locking the account, so up to N credits commit in parallel.
+
+The account's balance is ``Account.balance`` plus the sum of its stripes.
+Reads add the stripes up (``Account.consolidated_balance()``). Debits and
+batch jobs call consolidate() while holding the account lock. It locks the
+stripes and moves their balances into ``Account.balance``, so the debit checks
+and updates the exact balance.
+
+The balance_before/balance_after of a striped credit come from a read taken
+without the account lock. Its net (balance_after - balance_before) is always
+the amount, so snapshots stay exact, but the running balance shown on the
+statement of a striped account is approximate.
+
+Lock ordering rule: loans, then accounts in primary-key order, then stripes in
+(account, stripe) order.
+"""
+import zlib
+from collections import defaultdict
+
+from django.db import transaction as db_transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import account_cache
+from .models import Account, AccountStripe
+
+MAX_STRIPES = 64
+
+
+def stripe_for(transaction_id, stripe_count):
+    return zlib.crc32(transaction_id.encode()) % stripe_count
+
+
+def credit(account, transaction_id, amount):
+    """
+    Add ``amount`` to the stripe of ``account`` chosen by ``transaction_id``.
+    Returns False if that stripe no longer exists (the stripe count was lowered
+    since ``account`` was read); the caller must then credit the account row.
+    """
+    return bool(
+        AccountStripe.objects
+        .filter(account_id=account.pk, stripe=stripe_for(transaction_id, account.stripe_count))
+        .update(balance=F('balance') + amount)
+    )
+
+
+def consolidate(account_ids):
+    """
+    Move the stripe balances of the given accounts, locked by the caller, into
+    ``Account.balance``. Returns the amount moved per account.
+    """
+    stripes = list(
+        AccountStripe.objects.select_for_update()
+        .filter(account_id__in=account_ids)
+        .exclude(balance=0)
+        .order_by('account_id', 'stripe')
+        .values_list('pk', 'account_id', 'balance')
+    )
+    if not stripes:
+        return {}
+
+    moved = defaultdict(int)
+    for _, account_id, balance in stripes:
+        moved[account_id] += balance
+    AccountStripe.objects.filter(pk__in=[pk for pk, _, _ in stripes]).update(balance=0)
+    now = timezone.now()
+    for account_id, amount in moved.items():
+        Account.objects.filter(pk=account_id).update(balance=F('balance') + amount, updated_at=now)
+    return dict(moved)
+
+
+def stripe_total():
+    """Subquery expression for the sum of an account's stripes, to add to ``balance`` in annotations."""
+    total = (
+        AccountStripe.objects.filter(account=OuterRef('pk'))
+        .values('account')
+        .annotate(total=Sum('balance'))
+        .values('total')
+    )
+    return Coalesce(Subquery(total), 0, output_field=DecimalField(max_digits=15, decimal_places=2))
+
+
+def set_stripe_count(account, stripe_count):
+    """Stripe ``account`` over ``stripe_count`` rows (1 turns striping off); returns the account."""
+    if not 1 <= stripe_count <= MAX_STRIPES:
+        raise ValueError(f'stripe_count must be between 1 and {MAX_STRIPES}')
+    with db_transaction.atomic():
+        account = Account.objects.select_for_update().get(pk=account.pk)
+        # Lock every stripe, empty ones too, so no credit lands on a stripe being deleted
+        list(AccountStripe.objects.select_for_update().filter(account=account).order_by('stripe').values_list('pk'))
+        consolidate([account.pk])
+        stripes = stripe_count if stripe_count > 1 else 0
+        AccountStripe.objects.filter(account=account, stripe__gte=stripes).delete()
+        AccountStripe.objects.bulk_create(
+            [AccountStripe(account=account, stripe=stripe) for stripe in range(stripes)],
+            ignore_conflicts=True,
+        )
+        Account.objects.filter(pk=account.pk).update(stripe_count=stripe_count)
+        account_cache.invalidate(account.account_number)
+        account.refresh_from_db()
+        return account
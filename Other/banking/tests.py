@@ -1,3 +1,1464 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import (
+    account_cache, aging, amortization, batch_transfers, fees, group_commit, idempotency, ids, interest, metrics, posting, renderers, repayments,
+    routing, snapshots, striping,
+)
+from .serializers import TransactionRowSerializer, TransactionSerializer
+from .models import (
+    Customer, Account, AccountStripe, Transaction, Loan, LoanPayment, LoanAging, IdBlock, DailyBalance,
+    FeeSchedule, IdempotencyKey, TransferBatch,
+)
+
+
+def make_customer(username='customer1', is_staff=False):
+    user = User.objects.create_user(username=username, password='pass', is_staff=is_staff,
+                                    first_name='Jane', last_name='Doe')
+    customer = Customer.objects.create(
+        user=user,
+        customer_id=f"CUST-{username}",
+        phone_number='0700000000',
+        address='Nairobi',
+        date_of_birth=date(1990, 1, 1),
+        id_number=f"ID-{username}",
+    )
+    return user, customer
+
+
+@contextmanager
+def file_database():
+    """Run the block against a migrated, file-backed SQLite database instead of the in-memory test database."""
+    test_connection = connections['default']
+    with tempfile.TemporaryDirectory() as directory:
+        file_connection = type(test_connection)(
+            {**test_connection.settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3')}, 'default',
+        )
+        setattr(connections._connections, 'default', file_connection)
+        cache.clear()
+        account_cache.clear_local()
+        try:
+            call_command('migrate', verbosity=0)
+            yield
+        finally:
+            file_connection.close()
+            setattr(connections._connections, 'default', test_connection)
+            cache.clear()
+            account_cache.clear_local()
+
+
+def make_account(customer, account_number, balance='0.00', status='ACTIVE'):
+    return Account.objects.create(
+        customer=customer,
+        account_number=account_number,
+        account_type='SAVINGS',
+        balance=Decimal(balance),
+        status=status,
+    )
+
+
+class PostingEngineTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.source = make_account(self.customer, 'ACC001', '1000.00')
+        self.target = make_account(self.customer, 'ACC002', '50.00')
+
+    def test_deposit_updates_balance_and_ledger(self):
+        txn = posting.deposit('ACC001', '250.50', user=self.user)
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('1250.50'))
+        self.assertEqual(txn.balance_before, Decimal('1000.00'))
+        self.assertEqual(txn.balance_after, Decimal('1250.50'))
+        self.assertEqual(txn.status, 'COMPLETED')
+
+    def test_withdraw_rejects_insufficient_balance(self):
+        with self.assertRaises(posting.InsufficientFunds):
+            posting.withdraw('ACC002', '50.01')
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_rejects_bad_amounts_and_inactive_accounts(self):
+        for amount in ('0', '-5', 'abc', '1.001', 'NaN'):
+            with self.assertRaises(posting.InvalidAmount):
+                posting.deposit('ACC001', amount)
+        make_account(self.customer, 'ACC003', status='FROZEN')
+        with self.assertRaises(posting.AccountInactive):
+            posting.deposit('ACC003', '10')
+        with self.assertRaises(posting.AccountNotFound):
+            posting.deposit('MISSING', '10')
+
+    def test_transfer_posts_both_legs(self):
+        debit, credit = posting.transfer('ACC001', 'ACC002', '100.00')
+        self.source.refresh_from_db()
+        self.target.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('900.00'))
+        self.assertEqual(self.target.balance, Decimal('150.00'))
+        self.assertEqual(credit.reference_number, debit.transaction_id)
+
+    def test_transfer_failure_rolls_back_debit(self):
+        real_ledger_row = posting._ledger_row
+
+        def fail_on_credit(account, *args, **kwargs):
+            if account.account_number == 'ACC002':
+                raise RuntimeError('credit leg failed')
+            return real_ledger_row(account, *args, **kwargs)
+
+        for cache_enabled in (True, False):  # fast path, then locking path
+            with override_settings(WEKEZA_ACCOUNT_CACHE={'ENABLED': cache_enabled}), \
+                    mock.patch.object(posting, '_ledger_row', side_effect=fail_on_credit):
+                with self.assertRaises(RuntimeError):
+                    posting.transfer('ACC001', 'ACC002', '100.00')
+
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('1000.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_disburse_loan_only_once(self):
+        loan = Loan.objects.create(
+            customer=self.customer, account=self.target, loan_id='LN001', loan_type='PERSONAL',
+            principal_amount=Decimal('500.00'), interest_rate=Decimal('12.00'), term_months=12,
+            status='APPROVED',
+        )
+        posting.disburse_loan(loan)
+        with self.assertRaises(posting.InvalidLoanState):
+            posting.disburse_loan(loan)
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.balance, Decimal('550.00'))
+
+
+class PostBatchTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.hot = make_account(self.customer, 'ACC001', '0.00')
+        self.frozen = make_account(self.customer, 'ACC002', '10.00', status='FROZEN')
+
+    def test_per_row_results_and_running_balances(self):
+        entries = [
+            posting.BatchPosting('ACC001', 'DEPOSIT', Decimal('10.00')),
+            posting.BatchPosting('ACC001', 'DEPOSIT', Decimal('5.25')),
+            posting.BatchPosting('ACC002', 'DEPOSIT', Decimal('1.00')),
+            posting.BatchPosting('ACC001', 'WITHDRAWAL', Decimal('20.00'), credit=False),
+            posting.BatchPosting('MISSING', 'DEPOSIT', Decimal('1.00')),
+            posting.BatchPosting('ACC001', 'WITHDRAWAL', Decimal('15.25'), credit=False),
+        ]
+        results = posting.post_batch(entries)
+
+        self.assertEqual(results[1].balance_before, Decimal('10.00'))
+        self.assertEqual(results[1].balance_after, Decimal('15.25'))
+        self.assertIsInstance(results[2], posting.AccountInactive)
+        self.assertIsInstance(results[3], posting.InsufficientFunds)
+        self.assertIsInstance(results[4], posting.AccountNotFound)
+        self.assertEqual(results[5].balance_after, Decimal('0.00'))
+
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.balance, Decimal('0.00'))
+        self.assertEqual(Transaction.objects.count(), 3)
+
+    def test_group_committer_returns_each_callers_result(self):
+        committer = group_commit.GroupCommitter(window_ms=1, max_batch=10)
+        batch = [(posting.BatchPosting('ACC001', 'DEPOSIT', Decimal(amount)), Future())
+                 for amount in ('1.00', '2.00')]
+        batch.append((posting.BatchPosting('ACC002', 'DEPOSIT', Decimal('1.00')), Future()))
+
+        committer.flush(batch)
+
+        self.assertEqual(batch[1][1].result().balance_after, Decimal('3.00'))
+        self.assertIsInstance(batch[2][1].exception(), posting.AccountInactive)
+
+
+class IdGeneratorTests(TransactionTestCase):
+    def test_snowflake_ids_are_unique_and_time_ordered(self):
+        generator = ids.SnowflakeGenerator(node_id=7)
+        values = [generator.next_id() for _ in range(5000)]
+        self.assertEqual(values, sorted(set(values)))
+        encoded = [ids.encode(value) for value in values]
+        self.assertEqual(encoded, sorted(encoded))
+        self.assertLessEqual(len(ids.customer_id()), 20)
+
+    def test_snowflake_requires_a_configured_node_id(self):
+        for node_id in (None, '', 'host-a', 256, -1):
+            with self.assertRaises(ImproperlyConfigured):
+                ids.SnowflakeGenerator(node_id=node_id)
+        self.assertEqual(ids.SnowflakeGenerator(node_id='255').node_id, 255)
+
+    def test_block_sequence_reserves_one_block_per_block_size(self):
+        generator = ids.BlockSequenceGenerator(block_size=10)
+        values = [generator.next_id('transaction') for _ in range(25)]
+        self.assertEqual(values, list(range(1, 26)))
+        self.assertEqual(IdBlock.objects.get(name='transaction').next_value, 31)
+
+    def test_block_is_never_handed_out_twice_after_caller_rollback(self):
+        generator, other_process = ids.BlockSequenceGenerator(block_size=10), ids.BlockSequenceGenerator(block_size=10)
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                generator.next_id('customer')
+                raise RuntimeError
+        taken = {other_process.next_id('customer') for _ in range(10)}
+        self.assertFalse(taken & {generator.next_id('customer') for _ in range(10)})
+
+        with transaction.atomic():
+            first = generator.next_id('customer')
+        # The committed transaction's block is shared afterwards
+        self.assertEqual(generator.next_id('customer'), first + 1)
+
+    def test_block_refills_inside_postings_on_file_sqlite(self):
+        generator = ids.BlockSequenceGenerator(block_size=2)
+        with file_database(), mock.patch.object(ids, '_generator', generator):
+            _, customer = make_customer()
+            make_account(customer, 'ACC001')
+            for _ in range(5):
+                posting.deposit('ACC001', '1.00')
+
+            self.assertEqual(
+                sorted(Transaction.objects.values_list('transaction_id', flat=True)),
+                [f'TXN{ids.encode(value)}' for value in range(1, 6)],
+            )
+            self.assertEqual(Account.objects.get(account_number='ACC001').balance, Decimal('5.00'))
+            self.assertEqual(IdBlock.objects.get(name='transaction').next_value, 7)
+
+
+class PostingApiTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        make_account(self.customer, 'ACC001', '100.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_withdraw_errors_keep_response_shape(self):
+        response = self.client.post('/api/transactions/withdraw/',
+                                    {'account_number': 'ACC001', 'amount': '500'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'Insufficient balance'})
+
+        response = self.client.post('/api/transactions/deposit/',
+                                    {'account_number': 'NOPE', 'amount': '5'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_deposit_returns_serialized_transaction(self):
+        response = self.client.post('/api/transactions/deposit/',
+                                    {'account_number': 'ACC001', 'amount': 0.1}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['amount'], '0.10')
+        self.assertEqual(response.data['balance_after'], '100.10')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001', '100.00')
+        for _ in range(25):
+            posting.deposit('ACC001', '1.00')
+        # Force ties on created_at so the id tie-breaker is exercised
+        Transaction.objects.filter(pk__lte=Transaction.objects.order_by('pk')[12].pk).update(
+            created_at=timezone.now())
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, key):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data[key]
+        return seen, response
+
+    def test_pages_cover_every_row_once_in_order(self):
+        expected = list(Transaction.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        seen, last = self.walk('/api/transactions/?page_size=4', 'next')
+        self.assertEqual(seen, expected)
+
+        # Walk back from the last page using the previous links
+        backwards = [row['id'] for row in last.data['results']]
+        page = last
+        while page.data['previous']:
+            page = self.client.get(page.data['previous'])
+            backwards = [row['id'] for row in page.data['results']] + backwards
+        self.assertEqual(backwards, expected)
+
+    def test_statement_is_paginated_without_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/accounts/{self.account.pk}/statement/')
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertIsNotNone(response.data['next'])
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get('/api/transactions/?cursor=bm9wZQ==')
+        self.assertEqual(response.status_code, 404)
+
+
+class StatementExportTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001')
+        for amount in ('10.00', '20.00', '30.00'):
+            posting.deposit('ACC001', amount)
+        Transaction.objects.filter(amount=Decimal('10.00')).update(
+            created_at=timezone.make_aware(timezone.datetime(2024, 1, 15, 12)))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/accounts/{self.account.pk}/statement/export/'
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_with_date_range(self):
+        response = self.client.get(self.url, {'from': '2024-01-01', 'to': '2024-01-15'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = self.content(response).strip().splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'transaction_id')
+        self.assertEqual(len(lines), 2)
+        self.assertIn(',10.00,0.00,10.00,', lines[1])
+
+    def test_ndjson_export_is_chronological(self):
+        response = self.client.get(self.url, {'output': 'ndjson'})
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual([row['amount'] for row in rows], ['10.00', '20.00', '30.00'])
+
+    def test_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'from': '15/01/2024'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'from': '2024-02-30'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'output': 'xml'}).status_code, 400)
+
+
+class ListQueryCountTests(TestCase):
+    """A list page must cost the same number of queries whatever its size."""
+
+    def setUp(self):
+        self.staff, self.staff_customer = make_customer('staff', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.serial = 0
+
+    def assertQueriesIndependentOfPageSize(self, url, make_row, small=1, large=8):
+        counts = []
+        for total in (small, large):
+            while self.serial < total:
+                self.serial += 1
+                make_row(self.serial)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), total)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1], f'{url} issues queries per row: {counts}')
+
+    def make_account_row(self, n):
+        user, customer = make_customer(f'user{n}')
+        return make_account(customer, f'ACC{n:03d}', '100.00')
+
+    def make_loan(self, n):
+        account = self.make_account_row(n)
+        return Loan.objects.create(
+            customer=account.customer, account=account, loan_id=f'LN{n:03d}', loan_type='PERSONAL',
+            principal_amount=Decimal('100.00'), interest_rate=Decimal('10.00'), term_months=12,
+        )
+
+    def test_customers(self):
+        self.serial = 1  # the staff user's own profile is listed too
+        self.assertQueriesIndependentOfPageSize('/api/customers/', lambda n: make_customer(f'user{n}'))
+
+    def test_accounts(self):
+        self.assertQueriesIndependentOfPageSize('/api/accounts/', self.make_account_row)
+
+    def test_striped_accounts(self):
+        def make_striped_account(n):
+            account = striping.set_stripe_count(self.make_account_row(n), 2)
+            posting.deposit(account.account_number, '5.00')
+            return account
+        self.assertQueriesIndependentOfPageSize('/api/accounts/', make_striped_account)
+        self.assertEqual({row['balance'] for row in self.client.get('/api/accounts/').json()['results']}, {'105.00'})
+
+    def test_transactions(self):
+        account = make_account(self.staff_customer, 'ACC-STAFF')
+        self.assertQueriesIndependentOfPageSize(
+            '/api/transactions/', lambda n: posting.deposit(account.account_number, '1.00'))
+
+    def test_loans(self):
+        self.assertQueriesIndependentOfPageSize('/api/loans/', self.make_loan)
+
+    def test_cards(self):
+        from .models import Card
+        self.assertQueriesIndependentOfPageSize('/api/cards/', lambda n: Card.objects.create(
+            account=self.make_account_row(n), card_number=f'4000{n:012d}', card_type='DEBIT',
+            card_holder_name='Jane Doe', expiry_date=date(2030, 1, 1), cvv='123'))
+
+    def test_loan_payments(self):
+        from .models import LoanPayment
+        self.assertQueriesIndependentOfPageSize('/api/loan-payments/', lambda n: LoanPayment.objects.create(
+            loan=self.make_loan(n), payment_id=f'PAY{n}', amount=Decimal('10.00'),
+            principal_paid=Decimal('9.00'), interest_paid=Decimal('1.00'), balance_after=Decimal('91.00')))
+
+
+class RequestInstrumentationTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001', '100.00')
+        posting.deposit('ACC001', '5.00')
+
+    def test_server_timing_header(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f'/api/accounts/{self.account.pk}/statement/')
+        timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertIn('queries', timing['db'])
+        self.assertTrue(timing['ser'].startswith('dur='))
+        self.assertNotEqual(timing['ser'], 'dur=0.00')
+
+    def test_over_budget_request_is_logged_with_sql(self):
+        with override_settings(WEKEZA_PERF={'BUDGETS': {'account-balance': {'queries': 0}}}):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            with self.assertLogs('banking.perf', level='WARNING') as logs:
+                client.get(f'/api/accounts/{self.account.pk}/balance/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['route'], 'account-balance')
+        self.assertEqual(record['exceeded'], ['queries'])
+        self.assertTrue(any('"accounts"' in entry['sql'] for entry in record['sql']))
+
+    def test_idempotency_key_adds_its_queries_to_the_budget(self):
+        def deposit(**extra):
+            # Middleware reads WEKEZA_PERF when the client first loads it
+            client = APIClient()
+            client.force_authenticate(self.user)
+            return client.post('/api/transactions/deposit/', {'account_number': 'ACC001', 'amount': '1.00'},
+                               format='json', **extra)
+
+        with CaptureQueriesContext(connection) as queries:
+            deposit()
+        budget = {'transaction-deposit': {'queries': len(queries)}}
+        with override_settings(WEKEZA_PERF={'BUDGETS': budget}):
+            with self.assertNoLogs('banking.perf', level='WARNING'):
+                response = deposit(HTTP_IDEMPOTENCY_KEY='dep-1')
+        self.assertEqual(response.status_code, 201)
+        with override_settings(WEKEZA_PERF={'BUDGETS': budget, 'IDEMPOTENCY_KEY_QUERIES': 0}):
+            with self.assertLogs('banking.perf', level='WARNING'):
+                deposit(HTTP_IDEMPOTENCY_KEY='dep-2')
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        make_account(self.customer, 'ACC001', '100.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sample(self, text, prefix):
+        return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(prefix))
+
+    def test_scrape_reports_actions_and_postings(self):
+        self.client.post('/api/transactions/deposit/', {'account_number': 'ACC001', 'amount': '1'}, format='json')
+        self.client.post('/api/transactions/withdraw/', {'account_number': 'ACC001', 'amount': '999'}, format='json')
+        text = self.client.get('/metrics/').content.decode()
+
+        self.assertGreaterEqual(self.sample(
+            text, 'wekeza_http_request_duration_seconds_count{view="TransactionViewSet",action="deposit"}'), 1)
+        self.assertGreaterEqual(self.sample(
+            text, 'wekeza_postings_total{transaction_type="WITHDRAWAL",status="FAILED"}'), 1)
+        self.assertIn('wekeza_http_requests_in_flight 1', text)
+
+    def test_merges_snapshots_from_other_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            dead_worker = {'wekeza_postings_total': [[['FEE', 'COMPLETED'], 5]],
+                           'wekeza_http_requests_in_flight': [[[], 3]]}
+            with open(os.path.join(directory, '999999999-1.json'), 'w') as f:
+                json.dump(dead_worker, f)
+            before = self.sample(metrics.render(), 'wekeza_postings_total{transaction_type="FEE"')
+            with override_settings(WEKEZA_METRICS={'MULTIPROCESS_DIR': directory}):
+                text = metrics.render()
+        self.assertEqual(self.sample(text, 'wekeza_postings_total{transaction_type="FEE"'), before + 5)
+        self.assertNotIn('wekeza_http_requests_in_flight 3', text)
+
+    def test_connection_wait_is_observed_only_when_a_connection_opens(self):
+        prefix = 'wekeza_db_connection_wait_seconds_count{alias="default"}'
+        before = self.sample(metrics.render(), prefix)
+        with file_database():
+            connections['default'].close()
+            self.client.get('/metrics/')
+            self.assertIsNone(connections['default'].connection)
+            self.assertEqual(self.sample(metrics.render(), prefix), before)
+
+            self.client.get('/api/accounts/')
+            self.assertEqual(self.sample(metrics.render(), prefix), before + 1)
+
+    def test_token_protects_endpoint(self):
+        with override_settings(WEKEZA_METRICS={'TOKEN': 's3cret'}):
+            self.assertEqual(self.client.get('/metrics/').status_code, 401)
+            response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret')
+            self.assertEqual(response.status_code, 200)
+
+
+class DailyBalanceTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001')
+        self.other = make_account(self.customer, 'ACC002', '500.00')
+        Account.objects.update(created_at=timezone.make_aware(datetime(2024, 1, 1)))
+        self.post_on(date(2024, 3, 1), posting.deposit, 'ACC001', '100.00')
+        self.post_on(date(2024, 3, 2), posting.transfer, 'ACC001', 'ACC002', '30.00')
+        self.post_on(date(2024, 3, 4), posting.withdraw, 'ACC001', '20.00')
+
+    def post_on(self, day, func, *args):
+        result = func(*args)
+        rows = result if isinstance(result, tuple) else (result,)
+        Transaction.objects.filter(pk__in=[row.pk for row in rows]).update(
+            created_at=timezone.make_aware(datetime.combine(day, datetime.min.time().replace(hour=10))))
+
+    def test_snapshots_chain_day_to_day(self):
+        for day in (1, 2, 3):
+            snapshots.build_daily_balances(date(2024, 3, day), chunk_size=1)
+        snapshots.build_daily_balances(date(2024, 3, 2))  # rebuilding is idempotent
+
+        day2 = DailyBalance.objects.get(account=self.account, date=date(2024, 3, 2))
+        self.assertEqual((day2.opening_balance, day2.closing_balance), (Decimal('100.00'), Decimal('70.00')))
+        self.assertEqual((day2.total_debits, day2.transaction_count), (Decimal('30.00'), 1))
+        other = DailyBalance.objects.get(account=self.other, date=date(2024, 3, 3))
+        self.assertEqual(other.closing_balance, Decimal('530.00'))
+        self.assertEqual(DailyBalance.objects.count(), 6)
+
+    def test_balance_on_uses_snapshot_then_ledger(self):
+        self.account.refresh_from_db()
+        self.assertEqual(snapshots.balance_on(self.account, date(2024, 3, 1)), (Decimal('100.00'), 'ledger'))
+        snapshots.build_daily_balances(date(2024, 3, 2))
+        self.assertEqual(snapshots.balance_on(self.account, date(2024, 3, 2)), (Decimal('70.00'), 'snapshot'))
+        self.assertEqual(snapshots.balance_on(self.account, date(2024, 3, 5)),
+                         (Decimal('50.00'), 'snapshot+ledger'))
+
+    def test_balance_at_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f'/api/accounts/{self.account.pk}/balance-at/'
+        response = client.get(url, {'date': '2024-03-03'})
+        self.assertEqual(response.data['balance'], Decimal('70.00'))
+        self.assertEqual(client.get(url).status_code, 400)
+        self.assertEqual(client.get(url, {'date': '2024-02-30'}).status_code, 400)
+
+    def test_command_rejects_impossible_dates(self):
+        with self.assertRaisesMessage(CommandError, 'valid date'):
+            call_command('build_daily_balances', '--date=2024-02-30', stdout=open(os.devnull, 'w'))
+
+
+class InterestAccrualTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.day = date(2024, 3, 1)
+
+    def test_vectorized_interest_matches_decimal(self):
+        import random
+        rng = random.Random(7)
+        balances = [Decimal(rng.randint(1, 10 ** 11)) / 100 for _ in range(5000)]
+        rates = [Decimal(rng.randint(1, 2500)) / 100 for _ in range(5000)]
+        # Exact half cents must round up
+        balances += [Decimal('365.00'), Decimal('73.00')]
+        rates += [Decimal('0.50'), Decimal('2.50')]
+
+        expected = [interest._exact_daily_interest(b, r) for b, r in zip(balances, rates)]
+        self.assertEqual(interest.daily_interest(balances, rates), expected)
+        self.assertEqual(expected[-2:], [Decimal('0.01'), Decimal('0.01')])
+
+    def test_accrual_posts_once_per_day_and_respects_range(self):
+        accounts = [make_account(self.customer, f'ACC{i:03d}', '36500.00') for i in range(5)]
+        Account.objects.update(interest_rate=Decimal('3.00'))
+        Account.objects.filter(pk=accounts[1].pk).update(status='FROZEN')
+
+        results = list(interest.accrue_interest(self.day, end_id=accounts[2].pk, chunk_size=1))
+        self.assertEqual(sum(r.posted for r in results), 2)
+        self.assertEqual(results[-1].last_id, accounts[2].pk)
+
+        results = list(interest.accrue_interest(self.day))
+        self.assertEqual((sum(r.posted for r in results), sum(r.skipped for r in results)), (2, 2))
+
+        credited = Transaction.objects.filter(transaction_type='INTEREST', reference_number='INT-20240301')
+        self.assertEqual(credited.count(), 4)
+        self.assertEqual(Account.objects.get(pk=accounts[0].pk).balance, Decimal('36503.00'))
+        self.assertEqual(Account.objects.get(pk=accounts[1].pk).balance, Decimal('36500.00'))
+
+    def test_command_rejects_impossible_dates(self):
+        with self.assertRaisesMessage(CommandError, 'valid date'):
+            call_command('accrue_interest', '--date=2024-02-30', stdout=open(os.devnull, 'w'))
+
+
+class FeeEngineTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.period = fees.month_bounds(date(2024, 3, 15))
+        self.savings = make_account(self.customer, 'ACC001', '1000.00')
+        self.checking = make_account(self.customer, 'ACC002', '1000.00')
+        Account.objects.filter(pk=self.checking.pk).update(account_type='CHECKING')
+        self.broke = make_account(self.customer, 'ACC003', '5.00')
+
+        FeeSchedule.objects.create(name='Maintenance', fee_type='MONTHLY_MAINTENANCE', amount='10.00')
+        FeeSchedule.objects.create(name='Withdrawal fee', fee_type='PER_WITHDRAWAL',
+                                   account_type='CHECKING', amount='2.50')
+        FeeSchedule.objects.create(name='Low balance', fee_type='BELOW_MINIMUM_BALANCE',
+                                   amount='7.00', minimum_balance='500.00')
+
+        march = timezone.make_aware(datetime(2024, 3, 10, 12))
+        for number in ('ACC002', 'ACC002', 'ACC001'):
+            posting.withdraw(number, '1.00')
+        Transaction.objects.update(created_at=march)
+        DailyBalance.objects.create(account=self.savings, date=date(2024, 3, 9),
+                                    opening_balance='900.00', closing_balance='450.00')
+
+    def fees_for(self, account):
+        return list(
+            Transaction.objects.filter(account=account, transaction_type='FEE')
+            .order_by('reference_number').values_list('amount', 'description')
+        )
+
+    def test_accounts_are_locked_before_charged_fees_are_read(self):
+        schedules = list(FeeSchedule.objects.order_by('pk'))
+        with CaptureQueriesContext(connection) as queries:
+            fees.assess_chunk(schedules, [self.savings.pk, self.checking.pk], *self.period)
+        sql = [q['sql'] for q in queries.captured_queries]
+        lock = next(i for i, statement in enumerate(sql) if 'FROM "accounts"' in statement)
+        charged = next(i for i, statement in enumerate(sql) if "\"transaction_type\" = 'FEE'" in statement)
+        self.assertLess(lock, charged)
+
+    def test_schedules_are_evaluated_and_posted_once(self):
+        results = list(fees.assess_fees(*self.period, chunk_size=2))
+        self.assertEqual(sum(r.posted for r in results), 4)
+        self.assertEqual(sum(r.failed for r in results), 1)  # ACC003 cannot pay its maintenance fee
+
+        self.assertEqual(self.fees_for(self.savings), [
+            (Decimal('10.00'), 'Maintenance'), (Decimal('7.00'), 'Low balance'),
+        ])
+        self.assertEqual(self.fees_for(self.checking), [
+            (Decimal('10.00'), 'Maintenance'), (Decimal('5.00'), 'Withdrawal fee x 2'),
+        ])
+        self.assertEqual(Account.objects.get(pk=self.checking.pk).balance, Decimal('983.00'))
+
+        rerun = list(fees.assess_fees(*self.period))
+        self.assertEqual((sum(r.posted for r in rerun), sum(r.skipped for r in rerun)), (0, 4))
+
+    def test_partition_account_range(self):
+        extra = [make_account(self.customer, f'ACC1{i:02d}') for i in range(7)]
+        partitions = fees.partition_account_range(3)
+        self.assertEqual(len(partitions), 3)
+        self.assertEqual(partitions[0][0], self.savings.pk)
+        self.assertIsNone(partitions[-1][1])
+        for (_, last), (first, _) in zip(partitions, partitions[1:]):
+            self.assertEqual(last + 1, first)
+        self.assertEqual(fees.partition_account_range(2, start_id=extra[-1].pk), [(extra[-1].pk, None)])
+
+    def test_command_rejects_impossible_months(self):
+        with self.assertRaisesMessage(CommandError, 'valid month'):
+            call_command('assess_fees', '--month=2024-13', stdout=open(os.devnull, 'w'))
+
+
+class AmortizationTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001')
+        self.staff, _ = make_customer('staff', is_staff=True)
+
+    def make_loan(self, principal, rate, term, status='ACTIVE'):
+        return Loan.objects.create(
+            customer=self.customer, account=self.account, loan_id=f'LN{Loan.objects.count():04d}',
+            loan_type='PERSONAL', principal_amount=Decimal(principal), interest_rate=Decimal(rate),
+            term_months=term, status=status, disbursement_date=timezone.make_aware(datetime(2024, 1, 31)),
+        )
+
+    def test_vectorized_schedules_reconcile_with_decimal(self):
+        import random
+        rng = random.Random(11)
+        loans = [
+            (Decimal(rng.randint(100_00, 5_000_000_00)) / 100, Decimal(rng.randint(0, 3000)) / 100, term)
+            for term in (1, 12, 60, 360) for _ in range(200)
+        ] + [(Decimal('100.01'), Decimal('0.00'), 2), (Decimal('1000.00'), Decimal('12.00'), 12)]
+
+        for term in {term for _, _, term in loans}:
+            group = [loan for loan in loans if loan[2] == term]
+            payment, principal, interest, balance = amortize = amortization.amortize(
+                [p for p, _, _ in group], [r for _, r, _ in group], term,
+            )
+            for index, (p, r, _) in enumerate(group):
+                expected = amortization.decimal_schedule(p, r, term)
+                rows = [
+                    (month + 1,) + tuple(amortization._from_cents(array[month, index]) for array in amortize)
+                    for month in range(len(expected))
+                ]
+                self.assertEqual(rows, expected)
+                self.assertEqual(expected[0][1], amortization.monthly_payment(p, r, term))
+                self.assertEqual(expected[-1][-1], 0)
+                self.assertEqual(sum(row[2] for row in expected), p)
+
+    def test_approve_stores_the_schedule_payment(self):
+        loan = self.make_loan('1000.00', '12.00', 12, status='PENDING')
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        client.post(f'/api/loans/{loan.pk}/approve/')
+        loan.refresh_from_db()
+        self.assertEqual(loan.monthly_payment, Decimal('88.85'))
+
+    def test_portfolio_projection_and_export(self):
+        self.make_loan('1000.00', '12.00', 12)
+        self.make_loan('600.00', '0.00', 3, status='DISBURSED')
+        self.make_loan('500.00', '10.00', 6, status='PENDING')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/loans/amortization/').status_code, 403)
+
+        client.force_authenticate(self.staff)
+        self.assertEqual(client.get('/api/loans/amortization/', {'from': '2024-13'}).status_code, 400)
+        data = client.get('/api/loans/amortization/', {'from': '2024-04'}).data
+        self.assertEqual(data['loans'], 2)
+        self.assertEqual(data['months'][0], {
+            'month': '2024-04', 'principal': Decimal('280.43'), 'interest': Decimal('8.42'), 'installments': 2,
+        })
+        self.assertEqual(len(data['months']), 10)
+        schedule = amortization.decimal_schedule(Decimal('1000.00'), Decimal('12.00'), 12)
+        self.assertEqual(data['projected_interest'], sum(row[3] for row in schedule[2:]))
+
+        response = client.get('/api/loans/amortization/export/', {'output': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(amortization.SCHEDULE_COLUMNS))
+        self.assertEqual(len(lines), 1 + 3 + 12)
+        self.assertEqual(lines[1], 'LN0001,1,2024-02-29,200.00,200.00,0.00,400.00')
+
+
+class LoanRepaymentTests(TestCase):
+    def setUp(self):
+        # Repayments accrue interest by calendar date; a month after disbursement
+        now = mock.patch('django.utils.timezone.now', return_value=timezone.make_aware(datetime(2024, 4, 15, 12)))
+        now.start()
+        self.addCleanup(now.stop)
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001', '5000.00')
+        self.loan = self.make_loan('LN0001')
+
+    def make_loan(self, loan_id, principal='1000.00'):
+        return Loan.objects.create(
+            customer=self.customer, account=self.account, loan_id=loan_id, loan_type='PERSONAL',
+            principal_amount=Decimal(principal), interest_rate=Decimal('12.00'), term_months=12,
+            outstanding_balance=Decimal(principal), status='DISBURSED',
+            disbursement_date=timezone.make_aware(datetime(2024, 3, 15, 9)),
+        )
+
+    def test_repay_splits_interest_and_principal(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(f'/api/loans/{self.loan.pk}/repay/', {'amount': '88.85'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['loan']['status'], 'ACTIVE')
+        self.assertEqual(
+            (response.data['payment']['interest_paid'], response.data['payment']['principal_paid']),
+            ('10.00', '78.85'),
+        )
+
+        payment = LoanPayment.objects.get()
+        self.assertEqual(payment.transaction.transaction_type, 'LOAN_REPAYMENT')
+        self.assertEqual(payment.transaction.balance_after, Decimal('4911.15'))
+        self.assertEqual(Loan.objects.get(pk=self.loan.pk).outstanding_balance, Decimal('921.15'))
+
+        # Nothing accrues again the same day; 15 days after the last payment, 15 days' interest does
+        response = client.post(f'/api/loans/{self.loan.pk}/repay/', {'amount': '921.16'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        LoanPayment.objects.update(payment_date=timezone.make_aware(datetime(2024, 3, 31, 9)))
+        response = client.post(f'/api/loans/{self.loan.pk}/repay/', {'amount': '925.77'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = client.post(f'/api/loans/{self.loan.pk}/repay/', {'amount': '925.76'}, format='json')
+        self.assertEqual(response.data['payment']['interest_paid'], '4.61')
+        self.assertEqual(response.data['loan']['status'], 'PAID')
+        self.assertEqual(client.post(f'/api/loans/{self.loan.pk}/repay/', {'amount': '1'}).status_code, 400)
+
+    def test_batch_matches_single_repayments(self):
+        other = self.make_loan('LN0002', '300.00')
+        Loan.objects.filter(pk=other.pk).update(account=make_account(self.customer, 'ACC002', '10.00'))
+        results = repayments.repay_batch([
+            ('LN0001', '88.85'), ('LN0404', '10.00'), ('LN0002', '50.00'),
+            ('LN0001', '88.85'), ('LN0001', '5000.00'), ('LN0002', '5.00'),
+        ])
+
+        self.assertEqual([type(r).__name__ for r in results], [
+            'LoanPayment', 'LoanNotFound', 'InsufficientFunds', 'LoanPayment', 'InvalidAmount', 'LoanPayment',
+        ])
+        self.assertEqual([(r.interest_paid, r.balance_after) for r in results if isinstance(r, LoanPayment)], [
+            (Decimal('10.00'), Decimal('921.15')), (Decimal('0.00'), Decimal('832.30')),
+            (Decimal('3.00'), Decimal('298.00')),
+        ])
+        self.assertEqual(Loan.objects.get(pk=self.loan.pk).outstanding_balance, Decimal('832.30'))
+        self.assertEqual(Loan.objects.get(pk=other.pk).status, 'ACTIVE')
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('4822.30'))
+
+    def test_import_repayments_command(self):
+        from django.core.management import call_command
+        with tempfile.TemporaryDirectory() as directory:
+            path, errors = os.path.join(directory, 'in.csv'), os.path.join(directory, 'errors.csv')
+            with open(path, 'w') as f:
+                f.write('loan_id,amount\nLN0001,88.85\nLN0001,abc\nLN0001,88.85\n')
+            call_command('import_repayments', path, '--chunk-size=2', '--skip=1', f'--errors={errors}',
+                         stdout=open(os.devnull, 'w'))
+            with open(errors) as f:
+                self.assertEqual(f.read().splitlines()[1], '2,LN0001,abc,Invalid amount')
+        self.assertEqual(Loan.objects.get(pk=self.loan.pk).outstanding_balance, Decimal('921.15'))
+
+    def test_interest_left_unpaid_stays_owed(self):
+        _, payment = repayments.repay_loan(self.loan, '4.00')
+        self.assertEqual((payment.interest_paid, payment.principal_paid), (Decimal('4.00'), Decimal('0.00')))
+
+        # The month's 10.00 still accrues from disbursement; 4.00 of it is paid, then 3.00 more
+        results = repayments.repay_batch([('LN0001', '3.00'), ('LN0001', '88.85')])
+        self.assertEqual([(r.interest_paid, r.principal_paid) for r in results], [
+            (Decimal('3.00'), Decimal('0.00')), (Decimal('3.00'), Decimal('85.85')),
+        ])
+        _, payment = repayments.repay_loan(self.loan, '50.00')
+        self.assertEqual((payment.interest_paid, payment.balance_after), (Decimal('0.00'), Decimal('864.15')))
+
+    def test_installment_interest_is_thirty_days_of_accrual(self):
+        self.assertEqual(amortization.days_360(date(2024, 1, 31), date(2024, 2, 29)), 29)
+        self.assertEqual(amortization.days_360(date(2024, 3, 15), date(2024, 4, 15)), 30)
+        self.assertEqual(
+            amortization.accrued_interest(Decimal('921.15'), Decimal('12.00'), 30),
+            amortization.installment_interest(Decimal('921.15'), Decimal('12.00')),
+        )
+
+
+class LoanAgingTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001', '5000.00')
+        self.as_of = date(2024, 5, 20)
+
+    def make_loan(self, loan_id, paid):
+        loan = Loan.objects.create(
+            customer=self.customer, account=self.account, loan_id=loan_id, loan_type='PERSONAL',
+            principal_amount=Decimal('1100.00'), interest_rate=Decimal('0.00'), term_months=12,
+            monthly_payment=Decimal('100.00'), outstanding_balance=Decimal('1100.00'), status='DISBURSED',
+            disbursement_date=timezone.make_aware(datetime(2024, 1, 15, 9)),
+        )
+        if paid:
+            repayments.repay_loan(loan, paid)
+        return loan
+
+    def test_installments_due_clamps_to_month_end(self):
+        start = date(2024, 1, 31)
+        self.assertEqual(aging.installments_due(start, 12, date(2024, 2, 28)), 0)
+        self.assertEqual(aging.installments_due(start, 12, date(2024, 2, 29)), 1)
+        self.assertEqual(aging.installments_due(start, 12, date(2026, 1, 1)), 12)
+
+    def test_aging_buckets_and_defaults(self):
+        loans = {
+            'LN1': self.make_loan('LN1', None),
+            'LN2': self.make_loan('LN2', '300.00'),
+            'LN3': self.make_loan('LN3', '400.00'),
+            'LN4': self.make_loan('LN4', '150.00'),
+        }
+        LoanPayment.objects.update(payment_date=timezone.make_aware(datetime(2024, 4, 1)))
+        self.assertEqual(aging.build_loan_aging(self.as_of), (4, 1))
+        self.assertEqual(aging.build_loan_aging(self.as_of), (4, 0))
+
+        rows = {
+            row.loan.loan_id: (row.installments_due, row.arrears, row.days_past_due, row.bucket)
+            for row in LoanAging.objects.select_related('loan')
+        }
+        self.assertEqual(rows, {
+            'LN1': (4, Decimal('400.00'), 95, 'DPD_90_PLUS'),
+            'LN2': (4, Decimal('100.00'), 5, 'DPD_1_29'),
+            'LN3': (4, Decimal('0.00'), 0, 'CURRENT'),
+            'LN4': (4, Decimal('250.00'), 66, 'DPD_60_89'),
+        })
+        self.assertEqual(Loan.objects.get(pk=loans['LN1'].pk).status, 'DEFAULTED')
+
+        repayments.repay_loan(loans['LN1'], '100.00')
+        self.assertEqual(Loan.objects.get(pk=loans['LN1'].pk).status, 'DEFAULTED')
+
+        staff, _ = make_customer('staff', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(staff)
+        data = client.get('/api/loans/aging/').data
+        self.assertEqual(data['as_of'], self.as_of)
+        self.assertEqual(client.get('/api/loans/aging/', {'as_of': '2024-02-30'}).status_code, 400)
+        self.assertEqual([(b['bucket'], b['loans']) for b in data['buckets']], [
+            ('CURRENT', 1), ('DPD_1_29', 1), ('DPD_30_59', 0), ('DPD_60_89', 1), ('DPD_90_PLUS', 1),
+        ])
+
+    def test_command_rejects_impossible_dates(self):
+        with self.assertRaisesMessage(CommandError, 'valid date'):
+            call_command('age_loans', '--date=2024-02-30', stdout=open(os.devnull, 'w'))
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001', '100.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.body = {'account_number': 'ACC001', 'amount': '25.00'}
+
+    def deposit(self, key, body=None):
+        return self.client.post('/api/transactions/deposit/', body or self.body, format='json',
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def pending_key(self, key):
+        request = SimpleNamespace(method='POST', path='/api/transactions/deposit/', data=self.body)
+        return IdempotencyKey.objects.create(user=self.user, key=key,
+                                             fingerprint=idempotency.request_fingerprint(request))
+
+    def test_replay_returns_stored_response_without_posting(self):
+        first = self.deposit('abc-1')
+        with CaptureQueriesContext(connection) as queries:
+            replay = self.deposit('abc-1')
+
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json(), first.json())
+        self.assertFalse([q for q in queries.captured_queries if '"accounts"' in q['sql']])
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('125.00'))
+        self.assertEqual(self.deposit('abc-2').status_code, 201)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        self.deposit('abc-1')
+        response = self.deposit('abc-1', {'account_number': 'ACC001', 'amount': '99.00'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.deposit('x' * 256).status_code, 400)
+
+    def test_concurrent_duplicate_waits_for_first_result(self):
+        record = self.pending_key('abc-1')
+
+        def first_request_finishes(delay):
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status='COMPLETED', response_status=201, response_body={'transaction_id': 'TXN1'},
+            )
+
+        with mock.patch('banking.idempotency.time.sleep', side_effect=first_request_finishes) as sleep:
+            response = self.deposit('abc-1')
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(response.json(), {'transaction_id': 'TXN1'})
+        self.assertEqual(Transaction.objects.count(), 0)
+
+        self.pending_key('abc-2')
+        with override_settings(WEKEZA_IDEMPOTENCY={'WAIT_TIMEOUT': 0}):
+            self.assertEqual(self.deposit('abc-2').status_code, 409)
+
+    def test_expired_keys_are_reclaimed_and_purged(self):
+        self.deposit('abc-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=25))
+        self.assertEqual(self.deposit('abc-1').status_code, 201)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=25))
+        self.pending_key('abc-2')
+        self.assertEqual(idempotency.purge_expired(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['abc-2'])
+
+
+class StripedAccountTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.payer = make_account(self.customer, 'ACC001', '1000.00')
+        self.hot = striping.set_stripe_count(make_account(self.customer, 'PAYBILL', '50.00'), 4)
+
+    def stripe_balances(self):
+        return list(AccountStripe.objects.filter(account=self.hot).order_by('stripe').values_list('balance', flat=True))
+
+    def test_stripe_count_is_read_only_through_the_api(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch(f'/api/accounts/{self.payer.pk}/', {'stripe_count': 8}, format='json')
+        self.assertEqual((response.status_code, response.data['stripe_count']), (200, 1))
+        self.payer.refresh_from_db()
+        self.assertEqual(self.payer.stripe_count, 1)
+        self.assertFalse(AccountStripe.objects.filter(account=self.payer).exists())
+
+    def test_credits_land_on_stripes_without_locking_the_account(self):
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(8):
+                posting.transfer('ACC001', 'PAYBILL', '10.00')
+        locks = [q['sql'] for q in queries.captured_queries if 'FOR UPDATE' in q['sql']]
+        self.assertFalse([sql for sql in locks if 'PAYBILL' in sql and 'NOT' not in sql])
+
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.balance, Decimal('50.00'))
+        self.assertEqual(sum(self.stripe_balances()), Decimal('80.00'))
+        self.assertEqual(self.hot.consolidated_balance(), Decimal('130.00'))
+        credits = Transaction.objects.filter(account=self.hot)
+        self.assertTrue(all(row.balance_after - row.balance_before == row.amount for row in credits))
+
+    def test_debit_consolidates_stripes(self):
+        for _ in range(3):
+            posting.deposit('PAYBILL', '20.00')
+        posting.withdraw('PAYBILL', '100.00')
+
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.balance, Decimal('10.00'))
+        self.assertEqual(sum(self.stripe_balances()), 0)
+        with self.assertRaises(posting.InsufficientFunds):
+            posting.withdraw('PAYBILL', '10.01')
+
+    def test_balance_endpoint_and_snapshots_include_stripes(self):
+        posting.deposit('PAYBILL', '25.00')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        balance = client.get(f'/api/accounts/{self.hot.pk}/balance/').json()['balance']
+        self.assertEqual(Decimal(str(balance)), Decimal('75.00'))
+        self.assertEqual(client.get(f'/api/accounts/{self.hot.pk}/').json()['balance'], '75.00')
+
+        snapshots.build_daily_balances(timezone.localdate())
+        self.assertEqual(DailyBalance.objects.get(account=self.hot).closing_balance, Decimal('75.00'))
+
+    def test_lowering_stripe_count_keeps_the_balance(self):
+        for _ in range(6):
+            posting.deposit('PAYBILL', '5.00')
+        account = striping.set_stripe_count(self.hot, 1)
+        self.assertEqual((account.balance, account.stripe_count), (Decimal('80.00'), 1))
+        self.assertEqual(self.stripe_balances(), [])
+        posting.deposit('PAYBILL', '5.00')
+        self.assertEqual(Account.objects.get(pk=self.hot.pk).balance, Decimal('85.00'))
+
+
+@override_settings(WEKEZA_DB_ROUTING={'REPLICAS': ['replica1'], 'STICKY_SECONDS': 5})
+class ReplicaRoutingTests(TestCase):
+    """
+    Stands up a second SQLite database as the replica, migrated like the
+    primary. It is added before TestCase setup, so '__all__' takes it into the
+    per-test transaction.
+    """
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        connections.settings['replica1'] = {
+            **connections.settings['default'], 'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3'),
+        }
+        call_command('migrate', database='replica1', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica1'].close()
+        del connections['replica1']
+        del connections.settings['replica1']
+        cls.replica_dir.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001', '100.00')
+        # The replica lags: it has not seen the last 10.00 yet
+        for obj in (self.user, self.customer, self.account):
+            obj.save(using='replica1')
+        Account.objects.using('replica1').filter(pk=self.account.pk).update(balance=Decimal('90.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def balance(self):
+        return Decimal(str(self.client.get(f'/api/accounts/{self.account.pk}/balance/').json()['balance']))
+
+    def test_safe_reads_are_served_by_the_replica(self):
+        self.assertEqual(self.balance(), Decimal('90.00'))
+        self.assertEqual(self.client.get('/api/accounts/').json()['results'][0]['balance'], '90.00')
+        self.assertIsNone(routing.current_replica())
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('100.00'))
+
+    def test_user_reads_own_writes_after_posting(self):
+        response = self.client.post('/api/transactions/deposit/', {'account_number': 'ACC001', 'amount': '5.00'},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(routing.is_sticky(self.user))
+        self.assertEqual(self.balance(), Decimal('105.00'))
+
+        other_user, _ = make_customer('customer2')
+        self.assertFalse(routing.is_sticky(other_user))
+        cache.clear()  # the sticky window has passed
+        self.assertEqual(self.balance(), Decimal('90.00'))
+
+    def test_rejected_write_does_not_stick(self):
+        response = self.client.post('/api/transactions/withdraw/', {'account_number': 'ACC001', 'amount': '500.00'},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.balance(), Decimal('90.00'))
+
+
+@override_settings(WEKEZA_POSTING_RETRY={'ATTEMPTS': 3, 'BASE_DELAY': 0, 'MAX_DELAY': 0})
+class PostingRetryTests(TransactionTestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001', '100.00')
+
+    def locked_then(self, failures):
+        real_ledger_row = posting._ledger_row
+        errors = iter([OperationalError('database is locked')] * failures)
+
+        def flaky_ledger_row(*args, **kwargs):
+            error = next(errors, None)
+            if error:
+                raise error
+            return real_ledger_row(*args, **kwargs)
+        return mock.patch('banking.posting._ledger_row', side_effect=flaky_ledger_row)
+
+    def test_lock_conflict_is_retried(self):
+        with self.locked_then(2):
+            posting.deposit('ACC001', '10.00')
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('110.00'))
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_gives_up_after_attempts_and_inside_callers_transaction(self):
+        with self.locked_then(3), self.assertRaises(OperationalError):
+            posting.deposit('ACC001', '10.00')
+        with self.locked_then(1), self.assertRaises(OperationalError), transaction.atomic():
+            posting.deposit('ACC001', '10.00')
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('100.00'))
+
+
+class AccountCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        account_cache.clear_local()
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001', '100.00')
+        self.other = make_account(self.customer, 'ACC002', '100.00')
+
+    def statements(self, func, *args):
+        with CaptureQueriesContext(connection) as queries:
+            func(*args)
+        return [q['sql'] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+
+    def test_warm_cache_drops_queries_per_posting(self):
+        posting.transfer('ACC001', 'ACC002', '1.00')  # warms the cache for both accounts
+        self.assertEqual(len(self.statements(posting.deposit, 'ACC001', '5.00')), 2)
+        self.assertEqual(len(self.statements(posting.withdraw, 'ACC001', '5.00')), 2)
+        self.assertEqual(len(self.statements(posting.transfer, 'ACC001', 'ACC002', '5.00')), 3)
+
+        with override_settings(WEKEZA_ACCOUNT_CACHE={'ENABLED': False}):
+            self.assertEqual(len(self.statements(posting.deposit, 'ACC001', '5.00')), 3)
+            self.assertEqual(len(self.statements(posting.transfer, 'ACC001', 'ACC002', '5.00')), 5)
+
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('94.00'))
+        debit = Transaction.objects.filter(account=self.account).order_by('-id').first()
+        self.assertEqual((debit.balance_before, debit.balance_after), (Decimal('99.00'), Decimal('94.00')))
+
+    def test_deposit_into_a_negative_balance_takes_the_fast_path(self):
+        posting.deposit('ACC001', '1.00')  # warms the cache
+        Account.objects.filter(pk=self.account.pk).update(balance=Decimal('-50.00'))  # e.g. an admin correction
+        statements = self.statements(posting.deposit, 'ACC001', '20.00')
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('-30.00'))
+        with self.assertRaises(posting.InsufficientFunds):
+            posting.withdraw('ACC001', '1.00')
+
+    def test_renamed_account_leaves_the_cache_under_its_old_number(self):
+        posting.deposit('ACC001', '1.00')  # caches the entry under ACC001
+        self.account.account_number = 'ACC009'
+        self.account.save(update_fields=['account_number'])
+        with self.assertRaises(posting.AccountNotFound):
+            posting.deposit('ACC001', '1.00')
+        posting.deposit('ACC009', '1.00')
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('102.00'))
+
+    def test_stale_entry_never_lets_a_frozen_account_post(self):
+        self.assertEqual(account_cache.lookup('ACC001').status, 'ACTIVE')
+        Account.objects.filter(pk=self.account.pk).update(status='FROZEN')  # no signal: the entry is stale
+
+        with self.assertRaises(posting.AccountInactive):
+            posting.deposit('ACC001', '5.00')
+        self.assertEqual(account_cache.lookup('ACC001').status, 'FROZEN')
+        with self.assertRaises(posting.AccountInactive):
+            posting.transfer('ACC002', 'ACC001', '5.00')
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('100.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_stale_stripe_count_falls_back_to_the_locking_path(self):
+        # Entries another process still holds from before ACC002 was striped
+        stale = {number: account_cache.lookup(number) for number in ('ACC001', 'ACC002')}
+        striping.set_stripe_count(self.other, 4)
+        posting.deposit('ACC002', '50.00')
+        self.assertEqual(AccountStripe.objects.filter(account=self.other).aggregate(total=Sum('balance'))['total'],
+                         Decimal('50.00'))
+
+        with mock.patch.object(account_cache, 'lookup', side_effect=stale.get):
+            posting.withdraw('ACC002', '120.00')  # more than the base balance alone
+            posting.transfer('ACC001', 'ACC002', '10.00')  # the applied ACC001 leg is undone, then redone
+
+        self.assertEqual(Account.objects.get(pk=self.account.pk).balance, Decimal('90.00'))
+        self.assertEqual(Account.objects.get(pk=self.other.pk).consolidated_balance(), Decimal('40.00'))
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+
+    def test_save_invalidates_and_funds_are_checked_in_the_update(self):
+        account_cache.lookup('ACC001')
+        self.account.status = 'CLOSED'
+        self.account.save()
+        self.assertEqual(account_cache.lookup('ACC001').status, 'CLOSED')
+
+        with self.assertRaises(posting.InsufficientFunds):
+            posting.withdraw('ACC002', '100.01')
+        self.assertEqual(Account.objects.get(pk=self.other.pk).balance, Decimal('100.00'))
+
+
+@override_settings(WEKEZA_TRANSFER_BATCH={'BACKGROUND': False, 'CHUNK_SIZE': 2})
+class TransferBatchTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.source = make_account(self.customer, 'PAYROLL', '1000.00')
+        _, other = make_customer('employee')
+        for number in ('EMP001', 'EMP002', 'EMP003'):
+            make_account(other, number)
+        make_account(other, 'EMP004', status='FROZEN')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def balance(self, number):
+        return Account.objects.get(account_number=number).balance
+
+    def test_csv_upload_posts_one_debit_and_reports_every_line(self):
+        upload = SimpleUploadedFile(
+            'payroll.csv',
+            b'account_number,amount\nEMP001,100.00\nEMP002,250.50\nMISSING,5\nEMP004,10\nEMP003,1.001\nEMP003,49.50\n',
+            content_type='text/csv',
+        )
+        response = self.client.post('/api/transfer-batches/', {'from_account': 'PAYROLL', 'file': upload},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'COMPLETED')
+        self.assertEqual((response.data['accepted_lines'], response.data['rejected_lines']), (3, 3))
+        self.assertEqual(response.data['progress'], 100.0)
+
+        self.assertEqual(self.balance('PAYROLL'), Decimal('600.00'))
+        self.assertEqual(self.balance('EMP002'), Decimal('250.50'))
+        debits = Transaction.objects.filter(account=self.source)
+        self.assertEqual([debit.amount for debit in debits], [Decimal('400.00')])
+        credits = Transaction.objects.exclude(account=self.source)
+        self.assertEqual({credit.reference_number for credit in credits}, {debits[0].transaction_id})
+
+        response = self.client.get(f"/api/transfer-batches/{response.data['id']}/results/?output=ndjson")
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['status'] for line in lines],
+                         ['CREDITED', 'CREDITED', 'REJECTED', 'REJECTED', 'REJECTED', 'CREDITED'])
+        self.assertEqual([line['error'] for line in lines][2:5],
+                         ['Account not found', 'Account is not active', 'Amount cannot have more than 2 decimal places'])
+        self.assertTrue(lines[0]['transaction_id'].startswith('TXN'))
+
+    def test_idempotency_key_tells_apart_files_with_the_same_name(self):
+        def upload(content):
+            return self.client.post(
+                '/api/transfer-batches/',
+                {'from_account': 'PAYROLL', 'file': SimpleUploadedFile('payroll.csv', content, content_type='text/csv')},
+                format='multipart', HTTP_IDEMPOTENCY_KEY='payroll-march',
+            )
+
+        first = upload(b'account_number,amount\nEMP001,100.00\n')
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(upload(b'account_number,amount\nEMP001,100.00\n')['Idempotent-Replayed'], 'true')
+        self.assertEqual(upload(b'account_number,amount\nEMP002,900.00\n').status_code, 422)
+        self.assertEqual(TransferBatch.objects.count(), 1)
+
+    def test_destinations_are_validated_with_one_query(self):
+        def submit_queries(count):
+            lines = [(f'EMP00{1 + index % 3}', '1.00') for index in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                batch_transfers.submit('PAYROLL', lines)
+            return [q['sql'] for q in queries.captured_queries if 'FROM "accounts"' in q['sql']]
+
+        self.assertEqual(len(submit_queries(3)), 2)  # the source account, then every destination
+        self.assertEqual(len(submit_queries(300)), 2)
+
+    def test_line_rejected_while_posting_is_refunded(self):
+        batch = batch_transfers.submit('PAYROLL', [('EMP001', '100'), ('EMP002', '200'), ('EMP003', '300')])
+        Account.objects.filter(account_number='EMP003').update(status='CLOSED')
+
+        batch = batch_transfers.process(batch.pk)
+        self.assertEqual(batch.status, 'COMPLETED')
+        self.assertEqual((batch.credited_lines, batch.rejected_lines), (2, 1))
+        self.assertEqual((batch.credited_amount, batch.refunded_amount), (Decimal('300.00'), Decimal('300.00')))
+        self.assertEqual(self.balance('PAYROLL'), Decimal('700.00'))
+        self.assertEqual(batch.lines.get(account_number='EMP003').error, 'Account is not active')
+
+        # Finished batches are left alone
+        self.assertEqual(batch_transfers.process(batch.pk).credited_lines, 2)
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_unfunded_batch_fails_without_credits(self):
+        response = self.client.post('/api/transfer-batches/', {
+            'from_account': 'PAYROLL',
+            'lines': [{'account_number': 'EMP001', 'amount': '600'}, {'account_number': 'EMP002', 'amount': '600'}],
+        }, format='json')
+        self.assertEqual(response.data['status'], 'FAILED')
+        self.assertEqual(response.data['error'], 'Insufficient balance')
+        self.assertEqual(self.balance('PAYROLL'), Decimal('1000.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+        outsider = APIClient()
+        outsider.force_authenticate(User.objects.get(username='employee'))
+        response = outsider.post('/api/transfer-batches/', {
+            'from_account': 'PAYROLL', 'lines': [{'account_number': 'EMP001', 'amount': '1'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(outsider.get('/api/transfer-batches/').data['count'], 0)
+        self.assertEqual(TransferBatch.objects.count(), 1)
+
+
+class BatchBalanceTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.first = make_account(self.customer, 'ACC001', '100.00')
+        self.second = make_account(self.customer, 'ACC002', '20.50', status='FROZEN')
+        _, other = make_customer('other')
+        make_account(other, 'OTHER01', '999.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_answers_many_accounts_with_one_query_scoped_to_the_caller(self):
+        striping.set_stripe_count(self.first, 4)
+        posting.deposit('ACC001', '5.00')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f'/api/accounts/balances/?account_numbers=ACC001,OTHER01,NOPE&ids={self.second.pk}'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([q for q in queries.captured_queries if 'FROM "accounts"' in q['sql']]), 1)
+
+        results = response.json()['results']
+        self.assertEqual([row['account_number'] for row in results], ['ACC001', 'ACC002'])
+        self.assertEqual(Decimal(str(results[0]['balance'])), Decimal('105.00'))
+        self.assertEqual((results[1]['status'], Decimal(str(results[1]['balance']))), ('FROZEN', Decimal('20.50')))
+        self.assertEqual(response.json()['not_found'], ['OTHER01', 'NOPE'])
+
+    def test_rejects_missing_bad_and_oversized_requests(self):
+        self.assertEqual(self.client.get('/api/accounts/balances/').status_code, 400)
+        self.assertEqual(self.client.get('/api/accounts/balances/?ids=1,x').status_code, 400)
+        numbers = ','.join(f'ACC{index:03d}' for index in range(101))
+        self.assertEqual(self.client.get(f'/api/accounts/balances/?account_numbers={numbers}').status_code, 400)
+
+
+class ValuesSerializerTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        make_account(self.customer, 'ACC001', '1000.00')
+        make_account(self.customer, 'ACC002')
+        posting.deposit('ACC001', '0.10', user=self.user)
+        posting.transfer('ACC001', 'ACC002', '250.55', description='Rent')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_rows_render_exactly_like_the_model_serializer(self):
+        transactions = Transaction.objects.select_related('account').order_by('id')
+        for zone in ('UTC', 'Africa/Nairobi'):
+            with timezone.override(zone):
+                expected = [list(row.items()) for row in TransactionSerializer(transactions, many=True).data]
+                rows = TransactionRowSerializer.to_dicts(TransactionRowSerializer.values_list(transactions))
+                self.assertEqual([list(row.items()) for row in rows], expected)
+
+    def test_list_and_statement_serve_the_same_rows(self):
+        expected = [dict(row) for row in TransactionSerializer(
+            Transaction.objects.order_by('-created_at', '-id'), many=True).data]
+        self.assertEqual(self.client.get('/api/transactions/').json()['results'], json.loads(json.dumps(expected)))
+
+        account = Account.objects.get(account_number='ACC002')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/accounts/{account.pk}/statement/')
+        self.assertEqual([row['description'] for row in response.json()['results']], ['Rent - From ACC001'])
+        # The account is only checked for access, not loaded with its customer and user
+        self.assertFalse(any('JOIN "auth_user"' in q['sql'] for q in queries.captured_queries))
+
+
+class ORJSONRendererTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        make_account(self.customer, 'ACC001', '100.00')
+        posting.deposit('ACC001', '5.00', user=self.user, description='Line\u2028break')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_serializer_pages_render_byte_for_byte_like_json_renderer(self):
+        page = {'next': None, 'results': TransactionSerializer(Transaction.objects.all(), many=True).data}
+        for context in ({}, {'indent': 4}):
+            expected = JSONRenderer().render(page, 'application/json', context)
+            rendered = renderers.ORJSONRenderer().render(page, 'application/json', context)
+            if context:
+                self.assertEqual(json.loads(rendered), json.loads(expected))
+            else:
+                self.assertEqual(rendered, expected)
+        self.assertIn(b'\\u2028', rendered)
+        self.assertEqual(renderers.ORJSONRenderer().render(None), b'')
+
+    def test_raw_decimals_render_as_exact_strings(self):
+        account = Account.objects.get(account_number='ACC001')
+        response = self.client.get(f'/api/accounts/{account.pk}/balance/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()['balance'], '105.00')
+
+    def test_parser_accepts_json_and_rejects_malformed_bodies(self):
+        response = self.client.post('/api/transactions/deposit/', '{"account_number": "ACC001", "amount": 0.1}',
+                                    content_type='application/json')
+        self.assertEqual((response.status_code, response.json()['balance_after']), (201, '105.10'))
+
+        response = self.client.post('/api/transactions/deposit/', '{"account_number": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()['detail'].startswith('JSON parse error'))
+
+
+class MessagePackTests(TestCase):
+    def setUp(self):
+        self.user, self.customer = make_customer()
+        self.account = make_account(self.customer, 'ACC001', '100.00')
+        self.deposit = posting.deposit('ACC001', '0.10', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        return msgpack.unpackb(response.content)
+
+    def test_pages_match_json_with_timestamps_as_epoch_microseconds(self):
+        created_at = renderers.epoch_microseconds(self.deposit.created_at)
+        self.assertEqual(created_at, int(self.deposit.created_at.timestamp() * 1_000_000))
+
+        for url in ('/api/transactions/', f'/api/accounts/{self.account.pk}/statement/'):
+            expected = self.client.get(url).json()['results']
+            results = self.get(url)['results']
+            self.assertEqual(results[0]['created_at'], created_at)
+            self.assertEqual(results[0]['amount'], '0.10')
+            for row in expected:
+                row['created_at'] = created_at
+            self.assertEqual(results, expected)
+
+        detail = self.get(f'/api/transactions/{self.deposit.pk}/')
+        self.assertEqual((detail['created_at'], detail['balance_after']), (created_at, '100.10'))
+        self.assertEqual(self.get(f'/api/accounts/{self.account.pk}/balance/')['balance'], '100.10')
+        self.assertFalse(renderers.epoch_timestamps())
+
+    def test_parses_request_bodies_and_replays_idempotent_responses(self):
+        body = msgpack.packb({'account_number': 'ACC001', 'amount': '5.00'})
+        responses = [
+            self.client.post('/api/transactions/deposit/', body, content_type='application/msgpack',
+                             HTTP_ACCEPT='application/msgpack', HTTP_IDEMPOTENCY_KEY='msgpack-1')
+            for _ in range(2)
+        ]
+        self.assertEqual([response.status_code for response in responses], [201, 201])
+        first, replay = (msgpack.unpackb(response.content) for response in responses)
+        self.assertEqual(first['balance_after'], '105.10')
+        self.assertIsInstance(first['created_at'], int)
+        self.assertEqual(replay, first)
+        # A JSON retry would be replayed with epoch timestamps, so the key is refused instead
+        response = self.client.post('/api/transactions/deposit/', body, content_type='application/msgpack',
+                                    HTTP_IDEMPOTENCY_KEY='msgpack-1')
+        self.assertEqual(response.status_code, 422)
+
+        response = self.client.post('/api/transactions/deposit/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
@@ -10,6 +10,7 @@ router.register(r'transactions', views.TransactionViewSet)
 router.register(r'loans', views.LoanViewSet)
 router.register(r'cards', views.CardViewSet)
 router.register(r'loan-payments', views.LoanPaymentViewSet)
+router.register(r'transfer-batches', views.TransferBatchViewSet)
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -17,4 +18,5 @@ urlpatterns = [
     path('api/register/', views.register, name='register'),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
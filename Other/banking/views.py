@@ -1,254 +1,281 @@
 from django.shortcuts import render
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.contrib.auth.models import User
+from django.db.models import Q
+from django.http import HttpResponse
 from django.utils import timezone
-from decimal import Decimal
-import random
-import string
+from django.utils.dateparse import parse_date
 
-from .models import Customer, Account, Transaction, Loan, Card, LoanPayment
+from . import (
+    aging, amortization, batch_transfers, exports, group_commit, metrics, posting, repayments, snapshots, striping,
+)
+from .idempotency import idempotent
+from .posting import PostingError
+from .renderers import EpochTimestampsMixin
+from .routing import ReplicaReadMixin
+from .pagination import KeysetPagination, StatementPagination
+from .models import Customer, Account, Transaction, Loan, Card, LoanPayment, TransferBatch
 from .serializers import (
     CustomerSerializer, AccountSerializer, TransactionSerializer,
-    LoanSerializer, CardSerializer, LoanPaymentSerializer, RegisterSerializer
+    LoanSerializer, CardSerializer, LoanPaymentSerializer, TransferBatchSerializer, RegisterSerializer,
+    TransactionRowSerializer,
 )
 
 
-class CustomerViewSet(viewsets.ModelViewSet):
+def model_fields(model):
+    """Names of a model's own columns, for use in a query plan's only()."""
+    return tuple(field.name for field in model._meta.concrete_fields)
+
+
+class QueryPlanMixin:
+    """
+    Declares how a viewset loads its rows. ``select_related_fields`` lists the
+    relations its serializer walks and ``only_fields`` the columns it reads, so a
+    page of N rows costs one query instead of 1 + N (or 1 + 2N). get_queryset()
+    builds on get_base_queryset() so lists, detail views and actions share it.
+    """
+    select_related_fields = ()
+    only_fields = ()
+    
+    def get_base_queryset(self):
+        queryset = self.queryset.model._default_manager.all()
+        if self.select_related_fields:
+            queryset = queryset.select_related(*self.select_related_fields)
+        if self.only_fields:
+            queryset = queryset.only(*self.only_fields)
+        return queryset
+
+
+class CustomerViewSet(EpochTimestampsMixin, ReplicaReadMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [IsAuthenticated]
+    select_related_fields = ('user',)
+    only_fields = model_fields(Customer) + (
+        'user__username', 'user__email', 'user__first_name', 'user__last_name',
+    )
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Customer.objects.all()
-        return Customer.objects.filter(user=self.request.user)
+            return self.get_base_queryset()
+        return self.get_base_queryset().filter(user=self.request.user)
 
 
-class AccountViewSet(viewsets.ModelViewSet):
+class AccountViewSet(EpochTimestampsMixin, ReplicaReadMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
     permission_classes = [IsAuthenticated]
+    select_related_fields = ('customer__user',)
+    only_fields = model_fields(Account) + ('customer__user__first_name', 'customer__user__last_name')
+    replica_actions = ('list', 'retrieve', 'balance', 'balances', 'statement', 'balance_at')
+    max_balance_lookups = 100
+    
+    def get_base_queryset(self):
+        # The serializer's consolidated balance reads the annotation, not one aggregate per striped account
+        return super().get_base_queryset().annotate(stripe_balance=striping.stripe_total())
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Account.objects.all()
+            return self.get_base_queryset()
         try:
             customer = self.request.user.customer_profile
-            return Account.objects.filter(customer=customer)
+            return self.get_base_queryset().filter(customer=customer)
         except:
-            return Account.objects.none()
+            return self.get_base_queryset().none()
+    
+    def balance_rows(self):
+        """The caller's accounts as dicts with their consolidated balance, read with values()"""
+        return self.get_queryset().values('id', 'account_number', 'balance', 'stripe_balance', 'currency', 'status')
     
     @action(detail=True, methods=['get'])
     def balance(self, request, pk=None):
+        row = get_object_or_404(self.balance_rows(), pk=pk)
+        return Response({
+            'account_number': row['account_number'],
+            'balance': row['balance'] + row['stripe_balance'],
+            'currency': row['currency'],
+            'status': row['status']
+        })
+    
+    @action(detail=False, methods=['get'])
+    def balances(self, request):
+        """
+        Balances of several accounts in one request and one query, for gateways:
+        ?account_numbers=A,B and/or ?ids=1,2 (up to max_balance_lookups in all).
+        Accounts that do not exist or are not the caller's are listed in not_found.
+        """
+        numbers = [number for number in request.query_params.get('account_numbers', '').split(',') if number]
+        try:
+            pks = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk]
+        except ValueError:
+            return Response({'error': 'ids must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not numbers and not pks:
+            return Response({'error': 'account_numbers or ids is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(numbers) + len(pks) > self.max_balance_lookups:
+            return Response({'error': f'At most {self.max_balance_lookups} accounts per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        rows = list(self.balance_rows().filter(Q(account_number__in=numbers) | Q(pk__in=pks)))
+        by_number = {row['account_number']: row for row in rows}
+        by_pk = {row['id']: row for row in rows}
+        
+        results, not_found = [], []
+        for key, row in [(number, by_number.get(number)) for number in numbers] + [(pk, by_pk.get(pk)) for pk in pks]:
+            if row is None:
+                not_found.append(key)
+                continue
+            results.append({
+                'id': row['id'],
+                'account_number': row['account_number'],
+                'balance': row['balance'] + row['stripe_balance'],
+                'currency': row['currency'],
+                'status': row['status']
+            })
+        return Response({'results': results, 'not_found': not_found})
+    
+    @action(detail=True, methods=['get'])
+    def statement(self, request, pk=None):
+        account_pk = get_object_or_404(self.get_queryset().values_list('pk', flat=True), pk=pk)
+        paginator = StatementPagination()
+        rows = paginator.paginate_queryset(
+            TransactionRowSerializer.values_list(Transaction.objects.filter(account_id=account_pk), named=True),
+            request, view=self,
+        )
+        return paginator.get_paginated_response(TransactionRowSerializer.to_dicts(rows))
+    
+    @action(detail=True, methods=['get'], url_path='balance-at')
+    def balance_at(self, request, pk=None):
+        """End-of-day balance on ?date=YYYY-MM-DD, served from the daily snapshots."""
         account = self.get_object()
+        try:
+            day = parse_date(request.query_params.get('date', ''))
+        except ValueError:  # well formed but impossible, e.g. 2024-02-30
+            day = None
+        if day is None:
+            return Response({'error': 'date is required (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        balance, source = snapshots.balance_on(account, day)
         return Response({
             'account_number': account.account_number,
-            'balance': account.balance,
+            'date': day,
+            'balance': balance,
             'currency': account.currency,
-            'status': account.status
+            'source': source
         })
     
-    @action(detail=True, methods=['get'])
-    def statement(self, request, pk=None):
+    @action(detail=True, methods=['get'], url_path='statement/export')
+    def statement_export(self, request, pk=None):
+        """Stream the statement for ?from=/&to= (YYYY-MM-DD) as ?output=csv or ndjson."""
         account = self.get_object()
-        transactions = account.transactions.all()[:20]
-        serializer = TransactionSerializer(transactions, many=True)
-        return Response(serializer.data)
+        start, end = exports.parse_date_range(request)
+        output = exports.get_output_format(request)
+        return exports.streaming_export(
+            exports.STATEMENT_COLUMNS,
+            exports.statement_rows(account, start, end),
+            output,
+            f"statement-{account.account_number}",
+        )
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(EpochTimestampsMixin, ReplicaReadMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
+    select_related_fields = ('account',)
+    only_fields = model_fields(Transaction) + ('account__account_number',)
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Transaction.objects.all()
+            return self.get_base_queryset()
         try:
             customer = self.request.user.customer_profile
             accounts = customer.accounts.all()
-            return Transaction.objects.filter(account__in=accounts)
+            return self.get_base_queryset().filter(account__in=accounts)
         except:
-            return Transaction.objects.none()
+            return self.get_base_queryset().none()
+    
+    def list(self, request, *args, **kwargs):
+        # Ledger pages are read as tuples and mapped to dicts (banking/fast_serializers.py)
+        queryset = TransactionRowSerializer.values_list(self.filter_queryset(self.get_queryset()), named=True)
+        rows = self.paginate_queryset(queryset)
+        return self.get_paginated_response(TransactionRowSerializer.to_dicts(rows))
     
     @action(detail=False, methods=['post'])
+    @idempotent
     def deposit(self, request):
-        account_number = request.data.get('account_number')
-        amount = Decimal(request.data.get('amount', 0))
-        description = request.data.get('description', 'Deposit')
-        
+        post_deposit = group_commit.deposit if group_commit.is_enabled() else posting.deposit
         try:
-            account = Account.objects.get(account_number=account_number)
-            
-            if account.status != 'ACTIVE':
-                return Response({'error': 'Account is not active'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            if amount <= 0:
-                return Response({'error': 'Amount must be positive'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Create transaction
-            transaction_id = f"TXN{''.join(random.choices(string.ascii_uppercase + string.digits, k=10))}"
-            balance_before = account.balance
-            balance_after = balance_before + amount
-            
-            transaction = Transaction.objects.create(
-                transaction_id=transaction_id,
-                account=account,
-                transaction_type='DEPOSIT',
-                amount=amount,
-                balance_before=balance_before,
-                balance_after=balance_after,
-                description=description,
-                status='COMPLETED',
-                processed_by=request.user
+            transaction = post_deposit(
+                request.data.get('account_number'),
+                request.data.get('amount', 0),
+                description=request.data.get('description', 'Deposit'),
+                user=request.user,
             )
-            
-            # Update account balance
-            account.balance = balance_after
-            account.save()
-            
-            serializer = TransactionSerializer(transaction)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-            
-        except Account.DoesNotExist:
-            return Response({'error': 'Account not found'}, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except PostingError as e:
+            return Response({'error': e.message}, status=e.status_code)
+        
+        serializer = TransactionSerializer(transaction)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
     
     @action(detail=False, methods=['post'])
+    @idempotent
     def withdraw(self, request):
-        account_number = request.data.get('account_number')
-        amount = Decimal(request.data.get('amount', 0))
-        description = request.data.get('description', 'Withdrawal')
-        
         try:
-            account = Account.objects.get(account_number=account_number)
-            
-            if account.status != 'ACTIVE':
-                return Response({'error': 'Account is not active'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            if amount <= 0:
-                return Response({'error': 'Amount must be positive'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            if account.balance < amount:
-                return Response({'error': 'Insufficient balance'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Create transaction
-            transaction_id = f"TXN{''.join(random.choices(string.ascii_uppercase + string.digits, k=10))}"
-            balance_before = account.balance
-            balance_after = balance_before - amount
-            
-            transaction = Transaction.objects.create(
-                transaction_id=transaction_id,
-                account=account,
-                transaction_type='WITHDRAWAL',
-                amount=amount,
-                balance_before=balance_before,
-                balance_after=balance_after,
-                description=description,
-                status='COMPLETED',
-                processed_by=request.user
+            transaction = posting.withdraw(
+                request.data.get('account_number'),
+                request.data.get('amount', 0),
+                description=request.data.get('description', 'Withdrawal'),
+                user=request.user,
             )
-            
-            # Update account balance
-            account.balance = balance_after
-            account.save()
-            
-            serializer = TransactionSerializer(transaction)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-            
-        except Account.DoesNotExist:
-            return Response({'error': 'Account not found'}, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except PostingError as e:
+            return Response({'error': e.message}, status=e.status_code)
+        
+        serializer = TransactionSerializer(transaction)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
     
     @action(detail=False, methods=['post'])
+    @idempotent
     def transfer(self, request):
-        from_account_number = request.data.get('from_account')
-        to_account_number = request.data.get('to_account')
-        amount = Decimal(request.data.get('amount', 0))
-        description = request.data.get('description', 'Transfer')
-        
         try:
-            from_account = Account.objects.get(account_number=from_account_number)
-            to_account = Account.objects.get(account_number=to_account_number)
-            
-            if from_account.status != 'ACTIVE' or to_account.status != 'ACTIVE':
-                return Response({'error': 'One or both accounts are not active'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            if amount <= 0:
-                return Response({'error': 'Amount must be positive'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            if from_account.balance < amount:
-                return Response({'error': 'Insufficient balance'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Debit from source account
-            transaction_id_debit = f"TXN{''.join(random.choices(string.ascii_uppercase + string.digits, k=10))}"
-            from_balance_before = from_account.balance
-            from_balance_after = from_balance_before - amount
-            
-            debit_transaction = Transaction.objects.create(
-                transaction_id=transaction_id_debit,
-                account=from_account,
-                transaction_type='TRANSFER',
-                amount=amount,
-                balance_before=from_balance_before,
-                balance_after=from_balance_after,
-                description=f"{description} - To {to_account_number}",
-                status='COMPLETED',
-                processed_by=request.user
-            )
-            
-            from_account.balance = from_balance_after
-            from_account.save()
-            
-            # Credit to destination account
-            transaction_id_credit = f"TXN{''.join(random.choices(string.ascii_uppercase + string.digits, k=10))}"
-            to_balance_before = to_account.balance
-            to_balance_after = to_balance_before + amount
-            
-            credit_transaction = Transaction.objects.create(
-                transaction_id=transaction_id_credit,
-                account=to_account,
-                transaction_type='TRANSFER',
-                amount=amount,
-                balance_before=to_balance_before,
-                balance_after=to_balance_after,
-                description=f"{description} - From {from_account_number}",
-                status='COMPLETED',
-                processed_by=request.user
+            debit_transaction, credit_transaction = posting.transfer(
+                request.data.get('from_account'),
+                request.data.get('to_account'),
+                request.data.get('amount', 0),
+                description=request.data.get('description', 'Transfer'),
+                user=request.user,
             )
-            
-            to_account.balance = to_balance_after
-            to_account.save()
-            
-            return Response({
-                'debit_transaction': TransactionSerializer(debit_transaction).data,
-                'credit_transaction': TransactionSerializer(credit_transaction).data
-            }, status=status.HTTP_201_CREATED)
-            
-        except Account.DoesNotExist:
-            return Response({'error': 'Account not found'}, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except PostingError as e:
+            return Response({'error': e.message}, status=e.status_code)
+        
+        return Response({
+            'debit_transaction': TransactionSerializer(debit_transaction).data,
+            'credit_transaction': TransactionSerializer(credit_transaction).data
+        }, status=status.HTTP_201_CREATED)
 
 
-class LoanViewSet(viewsets.ModelViewSet):
+class LoanViewSet(EpochTimestampsMixin, ReplicaReadMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Loan.objects.all()
     serializer_class = LoanSerializer
     permission_classes = [IsAuthenticated]
+    select_related_fields = ('account', 'customer__user')
+    only_fields = model_fields(Loan) + (
+        'account__account_number', 'customer__user__first_name', 'customer__user__last_name',
+    )
+    replica_actions = ('list', 'retrieve', 'amortization', 'aging_summary')
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Loan.objects.all()
+            return self.get_base_queryset()
         try:
             customer = self.request.user.customer_profile
-            return Loan.objects.filter(customer=customer)
+            return self.get_base_queryset().filter(customer=customer)
         except:
-            return Loan.objects.none()
+            return self.get_base_queryset().none()
     
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
@@ -265,13 +292,9 @@ class LoanViewSet(viewsets.ModelViewSet):
         loan.approved_by = request.user
         loan.outstanding_balance = loan.principal_amount
         
-        # Calculate monthly payment (simple calculation)
-        monthly_rate = loan.interest_rate / 100 / 12
-        if monthly_rate > 0:
-            loan.monthly_payment = (loan.principal_amount * monthly_rate * (1 + monthly_rate) ** loan.term_months) / \
-                                   ((1 + monthly_rate) ** loan.term_months - 1)
-        else:
-            loan.monthly_payment = loan.principal_amount / loan.term_months
+        loan.monthly_payment = amortization.monthly_payment(
+            loan.principal_amount, loan.interest_rate, loan.term_months
+        )
         
         loan.save()
         
@@ -279,6 +302,7 @@ class LoanViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
+    @idempotent
     def disburse(self, request, pk=None):
         loan = self.get_object()
         
@@ -288,65 +312,163 @@ class LoanViewSet(viewsets.ModelViewSet):
         if loan.status != 'APPROVED':
             return Response({'error': 'Loan must be approved first'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Disburse to account
-        transaction_id = f"TXN{''.join(random.choices(string.ascii_uppercase + string.digits, k=10))}"
-        balance_before = loan.account.balance
-        balance_after = balance_before + loan.principal_amount
-        
-        transaction = Transaction.objects.create(
-            transaction_id=transaction_id,
-            account=loan.account,
-            transaction_type='LOAN_DISBURSEMENT',
-            amount=loan.principal_amount,
-            balance_before=balance_before,
-            balance_after=balance_after,
-            description=f"Loan disbursement - {loan.loan_id}",
-            status='COMPLETED',
-            processed_by=request.user
-        )
+        try:
+            loan, transaction = posting.disburse_loan(loan, user=request.user)
+        except PostingError as e:
+            return Response({'error': e.message}, status=e.status_code)
         
-        loan.account.balance = balance_after
-        loan.account.save()
+        return Response({
+            'loan': LoanSerializer(loan).data,
+            'transaction': TransactionSerializer(transaction).data
+        })
+    
+    @action(detail=True, methods=['post'])
+    @idempotent
+    def repay(self, request, pk=None):
+        loan = self.get_object()
         
-        loan.status = 'DISBURSED'
-        loan.disbursement_date = timezone.now()
-        loan.save()
+        try:
+            loan, payment = repayments.repay_loan(loan, request.data.get('amount'), user=request.user)
+        except PostingError as e:
+            return Response({'error': e.message}, status=e.status_code)
         
         return Response({
             'loan': LoanSerializer(loan).data,
-            'transaction': TransactionSerializer(transaction).data
+            'payment': LoanPaymentSerializer(payment).data
         })
+    
+    @action(detail=False, methods=['get'])
+    def amortization(self, request):
+        """Projected principal and interest income of the loan book, per month, from ?from=YYYY-MM"""
+        if not request.user.is_staff:
+            return Response({'error': 'Only staff can view portfolio projections'}, status=status.HTTP_403_FORBIDDEN)
+        
+        month = request.query_params.get('from')
+        if month:
+            try:
+                from_month = parse_date(f'{month}-01')
+            except ValueError:  # well formed but impossible, e.g. 2024-13
+                from_month = None
+            if from_month is None:
+                return Response({'error': 'Use the YYYY-MM format for from'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            from_month = timezone.localdate().replace(day=1)
+        
+        return Response(amortization.project_portfolio(from_month))
+    
+    @action(detail=False, methods=['get'], url_path='aging')
+    def aging_summary(self, request):
+        """Loans, arrears and outstanding balance per delinquency bucket, from the nightly aging (?as_of=YYYY-MM-DD)"""
+        if not request.user.is_staff:
+            return Response({'error': 'Only staff can view loan aging'}, status=status.HTTP_403_FORBIDDEN)
+        
+        as_of = request.query_params.get('as_of')
+        day = None
+        if as_of:
+            try:
+                day = parse_date(as_of)
+            except ValueError:  # well formed but impossible, e.g. 2024-02-30
+                pass
+            if day is None:
+                return Response({'error': 'Use the YYYY-MM-DD format for as_of'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(aging.bucket_summary(day))
+    
+    @action(detail=False, methods=['get'], url_path='amortization/export')
+    def amortization_export(self, request):
+        """Stream the full amortization schedule of every disbursed or active loan"""
+        if not request.user.is_staff:
+            return Response({'error': 'Only staff can export amortization schedules'}, status=status.HTTP_403_FORBIDDEN)
+        
+        output = exports.get_output_format(request)
+        return exports.streaming_export(
+            amortization.SCHEDULE_COLUMNS, amortization.schedule_rows(), output, 'amortization-schedules'
+        )
 
 
-class CardViewSet(viewsets.ModelViewSet):
+class CardViewSet(EpochTimestampsMixin, ReplicaReadMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Card.objects.all()
     serializer_class = CardSerializer
     permission_classes = [IsAuthenticated]
+    select_related_fields = ('account',)
+    only_fields = model_fields(Card) + ('account__account_number',)
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Card.objects.all()
+            return self.get_base_queryset()
         try:
             customer = self.request.user.customer_profile
             accounts = customer.accounts.all()
-            return Card.objects.filter(account__in=accounts)
+            return self.get_base_queryset().filter(account__in=accounts)
         except:
-            return Card.objects.none()
+            return self.get_base_queryset().none()
 
 
-class LoanPaymentViewSet(viewsets.ModelViewSet):
+class LoanPaymentViewSet(EpochTimestampsMixin, ReplicaReadMixin, QueryPlanMixin, viewsets.ModelViewSet):
     queryset = LoanPayment.objects.all()
     serializer_class = LoanPaymentSerializer
     permission_classes = [IsAuthenticated]
+    select_related_fields = ('loan',)
+    only_fields = model_fields(LoanPayment) + ('loan__loan_id',)
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return LoanPayment.objects.all()
+            return self.get_base_queryset()
         try:
             customer = self.request.user.customer_profile
-            return LoanPayment.objects.filter(loan__customer=customer)
+            return self.get_base_queryset().filter(loan__customer=customer)
         except:
-            return LoanPayment.objects.none()
+            return self.get_base_queryset().none()
+
+
+class TransferBatchViewSet(EpochTimestampsMixin, ReplicaReadMixin, QueryPlanMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = TransferBatch.objects.all()
+    serializer_class = TransferBatchSerializer
+    permission_classes = [IsAuthenticated]
+    select_related_fields = ('source_account',)
+    only_fields = model_fields(TransferBatch) + ('source_account__account_number',)
+    replica_actions = ()  # progress is polled while the batch runs, so read it from the primary
+    
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return self.get_base_queryset()
+        return self.get_base_queryset().filter(source_account__customer__user=self.request.user)
+    
+    @idempotent
+    def create(self, request):
+        """
+        Upload a batch of credits funded from ``from_account``: a CSV or JSON
+        ``file`` (multipart), or a JSON body with ``lines``. Answers 202 with
+        the batch; poll it for progress and fetch ``results/`` when done.
+        """
+        upload = request.FILES.get('file')
+        try:
+            if upload is not None:
+                lines = batch_transfers.read_file(upload)
+            else:
+                lines = batch_transfers.read_records(request.data.get('lines'))
+            batch = batch_transfers.submit(
+                request.data.get('from_account'),
+                lines,
+                description=request.data.get('description') or 'Batch transfer',
+                user=request.user,
+                owner=None if request.user.is_staff else request.user,
+            )
+        except PostingError as e:
+            return Response({'error': e.message}, status=e.status_code)
+        
+        batch = batch_transfers.start(batch)
+        return Response(TransferBatchSerializer(batch).data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['get'])
+    def results(self, request, pk=None):
+        """Stream the outcome of every line of the batch as ?output=csv or ndjson"""
+        batch = self.get_object()
+        output = exports.get_output_format(request)
+        return exports.streaming_export(
+            batch_transfers.RESULT_COLUMNS, batch_transfers.result_rows(batch), output,
+            f"transfer-batch-{batch.batch_id}",
+        )
 
 
 @api_view(['POST'])
@@ -363,6 +485,14 @@ def register(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def metrics_view(request):
+    """Prometheus scrape endpoint; requires 'Authorization: Bearer <token>' when WEKEZA_METRICS['TOKEN'] is set"""
+    token = metrics.get_config()['TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def index(request):
     """Main landing page"""
     return render(request, 'banking/index.html')
@@ -419,8 +419,8 @@ async function loadTransactions(accountId) {
         });
         
         if (response.ok) {
-            const transactions = await response.json();
-            displayTransactions(transactions);
+            const data = await response.json();
+            displayTransactions(data.results || data);
         }
     } catch (error) {
         console.error('Failed to load transactions:', error);